@@ -0,0 +1,47 @@
+# amounts.py
+"""
+Строгий разбор денежных сумм и курсов, введенных пользователем или взятых из выписок.
+Разделители тысяч (пробел, запятая, точка) распознаются только при правильной группировке
+по три цифры; неоднозначные значения (например, «1,000» — тысяча или единица?) отклоняются,
+а не угадываются.
+"""
+import re
+
+_SPACES = re.compile(r"[\s']")
+
+
+def _is_grouped(value: str, separator: str) -> bool:
+    """Число разбито на группы по три цифры заданным разделителем («1,234,567»)."""
+    return re.fullmatch(rf"\d{{1,3}}(?:{re.escape(separator)}\d{{3}})+", value) is not None
+
+
+def parse_amount(text: str) -> float:
+    """
+    Разбирает число со знаком: «1 000,50», «1,234.56», «1.234,56», «-12,5», «0,92», «1,234,567».
+    Бросает ValueError для некорректных и неоднозначных значений («1,000», «1.500», «1,234,56»).
+    """
+    value = _SPACES.sub("", text or "")
+    sign = -1.0 if value.startswith("-") else 1.0
+    value = value.lstrip("+-")
+    if not value or not re.fullmatch(r"[\d.,]+", value) or not value[0].isdigit() or not value[-1].isdigit():
+        raise ValueError(f"Некорректное число: {text}")
+
+    separators = [char for char in value if char in ",."]
+    if not separators:
+        return sign * float(value)
+    decimal_sep = separators[-1]
+    thousands_sep = "." if decimal_sep == "," else ","
+    if separators.count(decimal_sep) > 1:
+        # Один и тот же знак несколько раз — только разделитель тысяч («1,234,567»)
+        if thousands_sep in separators or not _is_grouped(value, decimal_sep):
+            raise ValueError(f"Некорректное число: {text}")
+        return sign * float(value.replace(decimal_sep, ""))
+
+    integer_part, fraction = value.rsplit(decimal_sep, 1)
+    if thousands_sep in integer_part:
+        if not _is_grouped(integer_part, thousands_sep):
+            raise ValueError(f"Некорректное число: {text}")
+        integer_part = integer_part.replace(thousands_sep, "")
+    elif len(fraction) == 3 and not integer_part.startswith("0") and len(integer_part) <= 3:
+        raise ValueError(f"Неоднозначное число: {text}. Уберите разделитель тысяч или укажите дробную часть иначе.")
+    return sign * float(f"{integer_part}.{fraction}")
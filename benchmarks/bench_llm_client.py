@@ -0,0 +1,77 @@
+# benchmarks/bench_llm_client.py
+"""
+Нагрузочная проверка клиента ИИ на локальном бэкенде FakeLLMBackend (без сети).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_llm_client.py --requests 200 --latency 0.2 --concurrency 1 4 16
+
+Для каждого лимита одновременных запросов печатает общее время, пропускную способность
+и статистику клиента. Доля повторяющихся запросов (--duplicates) показывает выигрыш от кэша.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2, help="задержка ответа заглушки, с")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--duplicates", type=float, default=0.3, help="доля запросов, повторяющих уже заданные")
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="доля вызовов с временной ошибкой")
+    return parser.parse_args()
+
+
+async def run(args, concurrency: int):
+    from llm_client import LLMClient, FakeLLMBackend, LLMError, LLMTransientError
+
+    rnd = random.Random(42)
+
+    class FlakyBackend(FakeLLMBackend):
+        async def generate(self, prompt):
+            if rnd.random() < args.failure_rate:
+                self.calls += 1
+                await asyncio.sleep(self.latency)
+                raise LLMTransientError("flaky")
+            return await super().generate(prompt)
+
+    backend = FlakyBackend(responder=lambda prompt: '{"total_sum": 1}', latency=args.latency)
+    client = LLMClient(backend, max_concurrency=concurrency, timeout=600, retry_base_delay=0.05)
+
+    prompts = []
+    for i in range(args.requests):
+        prompts.append(rnd.choice(prompts) if prompts and rnd.random() < args.duplicates else f"Чек №{i}")
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(client.generate(prompt) for prompt in prompts), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+
+    stats = client.get_stats()
+    failed = sum(isinstance(result, LLMError) for result in results)
+    print(
+        f"{concurrency}\t{elapsed:.2f}\t{args.requests / elapsed:.1f}\t{stats['cache_hits'] + stats['coalesced']}\t"
+        f"{stats['backend_calls']}\t{stats['retries']}\t{failed}\t{stats['latency_seconds_avg']:.2f}"
+    )
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ.setdefault("OWNER_TELEGRAM_ID", "1")
+    os.environ["LLM_BACKEND"] = "fake"
+    sys.path.insert(0, os.getcwd())
+    import logging
+    logging.disable(logging.WARNING)
+
+    print("лимит\tвремя, с\tзапр/с\tиз кэша\tвызовов\tповторов\tошибок\tзадержка, с")
+    for concurrency in args.concurrency:
+        asyncio.run(run(args, concurrency))
+
+
+if __name__ == "__main__":
+    main()
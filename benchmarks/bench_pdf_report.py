@@ -0,0 +1,87 @@
+# benchmarks/bench_pdf_report.py
+"""
+Сравнение PDF-движков отчетов: время рендеринга и пиковый RSS.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_pdf_report.py --rows 1000 5000 20000
+
+Каждый замер выполняется в отдельном процессе, чтобы пиковая память
+одного движка не влияла на результат другого.
+"""
+import argparse
+import datetime
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+ENGINES = {
+    "legacy": "render_pdf_report",
+    "paginated": "render_pdf_report_paginated",
+}
+
+
+def make_transactions(count: int) -> list[tuple]:
+    rnd = random.Random(42)
+    start = datetime.datetime(2023, 1, 1)
+    rows = []
+    for i in range(count):
+        t_date = start + datetime.timedelta(minutes=37 * (count - i))
+        t_type = "income" if rnd.random() < 0.3 else "expense"
+        description = "Чек от 01.01.2024\n- Хлеб (1.0 шт x 5,000.00) = 5,000.00 сум" if i % 20 == 0 else f"Покупка №{i}"
+        rows.append((i + 1, t_date.strftime("%Y-%m-%d %H:%M:%S"), t_type, round(rnd.uniform(1, 500000), 2), "Продукты", description))
+    return rows
+
+
+def run_single(engine: str, count: int):
+    """Выполняет один замер в текущем процессе и печатает результат одной строкой."""
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ.setdefault("OWNER_TELEGRAM_ID", "1")
+    sys.path.insert(0, os.getcwd())
+    import logging
+    import reports
+    logging.disable(logging.INFO)
+
+    rows = make_transactions(count)
+    total_income = sum(r[3] for r in rows if r[2] == "income")
+    total_expense = sum(r[3] for r in rows if r[2] == "expense")
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    try:
+        content = getattr(reports, ENGINES[engine])(rows, "Бенчмарк", "UZS", total_income, total_expense)
+        status = f"{len(content) / 1024:.0f} KiB"
+    except Exception as e:
+        status = f"ошибка: {type(e).__name__}"
+    elapsed = time.perf_counter() - started
+
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{engine}\t{count}\t{elapsed:.2f}\t{rss_peak / 1024:.0f}\t{(rss_peak - rss_before) / 1024:.0f}\t{status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument("--single", nargs=2, metavar=("ENGINE", "ROWS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        run_single(args.single[0], int(args.single[1]))
+        return
+
+    print("движок\tстрок\tвремя, с\tпик RSS, МиБ\tприрост RSS, МиБ\tрезультат")
+    for count in args.rows:
+        for engine in args.engines:
+            result = subprocess.run(
+                [sys.executable, __file__, "--single", engine, str(count)],
+                capture_output=True, text=True
+            )
+            print(result.stdout.strip() or f"{engine}\t{count}\tпроцесс завершился с кодом {result.returncode}: {result.stderr.strip()[-200:]}")
+
+
+if __name__ == "__main__":
+    main()
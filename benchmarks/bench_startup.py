@@ -0,0 +1,77 @@
+# benchmarks/bench_startup.py
+"""
+Время импорта main.py (то, что бот тратит до начала опроса Telegram).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_startup.py --runs 5 --top 15 --max-seconds 3
+
+Каждый прогон — отдельный процесс `python -X importtime -c "import main"`.
+Печатает медиану и худшее время и самые медленные модули, которые импортирует сам main
+(вместе с их зависимостями), по последнему прогону.
+С --max-seconds завершается с кодом 1, если медиана превышает порог (для CI).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="сколько самых медленных модулей показать")
+    parser.add_argument("--max-seconds", type=float, default=None, help="допустимая медиана, с")
+    return parser.parse_args()
+
+
+def import_once(env) -> tuple[float, str]:
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    return time.perf_counter() - started, result.stderr
+
+
+def slowest_modules(importtime_log: str, top: int) -> list[tuple[int, str]]:
+    # Строки вида "import time: self [us] | cumulative | imported package"; уровень вложенности —
+    # отступ имени по два пробела. Прямые импорты main имеют отступ ровно в два пробела.
+    modules = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name[1:]
+        if not name.startswith("  ") or name.startswith("   "):
+            continue
+        modules.append((int(cumulative), name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main():
+    args = parse_args()
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+    env.setdefault("GEMINI_API_KEY", "benchmark")
+    env.setdefault("OWNER_TELEGRAM_ID", "1")
+
+    timings, log = [], ""
+    for _ in range(args.runs):
+        elapsed, log = import_once(env)
+        timings.append(elapsed)
+
+    median = statistics.median(timings)
+    print(f"import main: медиана {median:.2f} с, худшее {max(timings):.2f} с ({args.runs} прогонов)")
+    print("\nмодуль\tвместе с зависимостями, с")
+    for cumulative_us, name in slowest_modules(log, args.top):
+        print(f"{name}\t{cumulative_us / 1e6:.3f}")
+
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f"\nМедиана {median:.2f} с превышает порог {args.max_seconds:.2f} с")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
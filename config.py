@@ -22,11 +22,77 @@ if not GEMINI_API_KEY:
     logger.critical("КРИТИЧЕСКАЯ ОШИБКА: Не найден GEMINI_API_KEY. Проверьте ваш .env файл.")
     exit(1)
 
+# Бэкенд ИИ: "gemini" (по умолчанию) или "fake" — локальная заглушка для тестов и бенчмарков без сети
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+LLM_MODEL_NAME = "gemini-1.5-flash-latest"
+LLM_MAX_CONCURRENCY = 4 # Сколько запросов к ИИ выполняется одновременно
+LLM_TIMEOUT_SECONDS = 30 # Общий срок на запрос к ИИ, включая повторы
+LLM_MAX_ATTEMPTS = 3 # Сколько раз пробовать запрос при временных ошибках
+LLM_RETRY_BASE_DELAY = 0.5 # Базовая пауза перед повтором, с (растет экспоненциально, со случайным разбросом)
+LLM_CACHE_MAX_ENTRIES = 256 # Сколько ответов ИИ хранить в кэше по хешу запроса
+
+# Адрес, по которому опубликован qr_scanner.html (HTTPS). Если не задан, кнопка сканера WebApp не показывается.
+QR_SCANNER_WEBAPP_URL = os.getenv("QR_SCANNER_WEBAPP_URL")
+
 
 EMBEDDING_MODEL_NAME = "models/embedding-001" # Заглушка, если не используется
 DB_NAME = "ai_agent_database.db"
+SCHEDULER_JOBS_DB = "scheduler_jobs.db" # Отдельная SQLite-база для заданий планировщика (напоминаний)
 USER_TIMEZONE_STR = "Asia/Tashkent"
 
+# Автоархивация старых планов
+ARCHIVE_AFTER_DAYS = 7 # Планы с датой старше стольких дней переносятся в архив
+ARCHIVE_BATCH_SIZE = 1000 # Ширина диапазона id, обрабатываемого одной короткой транзакцией
+ARCHIVE_PAUSE_SECONDS = 0.05 # Пауза между пачками, чтобы обработчики успевали писать в БД
+ARCHIVE_PAGE_SIZE = 20 # Сколько архивных планов показывать на одной странице
+
+# Скользящее окно напоминаний: задания планировщика создаются только для ближайших напоминаний
+REMINDER_HORIZON_HOURS = 24 # На сколько часов вперед создавать задания напоминаний
+REMINDER_WINDOW_REFRESH_MINUTES = 30 # Как часто дополнять окно (должно быть заметно меньше горизонта)
+REMINDER_MISFIRE_GRACE_SECONDS = 300 # Насколько позже срока напоминание еще отправляется (например, после перезапуска)
+REMINDER_PREFETCH_SECONDS = 60 # При срабатывании напоминания заодно загружаются те, что сработают в ближайшие N секунд
+REMINDER_PREFETCH_LIMIT = 500 # Максимум напоминаний, загружаемых заранее одним запросом
+REMINDER_COALESCE_SECONDS = 1.0 # Напоминания одного пользователя, сработавшие в пределах этого окна, приходят одним сообщением
+REMINDER_SEND_MAX_ATTEMPTS = 3 # Попыток отправить напоминание при временных ошибках Telegram
+REMINDER_SEND_RETRY_BASE_DELAY = 2.0 # Пауза перед первым повтором, с (дальше удваивается)
+REMINDER_REDELIVERY_INTERVAL_MINUTES = 15 # Как часто повторно отправлять напоминания из dead-letter таблицы
+REMINDER_REDELIVERY_MAX_SWEEPS = 5 # После стольких неудачных повторных отправок напоминание больше не отправляется
+REMINDER_REDELIVERY_BATCH_SIZE = 50 # Сколько напоминаний повторно отправлять за один запуск
+
+# Фоновая перечанковка документов при смене версии чанкера
+RECHUNK_INTERVAL_MINUTES = 10 # Как часто запускать задачу
+RECHUNK_BATCH_SIZE = 5 # Сколько документов обрабатывать за один запуск
+RECHUNK_PAUSE_SECONDS = 1.0 # Пауза между документами внутри запуска
+RECHUNK_RETRY_BASE_MINUTES = 30 # Задержка перед повтором после первой неудачной перечанковки файла (дальше удваивается)
+RECHUNK_RETRY_MAX_MINUTES = 24 * 60 # Максимальная задержка между повторами
+
+# Пул рендеринга отчетов (PDF/CSV)
+REPORT_WORKERS = 2 # Количество потоков рендеринга
+REPORT_QUEUE_SIZE = 8 # Сколько отчетов может ждать в очереди сверх занятых потоков
+REPORT_STREAM_BATCH_SIZE = 1000 # Сколько строк читать из БД за раз при потоковой выгрузке
+PDF_PAGINATED_THRESHOLD = 300 # С какого числа транзакций PDF рисуется помесячно через LongTable
+REPORT_CACHE_DIR = "report_cache" # Каталог дискового кэша готовых отчетов
+REPORT_CACHE_MAX_BYTES = 200 * 1024 * 1024 # Предельный размер кэша отчетов
+PARQUET_ROW_GROUP_SIZE = 50000 # Строк в одной группе Parquet (столько же читается из БД за раз)
+HTTP_POOL_LIMIT = 50 # Всего открытых соединений в общем HTTP-клиенте
+HTTP_POOL_LIMIT_PER_HOST = 10 # Соединений к одному хосту
+HTTP_DNS_CACHE_TTL = 300 # Сколько секунд хранить результаты DNS
+HTTP_CONNECT_TIMEOUT = 10 # Таймаут установки соединения, с
+HTTP_READ_TIMEOUT = 20 # Таймаут чтения ответа (между порциями данных), с
+HTTP_TOTAL_TIMEOUT = 45 # Общий таймаут запроса, с
+QR_DECODE_WORKERS = 2 # Потоков для распознавания QR-кодов
+QR_MIN_PHOTO_SIDE = 300 # Размеры фото Telegram меньше этого (миниатюры) не используются
+QR_MAX_DECODE_SIDE = 1280 # Перед распознаванием изображение уменьшается до этой стороны
+RECEIPT_ALBUM_DEBOUNCE_SECONDS = 1.0 # Сколько ждать остальные фото альбома после последнего полученного
+RECEIPT_ALBUM_CONCURRENCY = 4 # Сколько чеков альбома обрабатывается одновременно
+RECEIPT_CACHE_DIR = "receipt_cache" # Каталог дискового кэша страниц чеков soliq.uz
+RECEIPT_CACHE_MAX_BYTES = 50 * 1024 * 1024 # Предельный размер кэша чеков
+STATEMENT_IMPORT_MAX_BYTES = 10 * 1024 * 1024 # Максимальный размер CSV-выписки для импорта
+FX_BASE_CURRENCY = "USD" # Курсы хранятся как количество единиц валюты за 1 единицу базовой
+FX_CONSOLIDATED_CURRENCY = "UZS" # В какой валюте показывать сводный баланс всех книг
+FX_RATES_FILE = "fx_rates.csv" # Файл курсов (строки "ВАЛЮТА,КУРС"), загружается при старте, если существует
+WARMUP_DELAY_SECONDS = 3 # Через сколько секунд после запуска опроса в фоне загружать тяжелые библиотеки
+
 OWNER_TELEGRAM_ID_STR = os.getenv("OWNER_TELEGRAM_ID")
 OWNER_TELEGRAM_ID = int(OWNER_TELEGRAM_ID_STR) if OWNER_TELEGRAM_ID_STR and OWNER_TELEGRAM_ID_STR.isdigit() else None
 if not OWNER_TELEGRAM_ID:
@@ -1,10 +1,19 @@
 # db.py
+import datetime
 import logging
 import aiosqlite
-from config import DB_NAME
+from config import DB_NAME, FX_BASE_CURRENCY
 
 logger = logging.getLogger(__name__)
 
+async def _ensure_column(db, table: str, column: str, definition: str):
+    """Добавляет колонку в существующую таблицу, если ее там еще нет (миграция старых БД)."""
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    existing_columns = [row[1] for row in await cursor.fetchall()]
+    if column not in existing_columns:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        logger.info(f"В таблицу '{table}' добавлена колонка '{column}'.")
+
 async def init_db():
     async with aiosqlite.connect(DB_NAME) as db:
         await db.execute(
@@ -23,6 +32,79 @@ async def init_db():
             )
             """
         )
+        # Горячие (активные) и холодные (архивные) планы индексируются отдельно: обычные
+        # списки планов не читают архив, а архив листается постранично от новых к старым
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_plans_active_user_date ON plans (user_id, plan_date, id) WHERE is_archived = 0"
+        )
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_plans_archived_user_date ON plans (user_id, plan_date, id) WHERE is_archived = 1"
+        )
+        # Неотправленные напоминания по времени: по нему заполняется окно заданий планировщика
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_plans_pending_reminders ON plans (reminder_datetime) "
+            "WHERE is_reminder_sent = 0 AND reminder_datetime IS NOT NULL"
+        )
+        # Прогресс фоновых задач, проходящих таблицу пачками (например, автоархивации планов)
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS maintenance_progress (
+                task TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL DEFAULT 0,
+                cutoff TEXT,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        # Напоминания, которые не удалось доставить (см. scheduler_jobs.redeliver_failed_reminders)
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS reminder_dead_letters (
+                plan_id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                last_error TEXT,
+                is_permanent INTEGER DEFAULT 0,
+                redelivery_attempts INTEGER DEFAULT 0,
+                failed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (plan_id) REFERENCES plans (id) ON DELETE CASCADE
+            )
+            """
+        )
+        # Недоставленные напоминания серий: одна строка на серию, повторяется последнее повторение
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS series_reminder_dead_letters (
+                series_id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                last_error TEXT,
+                is_permanent INTEGER DEFAULT 0,
+                redelivery_attempts INTEGER DEFAULT 0,
+                failed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (series_id) REFERENCES plan_series (id) ON DELETE CASCADE
+            )
+            """
+        )
+        # Повторяющиеся планы: одна строка на серию, повторения вычисляются по rrule (см. recurrence.py)
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS plan_series (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                plan_topic TEXT,
+                plan_text TEXT NOT NULL,
+                rrule TEXT NOT NULL,
+                dtstart TEXT NOT NULL,
+                reminder_time TEXT,
+                next_reminder_datetime TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_plan_series_user ON plan_series (user_id)")
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_plan_series_next_reminder ON plan_series (next_reminder_datetime) "
+            "WHERE next_reminder_datetime IS NOT NULL"
+        )
         await db.execute(
             """
             CREATE TABLE IF NOT EXISTS user_files (
@@ -35,10 +117,16 @@ async def init_db():
                 upload_date DATETIME DEFAULT CURRENT_TIMESTAMP,
                 is_processed_for_chunks INTEGER DEFAULT 0,
                 plan_id INTEGER,
+                chunker_version INTEGER DEFAULT 0,
                 FOREIGN KEY (plan_id) REFERENCES plans (id) ON DELETE CASCADE
             )
             """
         )
+        await _ensure_column(db, "user_files", "chunker_version", "INTEGER DEFAULT 0")
+        # Неудачные попытки перечанковки и время, раньше которого файл не берется повторно
+        await _ensure_column(db, "user_files", "rechunk_attempts", "INTEGER DEFAULT 0")
+        await _ensure_column(db, "user_files", "rechunk_retry_after", "DATETIME")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_user_files_plan_id ON user_files (plan_id) WHERE plan_id IS NOT NULL")
         await db.execute(
             """
             CREATE TABLE IF NOT EXISTS file_chunks (
@@ -50,6 +138,16 @@ async def init_db():
             )
             """
         )
+        # Исходный текст документа: позволяет перечанковать файл без повторной загрузки из Telegram
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS file_texts (
+                user_file_id INTEGER PRIMARY KEY,
+                source_text TEXT NOT NULL,
+                FOREIGN KEY (user_file_id) REFERENCES user_files (id) ON DELETE CASCADE
+            )
+            """
+        )
         await db.execute(
             """
             CREATE TABLE IF NOT EXISTS books (
@@ -57,10 +155,12 @@ async def init_db():
                 user_id INTEGER NOT NULL,
                 name TEXT NOT NULL UNIQUE,
                 currency TEXT NOT NULL DEFAULT 'UZS',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                content_version INTEGER NOT NULL DEFAULT 0
             )
             """
         )
+        await _ensure_column(db, "books", "content_version", "INTEGER NOT NULL DEFAULT 0")
         await db.execute(
             """
             CREATE TABLE IF NOT EXISTS transactions (
@@ -73,29 +173,258 @@ async def init_db():
                 category TEXT,
                 transaction_date DATETIME DEFAULT CURRENT_TIMESTAMP,
                 check_url TEXT UNIQUE,
+                import_hash TEXT,
                 FOREIGN KEY (book_id) REFERENCES books (id) ON DELETE CASCADE
             )
             """
         )
+        await _ensure_column(db, "transactions", "import_hash", "TEXT")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_transactions_book_date ON transactions (book_id, transaction_date)")
+        # Защита от повторного импорта одной и той же выписки (см. statement_import.import_hash)
+        await db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_import_hash ON transactions (book_id, import_hash) "
+            "WHERE import_hash IS NOT NULL"
+        )
+        await _init_transaction_rollups(db)
+        # Курсы валют: сколько единиц currency стоит 1 единица FX_BASE_CURRENCY
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fx_rates (
+                currency TEXT PRIMARY KEY,
+                units_per_base REAL NOT NULL CHECK (units_per_base > 0),
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
         await db.commit()
     logger.info(f"База данных '{DB_NAME}' инициализирована со всеми таблицами.")
 
+# Агрегаты транзакций по (книга, месяц, тип, категория). Поддерживаются триггерами при каждой
+# вставке, изменении и удалении транзакции, поэтому сводки по месяцам и категориям читают
+# несколько строк агрегата, а не всю историю книги. Пустая категория хранится как ''.
+_ROLLUP_ADD_NEW_SQL = """
+    INSERT INTO transaction_rollups (book_id, month, type, category, total, cnt)
+    VALUES (NEW.book_id, substr(NEW.transaction_date, 1, 7), NEW.type, COALESCE(NEW.category, ''), NEW.amount, 1)
+    ON CONFLICT (book_id, month, type, category) DO UPDATE SET total = total + excluded.total, cnt = cnt + 1;
+"""
+_ROLLUP_SUBTRACT_OLD_SQL = """
+    UPDATE transaction_rollups SET total = total - OLD.amount, cnt = cnt - 1
+    WHERE book_id = OLD.book_id AND month = substr(OLD.transaction_date, 1, 7) AND type = OLD.type AND category = COALESCE(OLD.category, '');
+    DELETE FROM transaction_rollups
+    WHERE book_id = OLD.book_id AND month = substr(OLD.transaction_date, 1, 7) AND type = OLD.type AND category = COALESCE(OLD.category, '') AND cnt <= 0;
+"""
+
+async def _init_transaction_rollups(db):
+    """Создает таблицу агрегатов и триггеры; при первом запуске заполняет ее по существующим транзакциям."""
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS transaction_rollups (
+            book_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total REAL NOT NULL DEFAULT 0,
+            cnt INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (book_id, month, type, category)
+        )
+        """
+    )
+    await db.execute(f"CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_insert AFTER INSERT ON transactions BEGIN {_ROLLUP_ADD_NEW_SQL} END")
+    await db.execute(f"CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_delete AFTER DELETE ON transactions BEGIN {_ROLLUP_SUBTRACT_OLD_SQL} END")
+    await db.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup_update "
+        "AFTER UPDATE OF book_id, type, amount, category, transaction_date ON transactions "
+        f"BEGIN {_ROLLUP_SUBTRACT_OLD_SQL} {_ROLLUP_ADD_NEW_SQL} END"
+    )
+    await db.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_books_rollup_delete AFTER DELETE ON books "
+        "BEGIN DELETE FROM transaction_rollups WHERE book_id = OLD.id; END"
+    )
+    cursor = await db.execute("SELECT EXISTS (SELECT 1 FROM transaction_rollups), EXISTS (SELECT 1 FROM transactions)")
+    has_rollups, has_transactions = await cursor.fetchone()
+    if has_transactions and not has_rollups:
+        await db.execute(
+            """
+            INSERT INTO transaction_rollups (book_id, month, type, category, total, cnt)
+            SELECT book_id, substr(transaction_date, 1, 7), type, COALESCE(category, ''), SUM(amount), COUNT(*)
+            FROM transactions GROUP BY 1, 2, 3, 4
+            """
+        )
+        logger.info("Таблица агрегатов транзакций заполнена по существующим данным.")
+
+async def get_book_monthly_summary(user_id: int, book_id: int, limit: int = 12):
+    """Возвращает до limit последних месяцев книги: (месяц 'YYYY-MM', доходы, расходы, число транзакций)."""
+    async with aiosqlite.connect(DB_NAME) as db:
+        cursor = await db.execute(
+            "SELECT r.month, COALESCE(SUM(CASE WHEN r.type = 'income' THEN r.total END), 0.0), "
+            "COALESCE(SUM(CASE WHEN r.type = 'expense' THEN r.total END), 0.0), SUM(r.cnt) "
+            "FROM transaction_rollups r JOIN books b ON b.id = r.book_id "
+            "WHERE r.book_id = ? AND b.user_id = ? GROUP BY r.month ORDER BY r.month DESC LIMIT ?",
+            (book_id, user_id, limit)
+        )
+        return await cursor.fetchall()
+
+async def get_book_category_summary(user_id: int, book_id: int, month: str = None):
+    """Возвращает суммы по категориям книги (за все время или за месяц 'YYYY-MM'): (тип, категория, сумма, число)."""
+    async with aiosqlite.connect(DB_NAME) as db:
+        query = (
+            "SELECT r.type, r.category, SUM(r.total), SUM(r.cnt) "
+            "FROM transaction_rollups r JOIN books b ON b.id = r.book_id "
+            "WHERE r.book_id = ? AND b.user_id = ?"
+        )
+        params = (book_id, user_id)
+        if month: query += " AND r.month = ?"; params += (month,)
+        query += " GROUP BY r.type, r.category ORDER BY r.type, SUM(r.total) DESC"
+        cursor = await db.execute(query, params)
+        return await cursor.fetchall()
+
+async def set_fx_rates(rates: dict[str, float]) -> int:
+    """Сохраняет курсы {валюта: единиц за 1 базовую} одним executemany. Возвращает число записанных курсов."""
+    async with aiosqlite.connect(DB_NAME) as db:
+        await db.executemany(
+            "INSERT INTO fx_rates (currency, units_per_base, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP) "
+            "ON CONFLICT (currency) DO UPDATE SET units_per_base = excluded.units_per_base, updated_at = excluded.updated_at",
+            [(currency.upper(), rate) for currency, rate in rates.items()]
+        )
+        await db.commit()
+    return len(rates)
+
+async def get_fx_rates():
+    async with aiosqlite.connect(DB_NAME) as db:
+        cursor = await db.execute("SELECT currency, units_per_base, updated_at FROM fx_rates ORDER BY currency")
+        return await cursor.fetchall()
+
+async def get_consolidated_balance(user_id: int, target_currency: str):
+    """
+    Балансы всех книг пользователя одним запросом по таблице агрегатов, с пересчетом в target_currency
+    прямо в SQL через fx_rates. Возвращает строки (id, name, currency, income, expense, converted_balance);
+    converted_balance равен NULL, если для валюты книги или целевой валюты нет курса.
+    """
+    async with aiosqlite.connect(DB_NAME) as db:
+        cursor = await db.execute(
+            """
+            WITH rates AS (
+                SELECT currency, units_per_base FROM fx_rates
+                UNION ALL SELECT :base, 1.0 WHERE NOT EXISTS (SELECT 1 FROM fx_rates WHERE currency = :base)
+            ),
+            book_totals AS (
+                SELECT b.id, b.name, b.currency,
+                       COALESCE(SUM(CASE WHEN r.type = 'income' THEN r.total END), 0.0) AS income,
+                       COALESCE(SUM(CASE WHEN r.type = 'expense' THEN r.total END), 0.0) AS expense
+                FROM books b LEFT JOIN transaction_rollups r ON r.book_id = b.id
+                WHERE b.user_id = :user_id
+                GROUP BY b.id
+            )
+            SELECT t.id, t.name, t.currency, t.income, t.expense,
+                   (t.income - t.expense) / src.units_per_base * dst.units_per_base AS converted_balance
+            FROM book_totals t
+            LEFT JOIN rates src ON src.currency = t.currency
+            LEFT JOIN rates dst ON dst.currency = :target
+            ORDER BY t.name
+            """,
+            {"user_id": user_id, "base": FX_BASE_CURRENCY, "target": target_currency}
+        )
+        return await cursor.fetchall()
+
 async def check_if_url_exists(check_url: str) -> bool:
     """Проверяет, существует ли транзакция с таким URL чека."""
     async with aiosqlite.connect(DB_NAME) as db:
         cursor = await db.execute("SELECT 1 FROM transactions WHERE check_url = ?", (check_url,))
         return await cursor.fetchone() is not None
 
+# Версия содержимого книги увеличивается при любом изменении ее транзакций или свойств,
+# попадающих в отчет. По ней кэшируются готовые отчеты (см. reports.report_cache).
+_BUMP_BOOK_VERSION_SQL = "UPDATE books SET content_version = content_version + 1 WHERE id = ?"
+_BUMP_BOOK_VERSION_BY_TRANSACTION_SQL = (
+    "UPDATE books SET content_version = content_version + 1 "
+    "WHERE id = (SELECT book_id FROM transactions WHERE id = ? AND user_id = ?)"
+)
+
+async def get_book_content_version(user_id: int, book_id: int):
+    async with aiosqlite.connect(DB_NAME) as db:
+        cursor = await db.execute("SELECT content_version FROM books WHERE id = ? AND user_id = ?", (book_id, user_id))
+        row = await cursor.fetchone()
+        return row[0] if row else None
+
 async def add_transaction(user_id: int, book_id: int, type: str, amount: float, description: str = None, category: str = None, transaction_date: str = None, check_url: str = None) -> int:
     async with aiosqlite.connect(DB_NAME) as db:
         cursor = await db.execute(
             "INSERT INTO transactions (user_id, book_id, type, amount, description, category, transaction_date, check_url) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", 
             (user_id, book_id, type, amount, description, category, transaction_date, check_url)
         )
+        await db.execute(_BUMP_BOOK_VERSION_SQL, (book_id,))
         await db.commit()
         return cursor.lastrowid
 
+async def add_receipt_expenses(user_id: int, book_id: int, receipts: list[tuple], category: str) -> int:
+    """
+    Записывает расходы по нескольким чекам одной транзакцией БД.
+    receipts — кортежи (amount, description, transaction_date, check_url). Чеки, URL которых
+    уже есть в базе (например, добавлены параллельно), пропускаются. Возвращает число добавленных.
+    """
+    if not receipts:
+        return 0
+    async with aiosqlite.connect(DB_NAME) as db:
+        cursor = await db.executemany(
+            "INSERT OR IGNORE INTO transactions (user_id, book_id, type, amount, description, category, transaction_date, check_url) "
+            "VALUES (?, ?, 'expense', ?, ?, ?, ?, ?)",
+            [(user_id, book_id, amount, description, category, transaction_date, check_url)
+             for amount, description, transaction_date, check_url in receipts]
+        )
+        # Для executemany rowcount суммирует вставленные строки (изменения триггеров не учитываются)
+        inserted = cursor.rowcount
+        if inserted:
+            # Если все чеки уже были в базе, книга не изменилась — кэш отчетов остается действительным
+            await db.execute(_BUMP_BOOK_VERSION_SQL, (book_id,))
+        await db.commit()
+        return inserted
+
 # ... (остальной код файла без изменений)
+async def bulk_insert_transactions(user_id: int, book_id: int, rows: list[tuple]):
+    """
+    Вставляет импортированные транзакции одной транзакцией БД через executemany.
+    rows — кортежи (type, amount, description, category, transaction_date, import_hash).
+    Строки с уже существующим import_hash в этой книге пропускаются. Строки, совпадающие по дню,
+    типу и сумме с транзакциями, внесенными вручную (без import_hash), тоже пропускаются —
+    каждая ручная запись закрывает не больше одной строки выписки.
+    Возвращает (добавлено, пропущено как дубликаты импорта, пропущено как внесенные вручную).
+    """
+    async with aiosqlite.connect(DB_NAME) as db:
+        cursor = await db.execute("SELECT 1 FROM books WHERE id = ? AND user_id = ?", (book_id, user_id))
+        if await cursor.fetchone() is None:
+            return 0, 0, 0
+        manual_counts = {}
+        if rows:
+            days = sorted(row[4][:10] for row in rows)
+            cursor = await db.execute(
+                "SELECT substr(transaction_date, 1, 10), type, ROUND(amount, 2), COUNT(*) FROM transactions "
+                "WHERE book_id = ? AND import_hash IS NULL AND transaction_date >= ? AND transaction_date < date(?, '+1 day') "
+                "GROUP BY 1, 2, 3",
+                (book_id, days[0], days[-1])
+            )
+            manual_counts = {(day, t_type, amount): count for day, t_type, amount, count in await cursor.fetchall()}
+        new_rows = []
+        for row in rows:
+            key = (row[4][:10], row[0], round(row[1], 2))
+            if manual_counts.get(key):
+                manual_counts[key] -= 1
+            else:
+                new_rows.append(row)
+
+        count_sql = "SELECT COUNT(*) FROM transactions WHERE book_id = ? AND import_hash IS NOT NULL"
+        imported_before = (await (await db.execute(count_sql, (book_id,))).fetchone())[0]
+        await db.executemany(
+            "INSERT OR IGNORE INTO transactions (user_id, book_id, type, amount, description, category, transaction_date, import_hash) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(user_id, book_id, *row) for row in new_rows]
+        )
+        # total_changes учитывает и строки, измененные триггерами агрегатов, поэтому вставки считаются по индексу хешей
+        inserted = (await (await db.execute(count_sql, (book_id,))).fetchone())[0] - imported_before
+        if inserted:
+            await db.execute(_BUMP_BOOK_VERSION_SQL, (book_id,))
+        await db.commit()
+    return inserted, len(new_rows) - inserted, len(rows) - len(new_rows)
+
 async def update_file_category(file_id: int, user_id: int, category: str) -> bool:
     async with aiosqlite.connect(DB_NAME) as db:
         cursor = await db.execute("UPDATE user_files SET category = ? WHERE id = ? AND user_id = ?", (category, file_id, user_id))
@@ -132,13 +461,85 @@ async def get_files_by_search_query(user_id: int, query: str):
         cursor = await db.execute("SELECT id, original_file_name, category FROM user_files WHERE user_id = ? AND original_file_name LIKE ? ORDER BY upload_date DESC", (user_id, f"%{query}%"))
         return await cursor.fetchall()
 
+async def save_file_chunks(file_id: int, chunks: list[str], source_text: str, chunker_version: int) -> bool:
+    """
+    Атомарно заменяет чанки файла, кэширует исходный текст и записывает версию чанкера.
+    Используется как при первой обработке, так и при перечанковке.
+    Если файл успели удалить, пока шла обработка, ничего не записывает и возвращает False.
+    """
+    async with aiosqlite.connect(DB_NAME) as db:
+        # UPDATE идет первым: он открывает транзакцию и блокирует запись, поэтому удаление файла
+        # не может вклиниться между проверкой и вставкой чанков и оставить «осиротевшие» строки.
+        cursor = await db.execute(
+            "UPDATE user_files SET is_processed_for_chunks = 1, chunker_version = ?, "
+            "rechunk_attempts = 0, rechunk_retry_after = NULL WHERE id = ?",
+            (chunker_version, file_id)
+        )
+        if cursor.rowcount == 0:
+            await db.rollback()
+            return False
+        await db.execute("DELETE FROM file_chunks WHERE user_file_id = ?", (file_id,))
+        await db.executemany(
+            "INSERT INTO file_chunks (user_file_id, chunk_text, chunk_order) VALUES (?, ?, ?)",
+            [(file_id, chunk, i) for i, chunk in enumerate(chunks)]
+        )
+        await db.execute(
+            "INSERT INTO file_texts (user_file_id, source_text) VALUES (?, ?) "
+            "ON CONFLICT(user_file_id) DO UPDATE SET source_text = excluded.source_text",
+            (file_id, source_text)
+        )
+        await db.commit()
+    return True
+
+async def get_stale_chunked_files(current_version: int, limit: int, now: datetime.datetime = None, require_source_text: bool = False):
+    """
+    Возвращает до `limit` обработанных файлов, чанки которых построены старой версией чанкера.
+    Файлы, у которых после неудачной попытки еще не наступило время повтора, пропускаются.
+    Файлы с сохраненным исходным текстом идут первыми: их можно обновить без загрузки.
+    """
+    now = now or datetime.datetime.now()
+    query = (
+        "SELECT uf.id, uf.user_id, uf.telegram_file_id, uf.original_file_name, uf.file_type, ft.source_text "
+        "FROM user_files uf LEFT JOIN file_texts ft ON ft.user_file_id = uf.id "
+        "WHERE uf.is_processed_for_chunks = 1 AND uf.chunker_version < ? "
+        "AND (uf.rechunk_retry_after IS NULL OR uf.rechunk_retry_after <= ?)"
+    )
+    if require_source_text:
+        query += " AND ft.source_text IS NOT NULL"
+    query += " ORDER BY ft.source_text IS NULL, uf.id LIMIT ?"
+    async with aiosqlite.connect(DB_NAME) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute(query, (current_version, now.strftime("%Y-%m-%d %H:%M:%S"), limit))
+        return await cursor.fetchall()
+
+async def record_rechunk_failure(file_id: int, base_delay_minutes: int, max_delay_minutes: int, now: datetime.datetime = None) -> datetime.datetime:
+    """
+    Запоминает неудачную перечанковку файла и откладывает следующую попытку
+    с экспоненциальной задержкой: base, 2*base, 4*base... но не больше max_delay_minutes.
+    Возвращает время следующей попытки.
+    """
+    now = now or datetime.datetime.now()
+    async with aiosqlite.connect(DB_NAME) as db:
+        cursor = await db.execute("SELECT rechunk_attempts FROM user_files WHERE id = ?", (file_id,))
+        row = await cursor.fetchone()
+        attempts = (row[0] or 0) + 1 if row else 1
+        delay_minutes = min(base_delay_minutes * 2 ** (attempts - 1), max_delay_minutes)
+        retry_after = now + datetime.timedelta(minutes=delay_minutes)
+        await db.execute(
+            "UPDATE user_files SET rechunk_attempts = ?, rechunk_retry_after = ? WHERE id = ?",
+            (attempts, retry_after.strftime("%Y-%m-%d %H:%M:%S"), file_id)
+        )
+        await db.commit()
+    return retry_after
+
 async def delete_files_by_ids(user_id: int, file_ids: list[int]) -> int:
     """Удаляет файлы и связанные с ними чанки по списку ID."""
     deleted_count = 0
     async with aiosqlite.connect(DB_NAME) as db:
         for file_id in file_ids:
-            # Сначала удаляем связанные чанки
+            # Сначала удаляем связанные чанки и кэш исходного текста
             await db.execute("DELETE FROM file_chunks WHERE user_file_id = ?", (file_id,))
+            await db.execute("DELETE FROM file_texts WHERE user_file_id = ?", (file_id,))
             # Затем удаляем сам файл
             cursor = await db.execute("DELETE FROM user_files WHERE id = ? AND user_id = ?", (file_id, user_id))
             if cursor.rowcount > 0:
@@ -162,6 +563,7 @@ async def delete_category_by_name(user_id: int, category: str) -> int:
         
         # Удаляем все чанки для этих файлов
         await db.execute(f"DELETE FROM file_chunks WHERE user_file_id IN ({placeholders})", file_ids)
+        await db.execute(f"DELETE FROM file_texts WHERE user_file_id IN ({placeholders})", file_ids)
         
         # Удаляем сами файлы
         cursor_delete = await db.execute(f"DELETE FROM user_files WHERE id IN ({placeholders}) AND user_id = ?", (*file_ids, user_id))
@@ -176,11 +578,48 @@ async def add_plan_to_db(user_id: int, plan_date_str: str, plan_topic: str, plan
 
 async def get_plans_for_date(user_id: int, date_str: str):
     async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row; cursor = await db.execute("SELECT * FROM plans WHERE user_id = ? AND plan_date = ? ORDER BY id", (user_id, date_str)); return await cursor.fetchall()
+        db.row_factory = aiosqlite.Row; cursor = await db.execute("SELECT * FROM plans WHERE user_id = ? AND plan_date = ? AND is_archived = 0 ORDER BY id", (user_id, date_str)); return await cursor.fetchall()
 
 async def get_all_user_plans(user_id: int):
+    """Активные (неархивные) планы пользователя. Архив — get_archived_plans_page."""
+    async with aiosqlite.connect(DB_NAME) as db:
+        db.row_factory = aiosqlite.Row; cursor = await db.execute("SELECT * FROM plans WHERE user_id = ? AND is_archived = 0 ORDER BY plan_date ASC, id ASC", (user_id,)); return await cursor.fetchall()
+
+async def get_archived_plans_page(user_id: int, page: int, page_size: int):
+    """Страница архива (page с нуля), от новых планов к старым. Возвращает (планы, всего в архиве)."""
+    async with aiosqlite.connect(DB_NAME) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute("SELECT COUNT(*) FROM plans WHERE user_id = ? AND is_archived = 1", (user_id,))
+        total = (await cursor.fetchone())[0]
+        cursor = await db.execute(
+            "SELECT * FROM plans WHERE user_id = ? AND is_archived = 1 ORDER BY plan_date DESC, id DESC LIMIT ? OFFSET ?",
+            (user_id, page_size, page * page_size),
+        )
+        return await cursor.fetchall(), total
+
+async def add_plan_series(user_id: int, plan_topic: str, plan_text: str, rrule: str, dtstart: str, reminder_time: str = None, next_reminder_datetime: str = None) -> int:
     async with aiosqlite.connect(DB_NAME) as db:
-        db.row_factory = aiosqlite.Row; cursor = await db.execute("SELECT * FROM plans WHERE user_id = ? ORDER BY plan_date ASC, id ASC", (user_id,)); return await cursor.fetchall()
+        cursor = await db.execute(
+            "INSERT INTO plan_series (user_id, plan_topic, plan_text, rrule, dtstart, reminder_time, next_reminder_datetime) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user_id, plan_topic, plan_text, rrule, dtstart, reminder_time, next_reminder_datetime),
+        )
+        await db.commit(); return cursor.lastrowid
+
+async def get_user_plan_series(user_id: int):
+    async with aiosqlite.connect(DB_NAME) as db:
+        db.row_factory = aiosqlite.Row; cursor = await db.execute("SELECT * FROM plan_series WHERE user_id = ? ORDER BY id", (user_id,)); return await cursor.fetchall()
+
+async def get_plan_series_by_id(user_id: int, series_id: int):
+    async with aiosqlite.connect(DB_NAME) as db:
+        db.row_factory = aiosqlite.Row; cursor = await db.execute("SELECT * FROM plan_series WHERE id = ? AND user_id = ?", (series_id, user_id)); return await cursor.fetchone()
+
+async def set_series_next_reminder(user_id: int, series_id: int, next_reminder_datetime: str = None) -> bool:
+    async with aiosqlite.connect(DB_NAME) as db:
+        cursor = await db.execute("UPDATE plan_series SET next_reminder_datetime = ? WHERE id = ? AND user_id = ?", (next_reminder_datetime, series_id, user_id)); await db.commit(); return cursor.rowcount > 0
+
+async def delete_plan_series(user_id: int, series_id: int) -> bool:
+    async with aiosqlite.connect(DB_NAME) as db:
+        cursor = await db.execute("DELETE FROM plan_series WHERE id = ? AND user_id = ?", (series_id, user_id)); await db.commit(); return cursor.rowcount > 0
 
 async def get_plan_by_id(user_id: int, plan_id: int):
     async with aiosqlite.connect(DB_NAME) as db:
@@ -190,12 +629,82 @@ async def get_attachments_for_plan(plan_id: int):
     async with aiosqlite.connect(DB_NAME) as db:
         db.row_factory = aiosqlite.Row; cursor = await db.execute("SELECT telegram_file_id, file_type FROM user_files WHERE plan_id = ?", (plan_id,)); return await cursor.fetchall()
 
+async def get_reminder_contents(plan_id: int, due_from: str, due_to: str, prefetch_limit: int) -> dict:
+    """
+    Одним запросом загружает тему, текст и вложения плана plan_id и заодно — до prefetch_limit
+    неотправленных напоминаний со временем в [due_from, due_to], которые сработают рядом.
+    Возвращает {plan_id: {"user_id", "topic", "text", "attachments": [(telegram_file_id, file_type)]}}.
+    """
+    async with aiosqlite.connect(DB_NAME) as db:
+        cursor = await db.execute(
+            """
+            WITH due (id) AS (
+                SELECT ?
+                UNION
+                SELECT id FROM (
+                    SELECT id FROM plans
+                    WHERE is_reminder_sent = 0 AND reminder_datetime IS NOT NULL AND reminder_datetime BETWEEN ? AND ?
+                    ORDER BY reminder_datetime LIMIT ?
+                )
+            )
+            SELECT p.id, p.user_id, p.plan_topic, p.plan_text, uf.telegram_file_id, uf.file_type
+            FROM due
+            JOIN plans p ON p.id = due.id
+            LEFT JOIN user_files uf ON uf.plan_id = p.id
+            ORDER BY p.id, uf.id
+            """,
+            (plan_id, due_from, due_to, prefetch_limit),
+        )
+        contents = {}
+        for row_plan_id, user_id, topic, text, telegram_file_id, file_type in await cursor.fetchall():
+            content = contents.setdefault(row_plan_id, {"user_id": user_id, "topic": topic, "text": text, "attachments": []})
+            if telegram_file_id:
+                content["attachments"].append((telegram_file_id, file_type))
+        return contents
+
 async def get_transactions_by_book(user_id: int, book_id: int, transaction_type: str = None):
     async with aiosqlite.connect(DB_NAME) as db:
         db.row_factory = aiosqlite.Row; query = "SELECT * FROM transactions WHERE user_id = ? AND book_id = ?"; params = (user_id, book_id)
         if transaction_type: query += " AND type = ?"; params += (transaction_type,)
         query += " ORDER BY transaction_date DESC"; cursor = await db.execute(query, params); return await cursor.fetchall()
 
+async def iter_transactions_by_book(user_id: int, book_id: int, batch_size: int = 1000):
+    """
+    Асинхронный генератор: отдает транзакции книги пачками по batch_size строк (кортежи
+    id, transaction_date, type, amount, category, description), не загружая всю книгу в память.
+    Каждая пачка читается отдельным коротким запросом по ключу (дата, id) последней строки:
+    между пачками чтение не держит блокировку БД, и запись из других обработчиков и
+    планировщика не ждет, пока потребитель (выгрузка в Telegram, рендеринг) разберет пачку.
+    """
+    query = (
+        "SELECT id, transaction_date, type, amount, category, description FROM transactions "
+        "WHERE user_id = ? AND book_id = ? {after}ORDER BY transaction_date DESC, id DESC LIMIT ?"
+    )
+    async with aiosqlite.connect(DB_NAME) as db:
+        cursor = await db.execute(query.format(after=""), (user_id, book_id, batch_size))
+        rows = await cursor.fetchall()
+        while rows:
+            yield rows
+            if len(rows) < batch_size:
+                break
+            last_id, last_date = rows[-1][0], rows[-1][1]
+            cursor = await db.execute(
+                query.format(after="AND (transaction_date, id) < (?, ?) "),
+                (user_id, book_id, last_date, last_id, batch_size)
+            )
+            rows = await cursor.fetchall()
+
+async def get_book_totals(user_id: int, book_id: int):
+    """Возвращает (сумма доходов, сумма расходов, число транзакций) книги одним запросом."""
+    async with aiosqlite.connect(DB_NAME) as db:
+        cursor = await db.execute(
+            "SELECT COALESCE(SUM(CASE WHEN type = 'income' THEN amount END), 0.0), "
+            "COALESCE(SUM(CASE WHEN type = 'expense' THEN amount END), 0.0), COUNT(*) "
+            "FROM transactions WHERE user_id = ? AND book_id = ?",
+            (user_id, book_id)
+        )
+        return await cursor.fetchone()
+
 async def get_book_balance_summary(user_id: int, book_id: int):
     async with aiosqlite.connect(DB_NAME) as db:
         db.row_factory = aiosqlite.Row
@@ -223,12 +732,12 @@ async def delete_book(user_id: int, book_id: int) -> bool:
 
 async def update_book_currency(user_id: int, book_id: int, new_currency: str) -> bool:
     async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("UPDATE books SET currency = ? WHERE id = ? AND user_id = ?", (new_currency, book_id, user_id)); await db.commit(); return cursor.rowcount > 0
+        cursor = await db.execute("UPDATE books SET currency = ?, content_version = content_version + 1 WHERE id = ? AND user_id = ?", (new_currency, book_id, user_id)); await db.commit(); return cursor.rowcount > 0
 
 async def update_book_name(user_id: int, book_id: int, new_name: str) -> bool:
     try:
         async with aiosqlite.connect(DB_NAME) as db:
-            cursor = await db.execute("UPDATE books SET name = ? WHERE id = ? AND user_id = ?", (new_name, book_id, user_id)); await db.commit(); return cursor.rowcount > 0
+            cursor = await db.execute("UPDATE books SET name = ?, content_version = content_version + 1 WHERE id = ? AND user_id = ?", (new_name, book_id, user_id)); await db.commit(); return cursor.rowcount > 0
     except aiosqlite.IntegrityError: return False
 
 async def get_transaction_by_id(user_id: int, transaction_id: int):
@@ -238,8 +747,10 @@ async def get_transaction_by_id(user_id: int, transaction_id: int):
 async def update_transaction(user_id: int, transaction_id: int, field: str, value):
     async with aiosqlite.connect(DB_NAME) as db:
         if field not in ['type', 'amount', 'description', 'category', 'transaction_date']: return False
-        cursor = await db.execute(f"UPDATE transactions SET {field} = ? WHERE id = ? AND user_id = ?", (value, transaction_id, user_id)); await db.commit(); return cursor.rowcount > 0
+        cursor = await db.execute(f"UPDATE transactions SET {field} = ? WHERE id = ? AND user_id = ?", (value, transaction_id, user_id))
+        await db.execute(_BUMP_BOOK_VERSION_BY_TRANSACTION_SQL, (transaction_id, user_id)); await db.commit(); return cursor.rowcount > 0
 
 async def delete_transaction(user_id: int, transaction_id: int) -> bool:
     async with aiosqlite.connect(DB_NAME) as db:
+        await db.execute(_BUMP_BOOK_VERSION_BY_TRANSACTION_SQL, (transaction_id, user_id))
         cursor = await db.execute("DELETE FROM transactions WHERE id = ? AND user_id = ?", (transaction_id, user_id)); await db.commit(); return cursor.rowcount > 0
\ No newline at end of file
@@ -0,0 +1,107 @@
+# disk_cache.py
+import hashlib
+import os
+import tempfile
+import threading
+
+from config import logger
+
+
+class DiskLRUCache:
+    """
+    Простой кэш байтовых значений на диске с ограничением общего размера.
+    Каждый ключ хранится отдельным файлом (имя — sha256 ключа); время модификации
+    файла обновляется при чтении и служит меткой LRU. При превышении max_bytes
+    удаляются самые давно использованные файлы.
+    Общий размер считается сканированием каталога один раз, дальше ведется по записям;
+    каталог снова сканируется только для вытеснения. Все методы блокируют поток на
+    дисковых операциях, поэтому из асинхронного кода их вызывают через asyncio.to_thread.
+    """
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._total_size = None # Неизвестен до первой записи
+        self._lock = threading.Lock()
+
+    def _path_for(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def get_path(self, key: str) -> str | None:
+        """Возвращает путь к файлу значения (и отмечает его использование) или None."""
+        path = self._path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def get(self, key: str) -> bytes | None:
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # Файл мог быть вытеснен между get_path и чтением
+            return None
+
+    def put(self, key: str, data: bytes):
+        temp_path = self.new_temp_path()
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        self.put_file(key, temp_path)
+
+    def new_temp_path(self) -> str:
+        """Создает временный файл внутри каталога кэша (для последующего put_file)."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        return temp_path
+
+    def put_file(self, key: str, temp_path: str):
+        """Атомарно переносит готовый временный файл в кэш под указанным ключом."""
+        path = self._path_for(key)
+        new_size = os.path.getsize(temp_path)
+        with self._lock:
+            if self._total_size is None:
+                self._total_size = self._scan()[1]
+            try:
+                old_size = os.path.getsize(path)
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(temp_path, path)
+            self._total_size += new_size - old_size
+            if self._total_size > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        """Возвращает записи кэша (mtime, размер, путь) и их общий размер."""
+        entries = []
+        total_size = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total_size += stat.st_size
+        return entries, total_size
+
+    def _evict(self):
+        # Сканирование нужно только здесь: метки LRU (mtime) обновляются при чтении
+        entries, total_size = self._scan()
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total_size -= size
+            except FileNotFoundError:
+                pass
+        self._total_size = total_size
+        logger.info(f"Кэш '{self.directory}': вытеснены старые записи, размер {total_size} байт.")
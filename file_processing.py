@@ -1,25 +1,41 @@
 # file_processing.py
-import fitz
-from docx import Document as DocxDocument
-from nltk.tokenize import sent_tokenize
+# PyMuPDF, python-docx и NLTK тяжелые: импортируются при первом использовании
+# (или заранее в фоне, см. warmup.py), а не при запуске бота.
+import threading
+
 from config import logger
-import nltk # Убедимся, что nltk импортирован здесь для download
 
-# Проверка и загрузка NLTK 'punkt' один раз при импорте модуля
-try:
-    nltk.data.find("tokenizers/punkt")
-except LookupError:
-    logger.info("Загрузка NLTK 'punkt'...")
-    nltk.download("punkt", quiet=True)
-    # Повторная проверка после загрузки, чтобы убедиться
-    try:
-        nltk.data.find("tokenizers/punkt")
-    except LookupError:
-        logger.warning("NLTK 'punkt' не удалось загрузить после попытки. Некоторые функции могут работать некорректно.")
+_punkt_lock = threading.Lock()
+_punkt_checked = False
+
+def ensure_nltk_punkt():
+    """Проверяет (и при необходимости один раз загружает) NLTK 'punkt'."""
+    global _punkt_checked
+    with _punkt_lock:
+        if _punkt_checked:
+            return
+        import nltk
+        try:
+            nltk.data.find("tokenizers/punkt")
+        except LookupError:
+            logger.info("Загрузка NLTK 'punkt'...")
+            nltk.download("punkt", quiet=True)
+            # Повторная проверка после загрузки, чтобы убедиться
+            try:
+                nltk.data.find("tokenizers/punkt")
+            except LookupError:
+                logger.warning("NLTK 'punkt' не удалось загрузить после попытки. Некоторые функции могут работать некорректно.")
+        _punkt_checked = True
 
+# Версия алгоритма чанкинга. Сохраняется в user_files.chunker_version для каждого файла.
+# Увеличивайте ее при любом изменении chunk_text или его параметров: фоновая задача
+# rechunk_stale_documents перечанкует документы, обработанные старой версией.
+# 1 — предложения без перекрытия, 2 — предложения с перекрытием chunk_overlap.
+CHUNKER_VERSION = 2
 
 def extract_text_from_pdf(file_path: str) -> str:
     try:
+        import fitz
         with fitz.open(file_path) as doc:
             return "".join(page.get_text() for page in doc)
     except Exception as e:
@@ -28,6 +44,7 @@ def extract_text_from_pdf(file_path: str) -> str:
 
 def extract_text_from_docx(file_path: str) -> str:
     try:
+        from docx import Document as DocxDocument
         doc = DocxDocument(file_path)
         return "\n".join(p.text for p in doc.paragraphs if p.text)
     except Exception as e:
@@ -38,23 +55,34 @@ def chunk_text(text: str, chunk_size: int = 1500, chunk_overlap: int = 200) -> l
     if not text or not text.strip(): return []
     try:
         # Используем sent_tokenize, если 'punkt' доступен
+        ensure_nltk_punkt()
+        from nltk.tokenize import sent_tokenize
         sentences = sent_tokenize(text, language="russian")
     except Exception:
         logger.warning("NLTK 'punkt' недоступен или произошла ошибка токенизации. Используется примитивный чанкинг.")
         # Примитивный чанкинг как запасной вариант
         return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size - chunk_overlap)]
     
-    chunks, current_chunk = [], ""
+    chunks, current_sentences, current_len = [], [], 0
     for sentence in sentences:
         # Если добавление предложения превышает размер чанка
-        if len(current_chunk) + len(sentence) + 1 > chunk_size:
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            current_chunk = ""
-        current_chunk += sentence + " "
+        if current_sentences and current_len + len(sentence) + 1 > chunk_size:
+            chunks.append(" ".join(current_sentences).strip())
+            # Переносим последние предложения в новый чанк, чтобы соблюсти chunk_overlap
+            overlap, overlap_len = [], 0
+            for prev_sentence in reversed(current_sentences):
+                if overlap_len + len(prev_sentence) + 1 > chunk_overlap:
+                    break
+                overlap.insert(0, prev_sentence)
+                overlap_len += len(prev_sentence) + 1
+            if overlap_len + len(sentence) + 1 > chunk_size:
+                overlap, overlap_len = [], 0
+            current_sentences, current_len = overlap, overlap_len
+        current_sentences.append(sentence)
+        current_len += len(sentence) + 1
     
-    if current_chunk:
-        chunks.append(current_chunk.strip())
+    if current_sentences:
+        chunks.append(" ".join(current_sentences).strip())
     
     logger.info(f"Текст разделен на {len(chunks)} чанков.")
     return chunks
\ No newline at end of file
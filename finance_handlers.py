@@ -1,76 +1,54 @@
 # finance_handlers.py
 import re
+import asyncio
 import datetime
-import csv
-import io
 import os
 import pytz
-import aiohttp
 import json
-from bs4 import BeautifulSoup
-from PIL import Image
-from pyzbar.pyzbar import decode
-import google.generativeai as genai
-
-from reportlab.lib.pagesizes import A4
-# ... (остальные импорты reportlab)
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import Paragraph, SimpleDocTemplate, Table, TableStyle
-from reportlab.lib import colors
-from reportlab.lib.units import cm
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from collections import defaultdict
+from urllib.parse import urlsplit
 
 from aiogram import F, types
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.filters import CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import ReplyKeyboardRemove, BufferedInputFile
+from aiogram.types import ReplyKeyboardRemove, BufferedInputFile, FSInputFile
 from aiogram.utils.markdown import hbold
 
-from config import logger, GEMINI_API_KEY
+from config import (
+    logger, PDF_PAGINATED_THRESHOLD, STATEMENT_IMPORT_MAX_BYTES, RECEIPT_CACHE_DIR, RECEIPT_CACHE_MAX_BYTES,
+    RECEIPT_ALBUM_DEBOUNCE_SECONDS, RECEIPT_ALBUM_CONCURRENCY, OWNER_TELEGRAM_ID, FX_BASE_CURRENCY, FX_CONSOLIDATED_CURRENCY
+)
 from filters import IsAuthorizedUser
 from keyboards import (
     get_finance_keyboard, get_main_keyboard, get_report_format_keyboard,
     get_books_list_keyboard, get_book_menu_keyboard, get_currency_selection_keyboard,
     get_edit_book_field_keyboard, get_edit_transaction_field_keyboard,
-    get_date_keyboard
+    get_date_keyboard, get_statement_import_cancel_keyboard
 )
 from db import (
-    add_transaction, get_book_balance_summary, get_transactions_by_book,
+    add_transaction, get_book_balance_summary, get_transactions_by_book, iter_transactions_by_book,
     add_book, get_user_books, delete_book, get_book_by_id, update_book_currency,
     update_book_name, get_transaction_by_id, update_transaction, delete_transaction,
-    check_if_url_exists
+    check_if_url_exists, get_book_totals, get_book_content_version,
+    get_book_monthly_summary, get_book_category_summary, bulk_insert_transactions, add_receipt_expenses,
+    set_fx_rates, get_fx_rates, get_consolidated_balance
 )
-
-# --- НАСТРОЙКА GEMINI AI ---
-genai.configure(api_key=GEMINI_API_KEY)
-gemini_model = genai.GenerativeModel('gemini-1.5-flash-latest')
-
-
-# ... (код регистрации шрифтов без изменений)
-FONT_NAME = "TimesNewRoman"
-FONT_NAME_BOLD = "TimesNewRoman-Bold"
-try:
-    local_font_path = os.path.join(os.getcwd(), 'times.ttf')
-    local_font_path_bold = os.path.join(os.getcwd(), 'timesbd.ttf') 
-    if os.path.exists(local_font_path) and os.path.exists(local_font_path_bold):
-        pdfmetrics.registerFont(TTFont(FONT_NAME, local_font_path))
-        pdfmetrics.registerFont(TTFont(FONT_NAME_BOLD, local_font_path_bold))
-    else:
-        FONT_NAME = "Helvetica"
-        FONT_NAME_BOLD = "Helvetica-Bold"
-except Exception as e:
-    logger.error(f"Ошибка при регистрации шрифта для ReportLab: {e}", exc_info=True)
-    FONT_NAME = "Helvetica"
-    FONT_NAME_BOLD = "Helvetica-Bold"
+from reports import (
+    get_currency_symbol, render_pdf_report, render_pdf_report_paginated, report_pool, ReportQueueFull,
+    StreamingCSVReport, report_cache, report_cache_key, MONTH_NAMES, write_parquet_report, ParquetUnavailable,
+    iter_rows_from_batches
+)
+from amounts import parse_amount
+from statement_import import parse_statement, StatementFormatError
+from disk_cache import DiskLRUCache
+from http_client import get_http_session
+from receipt_parser import parse_receipt_html, ReceiptParseError, parser_stats
+from qr_decoder import decode_qr_from_photo
+from llm_client import llm_client
 
 
-CURRENCY_SYMBOLS = {'USD': '$', 'UZS': 'сум', 'RUB': '₽', 'EUR': '€'}
-def get_currency_symbol(currency_code: str) -> str:
-    if not currency_code:
-        return ""
-    return CURRENCY_SYMBOLS.get(currency_code.upper(), currency_code.upper())
 
 class FinanceStates(StatesGroup):
     # ... (все состояния без изменений)
@@ -88,6 +66,7 @@ class FinanceStates(StatesGroup):
     awaiting_expense_date = State()
     awaiting_qr_photo = State()
     awaiting_qr_category = State()
+    awaiting_statement_file = State()
     choosing_report_format_for_book = State()
     awaiting_book_to_edit = State()
     choosing_edit_book_field = State()
@@ -367,38 +346,198 @@ async def process_expense_date(message: types.Message, state: FSMContext):
     except ValueError:
         await message.answer("Неверный формат. Введите ДД.ММ.ГГГГ или нажмите 'Сегодня'.")
 
+RECEIPT_HOST = "soliq.uz"
+
+def is_receipt_url(url: str) -> bool:
+    """Ссылка ведет на фискальный чек: только https и хост soliq.uz или его поддомен."""
+    try:
+        parts = urlsplit(url)
+        hostname = parts.hostname or ""
+    except ValueError:
+        return False
+    return parts.scheme == "https" and (hostname == RECEIPT_HOST or hostname.endswith("." + RECEIPT_HOST))
+
+# Фискальные чеки не меняются после выдачи, поэтому страницу и извлеченный из нее текст
+# можно хранить бессрочно (в пределах лимита размера кэша). В кэш попадают только страницы,
+# которые удалось разобрать: ответ «чек еще не зарегистрирован» или страница ошибки не
+# закрепляются, и повторная попытка снова идет в сеть.
+receipt_cache = DiskLRUCache(RECEIPT_CACHE_DIR, RECEIPT_CACHE_MAX_BYTES)
+
+async def fetch_receipt_html(qr_url: str) -> bytes:
+    """Возвращает HTML страницы чека из кэша или загружает его с soliq.uz."""
+    html_content = await asyncio.to_thread(receipt_cache.get, f"html:{qr_url}")
+    if html_content is not None:
+        logger.info("Страница чека взята из кэша.")
+        return html_content
+    async with get_http_session().get(qr_url) as response:
+        if response.status != 200:
+            raise ConnectionError(f"Не удалось получить доступ к чеку. Статус: {response.status}")
+        return await response.read()
+
+def extract_receipt_text(qr_url: str, html_content: bytes) -> str:
+    """Возвращает текст страницы чека для ИИ (из кэша, если чек уже разбирался)."""
+    cached_text = receipt_cache.get(f"text:{qr_url}")
+    if cached_text is not None:
+        logger.info("Текст чека взят из кэша.")
+        return cached_text.decode("utf-8")
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_content, 'lxml')
+    return soup.body.get_text(separator='\n', strip=True)
+
+async def remember_receipt_page(qr_url: str, html_content: bytes, check_text: str = None):
+    """Кэширует страницу чека (и ее текст) после успешного разбора."""
+    await asyncio.to_thread(receipt_cache.put, f"html:{qr_url}", html_content)
+    if check_text is not None:
+        await asyncio.to_thread(receipt_cache.put, f"text:{qr_url}", check_text.encode("utf-8"))
+
+async def parse_receipt_with_gemini(check_text: str) -> dict:
+    """Разбирает текст чека через Gemini. Возвращает данные в формате receipt_parser.parse_receipt_html."""
+    prompt = f"""
+    Ты — эксперт по анализу фискальных чеков из Узбекистана. Проанализируй следующий текст, извлеченный со страницы чека.
+    Твоя задача — вернуть JSON объект со следующей структурой:
+    - "total_sum": число, итоговая сумма чека (найди строку "Jami to`lov").
+    - "check_date": строка, дата и время в формате "YYYY-MM-DD HH:MM:SS".
+    - "items": массив объектов, где каждый объект представляет товар со следующими ключами: "name", "quantity", "price_total".
+
+    Если не можешь найти какое-то значение, используй null. Не выдумывай данные.
+    В поле "check_date" используй дату и время с чека, а не текущие.
+
+    Вот текст чека:
+    ---
+    {check_text}
+    ---
+    """
+
+    logger.info("Отправка запроса в Gemini AI для анализа чека.")
+    response_text = await llm_client.generate(prompt)
+
+    try:
+        json_text = response_text.replace('```json', '').replace('```', '').strip()
+        parsed_data = json.loads(json_text)
+        logger.info(f"Получены структурированные данные от Gemini: {parsed_data}")
+
+        total_sum = float(parsed_data.get("total_sum") or 0)
+        check_date_str = parsed_data.get("check_date")
+        items = parsed_data.get("items") or []
+
+        if total_sum <= 0 or not check_date_str or not items:
+            raise ValueError("ИИ не смог извлечь все необходимые данные из чека.")
+        return {"total_sum": total_sum, "check_date": datetime.datetime.fromisoformat(check_date_str), "items": items}
+    except Exception:
+        # Непригодный ответ не должен возвращаться из кэша при повторной попытке
+        llm_client.forget(prompt)
+        raise
+
+async def analyze_receipt(qr_url: str) -> dict:
+    """
+    Извлекает сумму, дату и позиции чека. Сначала страница разбирается локально
+    (receipt_parser); Gemini вызывается, только если локальный разбор не прошел проверку.
+    """
+    html_content = await fetch_receipt_html(qr_url)
+    try:
+        receipt = parse_receipt_html(html_content)
+        parser_stats["local"] += 1
+        await remember_receipt_page(qr_url, html_content)
+        return receipt
+    except ReceiptParseError as e:
+        logger.warning(f"Локальный разбор чека не удался ({e}), используется Gemini.")
+        parser_stats["llm_fallback"] += 1
+
+    check_text = await asyncio.to_thread(extract_receipt_text, qr_url, html_content)
+    try:
+        receipt = await parse_receipt_with_gemini(check_text)
+    except Exception:
+        parser_stats["llm_failed"] += 1
+        raise
+    await remember_receipt_page(qr_url, html_content, check_text)
+    return receipt
+
+def format_receipt_description(transaction_dt: datetime.datetime, items: list[dict]) -> str:
+    description_items = [f"Чек от {transaction_dt.strftime('%d.%m.%Y')}"]
+    for item in items:
+        name = item.get("name") or "Неизвестный товар"
+        quantity = float(item.get("quantity") or 1.0)
+        price_total = float(item.get("price_total") or 0.0)
+        price_per_unit = price_total / quantity if quantity != 0 else 0
+        description_items.append(
+            f"- {name} ({quantity} шт x {price_per_unit:,.2f}) = {price_total:,.2f} сум"
+        )
+    return "\n".join(description_items)
+
+
 async def handle_scan_qr_button(message: types.Message, state: FSMContext):
     """Запрашивает фото QR-кода."""
     user_data = await state.get_data()
     if not user_data.get('current_book_id'):
         await message.answer("Сначала выберите книгу из меню 'Мои книги 📚'.", reply_markup=get_finance_keyboard())
         return
+    # Новый сеанс сканирования: чеки, брошенные в прошлый раз без категории, не должны попасть в запись
+    await state.update_data(qr_batch=None, qr_check_url=None)
     await message.answer("Пожалуйста, отправьте фотографию с QR-кодом чека.", reply_markup=ReplyKeyboardRemove())
     await state.set_state(FinanceStates.awaiting_qr_photo)
 
 
+# Фото альбомов, ожидающие обработки: (user_id, media_group_id) -> {"messages": [...], "task": Task}
+_receipt_albums = {}
+# Сводка альбома дописывается в qr_batch под блокировкой пользователя: пачки, обработанные
+# одновременно (фото пришли после паузы), не затирают друг друга
+_receipt_batch_locks = defaultdict(asyncio.Lock)
+
+
 async def process_qr_photo(message: types.Message, state: FSMContext):
-    """Обрабатывает полученное фото с QR-кодом с помощью Gemini AI."""
+    """Обрабатывает полученное фото с QR-кодом: локальный разбор чека, при неудаче — Gemini AI."""
     if not message.photo:
         await message.answer("Пожалуйста, отправьте именно фотографию.")
         return
 
-    await message.answer("🤖 Анализирую чек с помощью ИИ, это может занять несколько секунд...")
+    if message.media_group_id:
+        # Фото альбома приходят отдельными сообщениями: собираем их и обрабатываем вместе,
+        # когда новые фото перестают поступать
+        album_key = (message.from_user.id, message.media_group_id)
+        album = _receipt_albums.setdefault(album_key, {"messages": [], "task": None})
+        album["messages"].append(message)
+        if album["task"]:
+            album["task"].cancel()
+        album["task"] = asyncio.create_task(_process_receipt_album_after_debounce(album_key, state))
+        return
+
+    await message.answer("🔍 Анализирую чек, это может занять несколько секунд...")
 
-    photo_file = await message.bot.get_file(message.photo[-1].file_id)
-    photo_bytes = await message.bot.download_file(photo_file.file_path)
-    
     try:
-        img = Image.open(io.BytesIO(photo_bytes.read()))
-        decoded_objects = decode(img)
+        qr_url = await decode_qr_from_photo(message.bot, message.photo)
+    except Exception as e:
+        logger.error(f"Ошибка распознавания фото с QR: {e}", exc_info=True)
+        await message.answer(f"Не удалось обработать QR-код. Попробуйте еще раз или введите расход вручную.\nОшибка: `{e}`")
+        return
+    if not qr_url:
+        await message.answer("QR-код на фото не найден. Попробуйте сделать более четкое фото.")
+        return
 
-        if not decoded_objects:
-            await message.answer("QR-код на фото не найден. Попробуйте сделать более четкое фото.")
-            return
+    await process_receipt_url(message, state, qr_url)
 
-        qr_url = decoded_objects[0].data.decode("utf-8")
-        logger.info(f"Распознан URL из QR: {qr_url}")
-        
+
+async def process_qr_webapp_data(message: types.Message, state: FSMContext):
+    """Принимает ссылку на чек, распознанную сканером WebApp (qr_scanner.html) на телефоне."""
+    user_data = await state.get_data()
+    if not user_data.get('current_book_id'):
+        await message.answer("Сначала выберите книгу из меню 'Мои книги 📚'.", reply_markup=get_finance_keyboard())
+        return
+    qr_url = (message.web_app_data.data or "").strip()
+    if not qr_url:
+        await message.answer("Сканер не передал данные QR-кода. Попробуйте еще раз.")
+        return
+    if not is_receipt_url(qr_url):
+        await message.answer("❌ Это не ссылка на фискальный чек soliq.uz.")
+        return
+    await state.update_data(qr_batch=None, qr_check_url=None)
+    await message.answer("🔍 Анализирую чек, это может занять несколько секунд...")
+    await process_receipt_url(message, state, qr_url)
+
+
+async def process_receipt_url(message: types.Message, state: FSMContext, qr_url: str):
+    """Общий путь для ссылки на чек (из фото или WebApp): проверка, поиск дубликата, разбор и запрос категории."""
+    logger.info(f"Распознан URL из QR: {qr_url}")
+    try:
         # ПРОВЕРКА НА ДУБЛИКАТ
         if await check_if_url_exists(qr_url):
             await message.answer("❌ Этот чек уже был добавлен в базу данных ранее.")
@@ -408,61 +547,13 @@ async def process_qr_photo(message: types.Message, state: FSMContext):
             await message.answer("Выберите действие:", reply_markup=get_book_menu_keyboard(user_data['current_book_name']))
             return
 
-        if "ofd.soliq.uz" not in qr_url:
+        if not is_receipt_url(qr_url):
             raise ValueError("QR-код не является фискальным чеком soliq.uz.")
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(qr_url) as response:
-                if response.status != 200:
-                    raise ConnectionError(f"Не удалось получить доступ к чеку. Статус: {response.status}")
-                html_content = await response.text()
-
-        soup = BeautifulSoup(html_content, 'lxml')
-        check_text = soup.body.get_text(separator='\n', strip=True)
-
-        prompt = f"""
-        Ты — эксперт по анализу фискальных чеков из Узбекистана. Проанализируй следующий текст, извлеченный со страницы чека.
-        Твоя задача — вернуть JSON объект со следующей структурой:
-        - "total_sum": число, итоговая сумма чека (найди строку "Jami to`lov").
-        - "check_date": строка, дата и время в формате "YYYY-MM-DD HH:MM:SS".
-        - "items": массив объектов, где каждый объект представляет товар со следующими ключами: "name", "quantity", "price_total".
-
-        Если не можешь найти какое-то значение, используй null. Не выдумывай данные.
-        В поле "check_date" используй дату и время с чека, а не текущие.
-
-        Вот текст чека:
-        ---
-        {check_text}
-        ---
-        """
-        
-        logger.info("Отправка запроса в Gemini AI для анализа чека.")
-        response = await gemini_model.generate_content_async(prompt)
-        
-        json_text = response.text.replace('```json', '').replace('```', '').strip()
-        parsed_data = json.loads(json_text)
-        logger.info(f"Получены структурированные данные от Gemini: {parsed_data}")
-
-        total_sum = float(parsed_data.get("total_sum", 0))
-        check_date_str = parsed_data.get("check_date")
-        items = parsed_data.get("items", [])
-
-        if total_sum <= 0 or not check_date_str or not items:
-            raise ValueError("ИИ не смог извлечь все необходимые данные из чека.")
-
-        transaction_dt = datetime.datetime.fromisoformat(check_date_str)
-        
-        description_items = [f"Чек от {transaction_dt.strftime('%d.%m.%Y')}"]
-        for item in items:
-            name = item.get("name", "Неизвестный товар")
-            quantity = float(item.get("quantity", 1.0))
-            price_total = float(item.get("price_total", 0.0))
-            price_per_unit = price_total / quantity if quantity != 0 else 0
-            description_items.append(
-                f"- {name} ({quantity} шт x {price_per_unit:,.2f}) = {price_total:,.2f} сум"
-            )
-        
-        description = "\n".join(description_items)
+        receipt = await analyze_receipt(qr_url)
+        total_sum = receipt["total_sum"]
+        transaction_dt = receipt["check_date"]
+        description = format_receipt_description(transaction_dt, receipt["items"])
 
         await state.update_data(
             qr_amount=total_sum,
@@ -480,10 +571,89 @@ async def process_qr_photo(message: types.Message, state: FSMContext):
         await state.set_state(FinanceStates.awaiting_qr_category)
 
     except Exception as e:
-        logger.error(f"Ошибка обработки фото с QR: {e}", exc_info=True)
+        logger.error(f"Ошибка обработки чека по QR: {e}", exc_info=True)
         await message.answer(f"Не удалось обработать QR-код. Попробуйте еще раз или введите расход вручную.\nОшибка: `{e}`")
 
 
+async def _process_receipt_album_after_debounce(album_key: tuple, state: FSMContext):
+    await asyncio.sleep(RECEIPT_ALBUM_DEBOUNCE_SECONDS)
+    album = _receipt_albums.pop(album_key)
+    try:
+        await process_receipt_album(album["messages"], state)
+    except Exception as e:
+        logger.error(f"Ошибка обработки альбома чеков: {e}", exc_info=True)
+        await album["messages"][0].answer("Не удалось обработать альбом чеков. Попробуйте еще раз.")
+
+
+async def _recognize_album_receipt(message: types.Message, semaphore: asyncio.Semaphore) -> dict:
+    """Распознает QR на одном фото альбома и разбирает чек. Ошибки возвращаются в поле error."""
+    async with semaphore:
+        try:
+            qr_url = await decode_qr_from_photo(message.bot, message.photo)
+            if not qr_url:
+                return {"error": "QR-код не найден"}
+            if not is_receipt_url(qr_url):
+                return {"error": "не чек soliq.uz"}
+            if await check_if_url_exists(qr_url):
+                return {"error": "уже добавлен ранее", "url": qr_url}
+            receipt = await analyze_receipt(qr_url)
+            return {"url": qr_url, "receipt": receipt}
+        except Exception as e:
+            logger.error(f"Ошибка обработки чека из альбома: {e}", exc_info=True)
+            return {"error": str(e)}
+
+
+async def process_receipt_album(messages: list[types.Message], state: FSMContext):
+    """
+    Обрабатывает все фото альбома одновременно (не больше RECEIPT_ALBUM_CONCURRENCY за раз),
+    показывает одну сводку и запрашивает одну категорию для всех распознанных чеков.
+    """
+    first_message = messages[0]
+    await first_message.answer(f"🔍 Анализирую {len(messages)} чек(ов), это может занять несколько секунд...")
+
+    semaphore = asyncio.Semaphore(RECEIPT_ALBUM_CONCURRENCY)
+    results = await asyncio.gather(*(_recognize_album_receipt(message, semaphore) for message in messages))
+
+    receipts, failures, seen_urls = [], [], set()
+    for index, result in enumerate(results, start=1):
+        if "receipt" in result and result["url"] in seen_urls:
+            result = {"error": "повтор в альбоме"}
+        if "receipt" not in result:
+            failures.append(f"Фото {index}: {result['error']}")
+            continue
+        seen_urls.add(result["url"])
+        receipt = result["receipt"]
+        receipts.append({
+            "amount": receipt["total_sum"],
+            "description": format_receipt_description(receipt["check_date"], receipt["items"]),
+            "date": receipt["check_date"].strftime("%Y-%m-%d %H:%M:%S"),
+            "check_url": result["url"],
+        })
+
+    lines = [f"🧾 Распознано чеков: {len(receipts)} из {len(messages)}."]
+    for receipt in receipts:
+        amount = receipt["amount"]
+        lines.append(f"• {receipt['date'][:10]}: {hbold(f'{amount:,.2f} сум')}")
+    if failures:
+        lines += ["", hbold("Не удалось:")] + failures
+
+    if not receipts:
+        await first_message.answer("\n".join(lines), parse_mode="HTML")
+        return
+
+    async with _receipt_batch_locks[first_message.from_user.id]:
+        pending = (await state.get_data()).get('qr_batch') or []
+        pending_urls = {receipt["check_url"] for receipt in pending}
+        batch = pending + [receipt for receipt in receipts if receipt["check_url"] not in pending_urls]
+        await state.update_data(qr_batch=batch)
+        await state.set_state(FinanceStates.awaiting_qr_category)
+    if len(batch) > len(receipts):
+        lines += ["", f"Вместе с ранее распознанными чеков ожидает категории: {len(batch)}."]
+    total = sum(receipt["amount"] for receipt in batch)
+    lines += ["", f"Итого: {hbold(f'{total:,.2f} сум')}", "Введите категорию для этих расходов."]
+    await first_message.answer("\n".join(lines), parse_mode="HTML")
+
+
 async def process_qr_category(message: types.Message, state: FSMContext):
     if not message.text:
         await message.answer("Пожалуйста, введите название категории текстом.")
@@ -497,6 +667,26 @@ async def process_qr_category(message: types.Message, state: FSMContext):
         await state.clear()
         return
 
+    if user_data.get('qr_batch'):
+        # Чеки из альбома записываются одной транзакцией БД — вместе с чеком, отсканированным
+        # отдельно в том же сеансе, если он тоже ждет категории
+        receipts = list(user_data['qr_batch'])
+        if user_data.get('qr_check_url') and user_data['qr_check_url'] not in {r['check_url'] for r in receipts}:
+            receipts.append({
+                "amount": user_data['qr_amount'], "description": user_data['qr_description'],
+                "date": user_data['qr_date'], "check_url": user_data['qr_check_url'],
+            })
+        inserted = await add_receipt_expenses(
+            message.from_user.id, user_data['current_book_id'],
+            [(r['amount'], r['description'], r['date'], r['check_url']) for r in receipts], category
+        )
+        await message.answer(
+            f"✅ Записано расходов по чекам: {inserted} из {len(receipts)} в категорию «{hbold(category)}».",
+            parse_mode="HTML", reply_markup=get_book_menu_keyboard(user_data['current_book_name'])
+        )
+        await state.clear()
+        return
+
     await add_transaction(
         user_id=message.from_user.id,
         book_id=user_data['current_book_id'],
@@ -510,6 +700,69 @@ async def process_qr_category(message: types.Message, state: FSMContext):
     await message.answer(f"✅ Расход по QR записан в категорию «{hbold(category)}».", parse_mode="HTML", reply_markup=get_book_menu_keyboard(user_data['current_book_name']))
     await state.clear()
 
+async def handle_import_statement_button(message: types.Message, state: FSMContext):
+    """Запрашивает CSV-выписку для массового импорта."""
+    user_data = await state.get_data()
+    if not user_data.get('current_book_id'):
+        await message.answer("Сначала выберите книгу из меню 'Мои книги 📚'.", reply_markup=get_finance_keyboard())
+        return
+    await message.answer(
+        "Отправьте выписку в формате CSV. Нужны колонки с датой и суммой (например, «Дата» и «Сумма»); "
+        "колонки «Тип», «Категория» и «Описание» необязательны. Без колонки типа отрицательная сумма считается расходом.\n"
+        "Строки, совпадающие по дню, типу и сумме с операциями, внесенными вручную, не добавляются повторно.",
+        reply_markup=get_statement_import_cancel_keyboard()
+    )
+    await state.set_state(FinanceStates.awaiting_statement_file)
+
+
+async def process_statement_import_cancel(callback: types.CallbackQuery, state: FSMContext):
+    user_data = await state.get_data()
+    await callback.message.edit_text("Импорт выписки отменен.")
+    await callback.message.answer("Выберите действие:", reply_markup=get_book_menu_keyboard(user_data.get('current_book_name')))
+    await state.set_state(None)
+    await callback.answer()
+
+
+async def process_statement_file(message: types.Message, state: FSMContext):
+    """Разбирает CSV-выписку в отдельном потоке и вставляет все строки одной транзакцией БД."""
+    user_data = await state.get_data()
+    book_id = user_data.get('current_book_id')
+    book_name = user_data.get('current_book_name')
+    if not book_id:
+        await message.answer("Сессия выбора книги истекла. Пожалуйста, выберите книгу заново.", reply_markup=get_finance_keyboard())
+        await state.clear()
+        return
+    document = message.document
+    if not document or not (document.file_name or "").lower().endswith(".csv"):
+        await message.answer("Пожалуйста, отправьте файл с расширением .csv.")
+        return
+    if document.file_size and document.file_size > STATEMENT_IMPORT_MAX_BYTES:
+        await message.answer(f"Файл слишком большой. Максимальный размер — {STATEMENT_IMPORT_MAX_BYTES // (1024 * 1024)} МБ.")
+        return
+
+    await message.answer("⏳ Импортирую выписку...")
+    try:
+        file_info = await message.bot.get_file(document.file_id)
+        data = (await message.bot.download_file(file_info.file_path)).read()
+        rows, skipped = await asyncio.to_thread(parse_statement, data, book_id)
+    except StatementFormatError:
+        await message.answer("Не нашел в файле колонок с датой и суммой. Проверьте заголовки и отправьте файл снова.")
+        return
+    except Exception as e:
+        logger.error(f"Ошибка импорта выписки в книгу {book_id}: {e}", exc_info=True)
+        await message.answer("❌ Не удалось прочитать файл.", reply_markup=get_book_menu_keyboard(book_name))
+        await state.set_state(None)
+        return
+
+    inserted, duplicates, manual_matches = await bulk_insert_transactions(message.from_user.id, book_id, rows)
+    await message.answer(
+        f"✅ Импорт в «{hbold(book_name)}» завершен.\n"
+        f"Добавлено: {inserted}\nДубликатов пропущено: {duplicates}\n"
+        f"Уже внесены вручную: {manual_matches}\nСтрок с ошибками: {skipped}",
+        parse_mode="HTML", reply_markup=get_book_menu_keyboard(book_name)
+    )
+    await state.set_state(None)
+
 async def handle_book_balance_button(message: types.Message, state: FSMContext):
     # ... (код без изменений)
     user_data = await state.get_data()
@@ -526,6 +779,142 @@ async def handle_book_balance_button(message: types.Message, state: FSMContext):
     balance = total_income - total_expense
     await message.answer(f"📊 Баланс «{hbold(book_name)}»:\n⬆️ Доходы: {total_income:.2f} {symbol}\n⬇️ Расходы: {total_expense:.2f} {symbol}\n💰 Итог: {hbold(f'{balance:.2f} {symbol}')}", parse_mode="HTML")
 
+async def handle_book_monthly_summary_button(message: types.Message, state: FSMContext):
+    """Доходы и расходы по последним месяцам книги (из таблицы агрегатов)."""
+    user_data = await state.get_data()
+    book_id = user_data.get('current_book_id')
+    book_name = user_data.get('current_book_name')
+    if not book_id:
+        await message.answer("Пожалуйста, сначала выберите книгу из меню 'Мои книги 📚'.", reply_markup=get_finance_keyboard())
+        return
+
+    rows = await get_book_monthly_summary(message.from_user.id, book_id)
+    if not rows:
+        await message.answer(f"В книге «{hbold(book_name)}» нет транзакций.", parse_mode="HTML")
+        return
+    symbol = get_currency_symbol(user_data.get('current_book_currency'))
+    lines = [f"📅 «{hbold(book_name)}» по месяцам:"]
+    for month, income, expense, count in rows:
+        year, month_number = month.split("-")
+        lines.append(
+            f"\n{hbold(f'{MONTH_NAMES[int(month_number) - 1]} {year}')} ({count} тр.)\n"
+            f"⬆️ {income:.2f} {symbol}  ⬇️ {expense:.2f} {symbol}  💰 {income - expense:.2f} {symbol}"
+        )
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+async def handle_book_category_summary_button(message: types.Message, state: FSMContext):
+    """Суммы по категориям книги за все время (из таблицы агрегатов)."""
+    user_data = await state.get_data()
+    book_id = user_data.get('current_book_id')
+    book_name = user_data.get('current_book_name')
+    if not book_id:
+        await message.answer("Пожалуйста, сначала выберите книгу из меню 'Мои книги 📚'.", reply_markup=get_finance_keyboard())
+        return
+
+    rows = await get_book_category_summary(message.from_user.id, book_id)
+    if not rows:
+        await message.answer(f"В книге «{hbold(book_name)}» нет транзакций.", parse_mode="HTML")
+        return
+    symbol = get_currency_symbol(user_data.get('current_book_currency'))
+    sections = {"expense": [], "income": []}
+    for t_type, category, total, count in rows:
+        sections.setdefault(t_type, []).append(f"• {category or 'Без категории'}: {total:.2f} {symbol} ({count})")
+    lines = [f"🗂️ «{hbold(book_name)}» по категориям:"]
+    if sections["expense"]:
+        lines += ["", hbold("⬇️ Расходы:")] + sections["expense"]
+    if sections["income"]:
+        lines += ["", hbold("⬆️ Доходы:")] + sections["income"]
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+async def handle_consolidated_balance_button(message: types.Message, state: FSMContext):
+    """Сводный баланс всех книг пользователя в FX_CONSOLIDATED_CURRENCY (один SQL-запрос с пересчетом по курсам)."""
+    rows = await get_consolidated_balance(message.from_user.id, FX_CONSOLIDATED_CURRENCY)
+    if not rows:
+        await message.answer("У вас пока нет книг учета.", reply_markup=get_finance_keyboard())
+        return
+
+    target_symbol = get_currency_symbol(FX_CONSOLIDATED_CURRENCY)
+    lines = [f"💱 {hbold('Сводный баланс всех книг')}:"]
+    total, missing_currencies = 0.0, set()
+    for _, name, currency, income, expense, converted in rows:
+        line = f"• {name}: {income - expense:,.2f} {get_currency_symbol(currency)}"
+        if converted is None:
+            missing_currencies.add(currency)
+        else:
+            total += converted
+            if currency != FX_CONSOLIDATED_CURRENCY:
+                line += f" ≈ {converted:,.2f} {target_symbol}"
+        lines.append(line)
+    lines.append(f"\n💰 Итого: {hbold(f'{total:,.2f} {target_symbol}')}")
+    if missing_currencies:
+        lines.append(f"⚠️ Нет курса для: {', '.join(sorted(missing_currencies))} — эти книги не вошли в итог.")
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
+def parse_fx_rates(text: str) -> dict[str, float]:
+    """
+    Разбирает курсы из текста вида "UZS 12650" или "UZS,12650" (по одному или несколько через строки/пробелы).
+    Курс разбирается строго (amounts.parse_amount): «12,850» отклоняется как неоднозначный.
+    """
+    # Разделитель после кода валюты может быть запятой, а в самом курсе запятая — десятичный знак
+    normalized = re.sub(r"([A-Za-z]{3})\s*[,;=:]\s*", r"\1 ", text.strip())
+    tokens = re.split(r"[\s;]+", normalized)
+    if len(tokens) % 2:
+        raise ValueError("Ожидаются пары ВАЛЮТА КУРС.")
+    rates = {}
+    for currency, rate in zip(tokens[::2], tokens[1::2]):
+        if not re.fullmatch(r"[A-Za-z]{3}", currency):
+            raise ValueError(f"Некорректный код валюты: {currency}")
+        value = parse_amount(rate)
+        if value <= 0:
+            raise ValueError(f"Курс должен быть положительным: {rate}")
+        rates[currency.upper()] = value
+    return rates
+
+
+async def load_fx_rates_file(path: str) -> int:
+    """Загружает курсы из файла (если он есть). Возвращает число загруженных курсов."""
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding="utf-8") as f:
+        lines = [line for line in f if line.strip() and not line.lstrip().startswith("#")]
+    rates = parse_fx_rates(" ".join(lines))
+    await set_fx_rates(rates)
+    logger.info(f"Загружено курсов валют из '{path}': {len(rates)}.")
+    return len(rates)
+
+
+async def handle_fx_command(message: types.Message, command: CommandObject = None):
+    """
+    /fx — показать курсы; /fx UZS 12650 EUR 0.92 — задать курсы (только владелец);
+    файл с подписью /fx — загрузить курсы из файла (строки "ВАЛЮТА,КУРС").
+    """
+    args = (command.args if command else None) or ""
+    if not args and not message.document:
+        rates = await get_fx_rates()
+        if not rates:
+            await message.answer(f"Курсы не заданы. Пример: /fx UZS 12650 (единиц валюты за 1 {FX_BASE_CURRENCY}).")
+            return
+        lines = [f"💱 Курсы за 1 {FX_BASE_CURRENCY}:"] + [f"• {currency}: {rate:g} (обновлен {updated_at})" for currency, rate, updated_at in rates]
+        await message.answer("\n".join(lines))
+        return
+
+    if message.from_user.id != OWNER_TELEGRAM_ID:
+        await message.answer("❌ Изменять курсы может только владелец бота.")
+        return
+    try:
+        if message.document:
+            file_info = await message.bot.get_file(message.document.file_id)
+            content = (await message.bot.download_file(file_info.file_path)).read().decode("utf-8-sig")
+            args = " ".join(line for line in content.splitlines() if line.strip() and not line.lstrip().startswith("#"))
+        rates = parse_fx_rates(args)
+    except (ValueError, UnicodeDecodeError) as e:
+        await message.answer(f"Не удалось разобрать курсы: {e}")
+        return
+    await set_fx_rates(rates)
+    await message.answer("✅ Курсы сохранены: " + ", ".join(f"{currency} {rate:g}" for currency, rate in rates.items()))
+
+
 async def handle_book_report_button(message: types.Message, state: FSMContext):
     # ... (код без изменений)
     user_data = await state.get_data()
@@ -552,100 +941,78 @@ async def choose_report_format_for_book(callback: types.CallbackQuery, state: FS
         await callback.message.edit_text("Сессия выбора книги истекла. Пожалуйста, выберите книгу заново.")
         await state.clear()
         return
-        
-    transactions = await get_transactions_by_book(callback.from_user.id, book_id)
-    if not transactions:
+
+    file_name_prefix = f"report_{book_name}_{datetime.date.today()}"
+
+    # Если книга не менялась с прошлого отчета того же формата — отдаем его из кэша
+    content_version = await get_book_content_version(callback.from_user.id, book_id)
+    cache_key = report_cache_key(book_id, report_format, content_version)
+    cached_path = await asyncio.to_thread(report_cache.get_path, cache_key)
+    if cached_path:
+        try:
+            await callback.message.answer_document(FSInputFile(cached_path, filename=f"{file_name_prefix}.{report_format}"), caption=f"Ваш {report_format.upper()} отчет.")
+            await state.set_state(None)
+            return
+        except (FileNotFoundError, TelegramNetworkError) as e:
+            # Файл мог быть вытеснен другим запросом между get_path и отправкой — формируем отчет заново
+            logger.warning(f"Не удалось отправить отчет из кэша для книги {book_id}: {e}. Отчет будет сформирован заново.")
+
+    # Итоги и количество строк считаются в SQL, без загрузки транзакций в память
+    total_income, total_expense, transactions_count = await get_book_totals(callback.from_user.id, book_id)
+    if not transactions_count:
         await callback.message.edit_text(f"В книге «{hbold(book_name)}» нет транзакций.", parse_mode="HTML")
         await state.set_state(None)
         return
 
     await callback.message.edit_text(f"Готовлю {report_format.upper()} отчет...")
-    file_name_prefix = f"report_{book_name}_{datetime.date.today()}"
-    
-    total_income = sum(t['amount'] for t in transactions if t['type'] == 'income')
-    total_expense = sum(t['amount'] for t in transactions if t['type'] == 'expense')
-    balance = total_income - total_expense
 
     if report_format == "csv":
-        string_io = io.StringIO()
-        type_map = {"income": "Доход", "expense": "Расход"}
-        writer = csv.writer(string_io)
-        writer.writerow(["ID", "Дата", "Тип", "Сумма", "Валюта", "Категория", "Описание"])
-        for t in transactions:
-            writer.writerow([t['id'], t['transaction_date'], type_map.get(t['type'], t['type']), t['amount'], book_currency, t['category'], t['description']])
-        
-        writer.writerow([]) 
-        writer.writerow(['', '', 'Общая сумма Доходов', f'{total_income:.2f}', book_currency])
-        writer.writerow(['', '', 'Общая сумма Расходов', f'{total_expense:.2f}', book_currency])
-        writer.writerow(['', '', 'Баланс', f'{balance:.2f}', book_currency])
-
-        file = BufferedInputFile(string_io.getvalue().encode('utf-8-sig'), filename=f"{file_name_prefix}.csv")
-    
+        # CSV читается из БД пачками прямо во время отправки файла
+        file = StreamingCSVReport(
+            callback.from_user.id, book_id, book_currency, total_income, total_expense,
+            filename=f"{file_name_prefix}.csv", cache=report_cache, cache_key=cache_key
+        )
     elif report_format == "pdf":
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1.5*cm, bottomMargin=1.5*cm, leftMargin=1.5*cm, rightMargin=1.5*cm)
-        
-        styles = getSampleStyleSheet()
-        income_color = colors.HexColor("#000080")
-        expense_color = colors.HexColor("#FF0000")
-        title_color = colors.HexColor("#0000CD")
-
-        title_style = ParagraphStyle(name='TitleStyle', fontName=FONT_NAME_BOLD, fontSize=16, alignment=TA_CENTER, spaceAfter=12)
-        header_style = ParagraphStyle(name='HeaderStyle', fontName=FONT_NAME_BOLD, fontSize=10, alignment=TA_CENTER, textColor=colors.whitesmoke)
-        
-        base_body_style = ParagraphStyle(name='BaseBody', fontName=FONT_NAME, fontSize=9, alignment=TA_LEFT)
-        income_style = ParagraphStyle(name='IncomeStyle', parent=base_body_style, textColor=income_color)
-        expense_style = ParagraphStyle(name='ExpenseStyle', parent=base_body_style, textColor=expense_color)
-
-        summary_label_style = ParagraphStyle(name='SummaryLabel', fontName=FONT_NAME_BOLD, fontSize=10, alignment=TA_RIGHT)
-        summary_value_style = ParagraphStyle(name='SummaryValue', fontName=FONT_NAME, fontSize=10, alignment=TA_LEFT)
-        
-        type_map = {"income": "Доход", "expense": "Расход"}
-        headers = ["ID", "Дата", "Тип", "Сумма", "Категория", "Описание"]
-        data = [[Paragraph(h, header_style) for h in headers]]
-
-        for t in transactions:
-            row_style = income_style if t['type'] == 'income' else expense_style
-            row = [
-                Paragraph(str(t['id']), row_style),
-                Paragraph(datetime.datetime.fromisoformat(t['transaction_date']).strftime('%d.%m.%y %H:%M'), row_style),
-                Paragraph(type_map.get(t['type'], t['type']), row_style),
-                Paragraph(f"{t['amount']:.2f}", row_style),
-                Paragraph(t['category'] or '', row_style),
-                Paragraph(t['description'] or '', row_style),
-            ]
-            data.append(row)
-
-        data.append(['', '', '', '', '', ''])
-        currency_str = get_currency_symbol(book_currency)
-        data.append([
-            '', '', Paragraph('Общая сумма Доходов', summary_label_style), Paragraph(f'{total_income:.2f} {currency_str}', summary_value_style), '', ''
-        ])
-        data.append([
-            '', '', Paragraph('Общая сумма Расходов', summary_label_style), Paragraph(f'{total_expense:.2f} {currency_str}', summary_value_style), '', ''
-        ])
-        data.append([
-            '', '', Paragraph('Баланс', summary_label_style), Paragraph(f'{balance:.2f} {currency_str}', summary_value_style), '', ''
-        ])
-
-        table = Table(data, colWidths=[cm, 2.5*cm, 3.5*cm, 3*cm, 3*cm, 4*cm])
-        
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('GRID', (0, 0), (-1, -5), 1, colors.black),
-            ('GRID', (2, -3), (3, -1), 1, colors.black),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('SPAN', (3, -4), (5, -4)),
-            ('SPAN', (0, -4), (1, -4)),
-            ('BACKGROUND', (2, -1), (3, -1), colors.lightgrey),
-        ]))
-        
-        title_text = f"Отчет по книге: <font color='{title_color.hexval()}'>{book_name}</font>"
-        title_paragraph = Paragraph(title_text, title_style)
-        
-        elements = [title_paragraph, table]
-        doc.build(elements)
-        file = BufferedInputFile(buffer.getvalue(), filename=f"{file_name_prefix}.pdf")
+        # Большие книги рисуются постраничным движком на LongTable с разбивкой по месяцам
+        render_func = render_pdf_report_paginated if transactions_count > PDF_PAGINATED_THRESHOLD else render_pdf_report
+        # Рендеринг выполняется в пуле потоков, чтобы не блокировать остальных пользователей.
+        # Строки подаются движку пачками (каждая — отдельный короткий запрос), без сбора всей книги
+        # в список и без открытого на все время рендеринга чтения, которое блокировало бы запись в БД.
+        batches = iter_transactions_by_book(callback.from_user.id, book_id)
+        rows = iter_rows_from_batches(batches, asyncio.get_running_loop())
+        try:
+            content = await report_pool.render(render_func, rows, book_name, book_currency, total_income, total_expense)
+        except ReportQueueFull:
+            await callback.message.edit_text("⏳ Сейчас формируется слишком много отчетов. Попробуйте через минуту.")
+            await state.set_state(None)
+            return
+        except Exception as e:
+            logger.error(f"Ошибка формирования PDF отчета для книги {book_id}: {e}", exc_info=True)
+            await callback.message.edit_text("❌ Не удалось сформировать отчет.")
+            await state.set_state(None)
+            return
+        finally:
+            await batches.aclose()
+        await asyncio.to_thread(report_cache.put, cache_key, content)
+        file = BufferedInputFile(content, filename=f"{file_name_prefix}.pdf")
+    elif report_format == "parquet":
+        # Parquet пишется группами строк прямо из курсора во временный файл каталога кэша;
+        # после отправки файл переносится в кэш без копирования
+        temp_path = await asyncio.to_thread(report_cache.new_temp_path)
+        try:
+            await write_parquet_report(callback.from_user.id, book_id, book_name, book_currency, temp_path)
+            await callback.message.answer_document(FSInputFile(temp_path, filename=f"{file_name_prefix}.parquet"), caption="Ваш PARQUET отчет.")
+            await asyncio.to_thread(report_cache.put_file, cache_key, temp_path)
+        except ParquetUnavailable:
+            await callback.message.edit_text("❌ Выгрузка в Parquet недоступна: на сервере не установлен pyarrow.")
+        except Exception as e:
+            logger.error(f"Ошибка формирования Parquet отчета для книги {book_id}: {e}", exc_info=True)
+            await callback.message.edit_text("❌ Не удалось сформировать отчет.")
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        await state.set_state(None)
+        return
 
     await callback.message.answer_document(file, caption=f"Ваш {report_format.upper()} отчет.")
     await state.set_state(None)
@@ -0,0 +1,56 @@
+# http_client.py
+"""
+Общий для всего приложения aiohttp.ClientSession.
+Сессия создается в main() и закрывается при остановке бота; соединения
+переиспользуются (keep-alive), DNS кэшируется, таймауты заданы явно.
+"""
+import aiohttp
+
+from config import (
+    logger, HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL,
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_TOTAL_TIMEOUT
+)
+
+_session: aiohttp.ClientSession | None = None
+
+
+def _create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=HTTP_TOTAL_TIMEOUT,
+        sock_connect=HTTP_CONNECT_TIMEOUT,
+        sock_read=HTTP_READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def init_http_session():
+    """Создает общую сессию (вызывается при старте бота)."""
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+        logger.info("Общий HTTP-клиент создан.")
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Возвращает общую сессию. Если init_http_session() еще не вызывался
+    (например, в тестах или скриптах), сессия создается при первом обращении.
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+    return _session
+
+
+async def close_http_session():
+    """Закрывает общую сессию и ее пул соединений (вызывается при остановке бота)."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("Общий HTTP-клиент закрыт.")
+    _session = None
@@ -0,0 +1,118 @@
+# job_store.py
+"""
+Хранилище заданий APScheduler в SQLite (стандартный sqlite3, без SQLAlchemy).
+Задания переживают перезапуск бота, поэтому при старте не нужно заново создавать
+напоминания из таблицы plans — достаточно сверить расхождения.
+Состояние задания хранится в pickle, время следующего запуска — отдельной колонкой
+с индексом, чтобы планировщик выбирал ближайшие задания без разбора всех остальных.
+Хранилище держит отдельный файл БД: короткие синхронные записи планировщика
+не ждут блокировок основной базы.
+"""
+import pickle
+import sqlite3
+
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+
+
+class SQLiteJobStore(BaseJobStore):
+    def __init__(self, path: str, pickle_protocol: int = pickle.HIGHEST_PROTOCOL):
+        super().__init__()
+        self.path = path
+        self.pickle_protocol = pickle_protocol
+        self._conn = None
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        # Все вызовы идут из потока планировщика (цикла событий); autocommit на каждую операцию
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS apscheduler_jobs ("
+            "id TEXT PRIMARY KEY, next_run_time REAL, job_state BLOB NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_apscheduler_jobs_next_run_time ON apscheduler_jobs(next_run_time)")
+
+    def lookup_job(self, job_id):
+        row = self._conn.execute("SELECT job_state FROM apscheduler_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._reconstitute_job(row[0]) if row else None
+
+    def get_due_jobs(self, now):
+        timestamp = datetime_to_utc_timestamp(now)
+        return self._get_jobs("WHERE next_run_time <= ?", (timestamp,))
+
+    def get_next_run_time(self):
+        row = self._conn.execute(
+            "SELECT next_run_time FROM apscheduler_jobs WHERE next_run_time IS NOT NULL "
+            "ORDER BY next_run_time LIMIT 1"
+        ).fetchone()
+        return utc_timestamp_to_datetime(row[0]) if row else None
+
+    def get_all_jobs(self):
+        jobs = self._get_jobs()
+        self._fix_paused_jobs_sorting(jobs)
+        return jobs
+
+    def get_job_ids(self) -> set[str]:
+        """ID всех заданий без распаковки их состояния (для сверки при старте)."""
+        return {row[0] for row in self._conn.execute("SELECT id FROM apscheduler_jobs")}
+
+    def add_job(self, job):
+        try:
+            self._conn.execute(
+                "INSERT INTO apscheduler_jobs (id, next_run_time, job_state) VALUES (?, ?, ?)",
+                (job.id, datetime_to_utc_timestamp(job.next_run_time), self._serialize(job)),
+            )
+        except sqlite3.IntegrityError:
+            raise ConflictingIdError(job.id)
+
+    def update_job(self, job):
+        cursor = self._conn.execute(
+            "UPDATE apscheduler_jobs SET next_run_time = ?, job_state = ? WHERE id = ?",
+            (datetime_to_utc_timestamp(job.next_run_time), self._serialize(job), job.id),
+        )
+        if cursor.rowcount == 0:
+            raise JobLookupError(job.id)
+
+    def remove_job(self, job_id):
+        cursor = self._conn.execute("DELETE FROM apscheduler_jobs WHERE id = ?", (job_id,))
+        if cursor.rowcount == 0:
+            raise JobLookupError(job_id)
+
+    def remove_all_jobs(self):
+        self._conn.execute("DELETE FROM apscheduler_jobs")
+
+    def shutdown(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _serialize(self, job) -> bytes:
+        return pickle.dumps(job.__getstate__(), self.pickle_protocol)
+
+    def _reconstitute_job(self, job_state: bytes):
+        state = pickle.loads(job_state)
+        state["jobstore"] = self
+        job = Job.__new__(Job)
+        job.__setstate__(state)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _get_jobs(self, where: str = "", params: tuple = ()):
+        rows = self._conn.execute(
+            f"SELECT id, job_state FROM apscheduler_jobs {where} ORDER BY next_run_time", params
+        ).fetchall()
+        jobs, failed_job_ids = [], []
+        for job_id, job_state in rows:
+            try:
+                jobs.append(self._reconstitute_job(job_state))
+            except Exception:
+                self._logger.exception(f"Не удалось восстановить задание {job_id}, оно будет удалено.")
+                failed_job_ids.append(job_id)
+        if failed_job_ids:
+            self._conn.executemany("DELETE FROM apscheduler_jobs WHERE id = ?", [(job_id,) for job_id in failed_job_ids])
+        return jobs
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} (path={self.path})>"
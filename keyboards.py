@@ -1,5 +1,7 @@
 # keyboards.py
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
+
+from config import QR_SCANNER_WEBAPP_URL
 
 def get_main_keyboard():
     return ReplyKeyboardMarkup(
@@ -18,12 +20,31 @@ def get_plans_keyboard():
             [KeyboardButton(text="Добавить план ➕"), KeyboardButton(text="Планы на сегодня ☀️")],
             [KeyboardButton(text="Все планы 📝"), KeyboardButton(text="Редактировать план ✏️")],
             [KeyboardButton(text="Удалить план 🗑️"), KeyboardButton(text="Выполнить план ✅")],
-            [KeyboardButton(text="Установить напоминание ⏰"), KeyboardButton(text="Главное меню 🏠")]
+            [KeyboardButton(text="Установить напоминание ⏰"), KeyboardButton(text="Архив планов 🗄️")],
+            [KeyboardButton(text="Повторяющийся план 🔁"), KeyboardButton(text="Главное меню 🏠")]
         ],
         resize_keyboard=True,
         one_time_keyboard=False,
     )
 
+def get_recurrence_keyboard():
+    return ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text="Каждый день"), KeyboardButton(text="По будням")],
+            [KeyboardButton(text="Каждую неделю"), KeyboardButton(text="Каждый месяц")]
+        ],
+        resize_keyboard=True,
+        one_time_keyboard=True,
+    )
+
+def get_plans_archive_pagination_keyboard(page: int, pages_count: int):
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="◀️ Новее", callback_data=f"plans_archive:{page - 1}"))
+    if page < pages_count - 1:
+        buttons.append(InlineKeyboardButton(text="Старее ▶️", callback_data=f"plans_archive:{page + 1}"))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
 def get_docs_keyboard():
     return ReplyKeyboardMarkup(
         keyboard=[
@@ -41,6 +62,7 @@ def get_finance_keyboard():
         keyboard=[
             [KeyboardButton(text="Создать книгу 📖"), KeyboardButton(text="Мои книги 📚")],
             [KeyboardButton(text="Удалить книгу 🗑️"), KeyboardButton(text="Редактировать книгу ✏️")],
+            [KeyboardButton(text="Все книги 💱")],
             [KeyboardButton(text="Главное меню 🏠")]
         ],
         resize_keyboard=True,
@@ -48,12 +70,18 @@ def get_finance_keyboard():
     )
 
 def get_book_menu_keyboard(book_name: str):
+    qr_buttons = [KeyboardButton(text="💸 Сканировать QR расхода")]
+    if QR_SCANNER_WEBAPP_URL:
+        # Сканер в WebApp распознает QR на телефоне и присылает боту только текст ссылки
+        qr_buttons.append(KeyboardButton(text="📷 Сканер QR", web_app=WebAppInfo(url=QR_SCANNER_WEBAPP_URL)))
     return ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text=f"Добавить доход в {book_name} ⬆️")],
             [KeyboardButton(text=f"Добавить расход в {book_name} ⬇️")],
-            [KeyboardButton(text="💸 Сканировать QR расхода")],
+            qr_buttons,
+            [KeyboardButton(text="Импорт выписки 📥")],
             [KeyboardButton(text=f"Баланс {book_name} 📊"), KeyboardButton(text=f"Отчет {book_name} 📈")],
+            [KeyboardButton(text="По месяцам 📅"), KeyboardButton(text="По категориям 🗂️")],
             [KeyboardButton(text="Редактировать транзакцию 📝")],
             [KeyboardButton(text="Назад к книгам 🔙")]
         ],
@@ -82,9 +110,15 @@ def get_report_format_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="CSV", callback_data="report_format:csv")],
         [InlineKeyboardButton(text="PDF", callback_data="report_format:pdf")],
+        [InlineKeyboardButton(text="Parquet (для pandas)", callback_data="report_format:parquet")],
         [InlineKeyboardButton(text="❌ Отмена", callback_data="report_format:cancel")]
     ])
 
+def get_statement_import_cancel_keyboard():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="statement_import:cancel")]
+    ])
+
 def get_currency_selection_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🇺🇸 USD", callback_data="currency:USD")],
@@ -0,0 +1,231 @@
+# llm_client.py
+"""
+Единая точка обращения к ИИ (Gemini).
+Клиент ограничивает число одновременных запросов, соблюдает общий срок на запрос
+(вместе с повторами), повторяет запрос со случайной паузой при временных ошибках,
+ведет учет токенов и задержек и кэширует ответы по хешу модели и запроса.
+Для тестов и бенчмарков есть локальный бэкенд FakeLLMBackend, не требующий сети.
+Бэкенд создается при первом запросе (или при фоновом прогреве), поэтому импорт модуля
+не тянет за собой google.generativeai и не замедляет запуск бота.
+"""
+import asyncio
+import hashlib
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from config import (
+    logger, GEMINI_API_KEY, LLM_BACKEND, LLM_MODEL_NAME, LLM_MAX_CONCURRENCY, LLM_TIMEOUT_SECONDS,
+    LLM_MAX_ATTEMPTS, LLM_RETRY_BASE_DELAY, LLM_CACHE_MAX_ENTRIES
+)
+
+
+class LLMError(Exception):
+    """Запрос к ИИ не удался (после всех повторов или из-за истечения срока)."""
+
+
+class LLMTransientError(Exception):
+    """Временная ошибка бэкенда: запрос имеет смысл повторить."""
+
+
+@dataclass
+class LLMResponse:
+    text: str
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+
+
+class GeminiBackend:
+    """Бэкенд Google Gemini. Библиотека импортируется при создании бэкенда, а не при импорте модуля."""
+    def __init__(self, model_name: str, api_key: str):
+        import google.generativeai as genai
+        from google.api_core import exceptions as google_exceptions
+
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self._model = genai.GenerativeModel(model_name)
+        self._transient_errors = (
+            google_exceptions.TooManyRequests, google_exceptions.ServiceUnavailable,
+            google_exceptions.InternalServerError, google_exceptions.DeadlineExceeded,
+            ConnectionError,
+        )
+
+    async def generate(self, prompt: str) -> LLMResponse:
+        try:
+            response = await self._model.generate_content_async(prompt)
+        except self._transient_errors as e:
+            raise LLMTransientError(str(e)) from e
+        usage = getattr(response, "usage_metadata", None)
+        return LLMResponse(
+            text=response.text,
+            prompt_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+            output_tokens=getattr(usage, "candidates_token_count", 0) or 0,
+        )
+
+
+class FakeLLMBackend:
+    """
+    Локальная заглушка: отвечает функцией responder(prompt) (по умолчанию — пустым JSON)
+    с искусственной задержкой latency. Первые transient_failures вызовов завершаются
+    временной ошибкой — так проверяются повторы.
+    """
+    def __init__(self, responder=None, latency: float = 0.0, transient_failures: int = 0):
+        self.model_name = "fake"
+        self.responder = responder or (lambda prompt: "{}")
+        self.latency = latency
+        self.transient_failures = transient_failures
+        self.calls = 0
+
+    async def generate(self, prompt: str) -> LLMResponse:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.transient_failures > 0:
+            self.transient_failures -= 1
+            raise LLMTransientError("Искусственная временная ошибка")
+        text = self.responder(prompt)
+        return LLMResponse(text=text, prompt_tokens=len(prompt.split()), output_tokens=len(text.split()))
+
+
+class LLMClient:
+    def __init__(self, backend=None, max_concurrency: int = LLM_MAX_CONCURRENCY, timeout: float = LLM_TIMEOUT_SECONDS,
+                 max_attempts: int = LLM_MAX_ATTEMPTS, retry_base_delay: float = LLM_RETRY_BASE_DELAY,
+                 cache_max_entries: int = LLM_CACHE_MAX_ENTRIES, backend_factory=None):
+        if backend is None and backend_factory is None:
+            raise ValueError("Нужен backend или backend_factory")
+        self._backend = backend
+        self._backend_factory = backend_factory
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.cache_max_entries = cache_max_entries
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._cache = OrderedDict()
+        # Одинаковые запросы, пришедшие одновременно, ждут один и тот же вызов бэкенда
+        self._in_flight = {}
+        self._stats = {
+            "requests": 0,
+            "cache_hits": 0,
+            "coalesced": 0,
+            "backend_calls": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "prompt_tokens": 0,
+            "output_tokens": 0,
+            "latency_seconds_total": 0.0,
+            "latency_seconds_max": 0.0,
+        }
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = self._backend_factory()
+        return self._backend
+
+    def _cache_key(self, prompt: str) -> str:
+        return hashlib.sha256(f"{self.backend.model_name}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def _retry_delay(self, attempt: int) -> float:
+        # Экспоненциальная пауза с полным случайным разбросом, чтобы повторы не шли залпом
+        return random.uniform(0, self.retry_base_delay * (2 ** (attempt - 1)))
+
+    async def _call_with_retries(self, prompt: str, deadline: float) -> LLMResponse:
+        for attempt in range(1, self.max_attempts + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            self._stats["backend_calls"] += 1
+            try:
+                return await asyncio.wait_for(self.backend.generate(prompt), timeout=remaining)
+            except LLMTransientError as e:
+                if attempt == self.max_attempts:
+                    raise LLMError(f"ИИ недоступен после {attempt} попыток: {e}") from e
+                delay = self._retry_delay(attempt)
+                if time.monotonic() + delay >= deadline:
+                    raise asyncio.TimeoutError()
+                self._stats["retries"] += 1
+                logger.warning(f"Временная ошибка ИИ ({e}), повтор {attempt + 1}/{self.max_attempts} через {delay:.2f} с.")
+                await asyncio.sleep(delay)
+
+    async def generate(self, prompt: str, use_cache: bool = True) -> str:
+        """Возвращает текст ответа ИИ. Бросает LLMError при неудаче или истечении срока."""
+        self._stats["requests"] += 1
+        cache_key = self._cache_key(prompt)
+        if use_cache and cache_key in self._cache:
+            self._cache.move_to_end(cache_key)
+            self._stats["cache_hits"] += 1
+            return self._cache[cache_key]
+
+        if use_cache and cache_key in self._in_flight:
+            self._stats["coalesced"] += 1
+            return await asyncio.shield(self._in_flight[cache_key])
+
+        if not use_cache:
+            return await self._generate_uncached(prompt, cache_key, use_cache)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = future
+        try:
+            text = await self._generate_uncached(prompt, cache_key, use_cache)
+            future.set_result(text)
+            return text
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Помечаем исключение как полученное: ожидающих одинаковых запросов может и не быть
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[cache_key]
+
+    async def _generate_uncached(self, prompt: str, cache_key: str, use_cache: bool) -> str:
+        started = time.monotonic()
+        # Срок отсчитывается с момента вызова, включая ожидание свободного слота
+        deadline = started + self.timeout
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), max(0.0, deadline - time.monotonic()))
+            try:
+                response = await self._call_with_retries(prompt, deadline)
+            finally:
+                self._semaphore.release()
+        except asyncio.TimeoutError as e:
+            self._stats["timeouts"] += 1
+            raise LLMError(f"ИИ не ответил за {self.timeout:.0f} с.") from e
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        latency = time.monotonic() - started
+
+        self._stats["prompt_tokens"] += response.prompt_tokens
+        self._stats["output_tokens"] += response.output_tokens
+        self._stats["latency_seconds_total"] += latency
+        self._stats["latency_seconds_max"] = max(self._stats["latency_seconds_max"], latency)
+
+        if use_cache:
+            self._cache[cache_key] = response.text
+            if len(self._cache) > self.cache_max_entries:
+                self._cache.popitem(last=False)
+        return response.text
+
+    def forget(self, prompt: str):
+        """Удаляет ответ из кэша (например, если он оказался непригодным и запрос нужно повторить)."""
+        self._cache.pop(self._cache_key(prompt), None)
+
+    def get_stats(self) -> dict:
+        stats = dict(self._stats)
+        answered = stats["requests"] - stats["cache_hits"] - stats["coalesced"] - stats["timeouts"] - stats["errors"]
+        stats["latency_seconds_avg"] = stats["latency_seconds_total"] / answered if answered > 0 else 0.0
+        return stats
+
+
+def create_backend(name: str = LLM_BACKEND):
+    if name == "fake":
+        return FakeLLMBackend()
+    return GeminiBackend(LLM_MODEL_NAME, GEMINI_API_KEY)
+
+
+llm_client = LLMClient(backend_factory=create_backend)
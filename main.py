@@ -1,14 +1,15 @@
 # main.py
 import asyncio
-import nltk
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ContentType, ParseMode
-from aiogram.filters import CommandStart, StateFilter
+from aiogram.filters import Command, CommandStart, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.markdown import hbold
 
-from config import BOT_TOKEN, logger
+from config import (
+    BOT_TOKEN, RECHUNK_INTERVAL_MINUTES, REMINDER_WINDOW_REFRESH_MINUTES, REMINDER_REDELIVERY_INTERVAL_MINUTES, FX_RATES_FILE, logger
+)
 from db import init_db
 from keyboards import get_main_keyboard, get_plans_keyboard, get_docs_keyboard, get_remove_keyboard, get_finance_keyboard
 
@@ -19,7 +20,10 @@ from plan_handlers import (
     edit_plan_id_received, choose_edit_field, update_plan_text, update_plan_date, update_plan_topic,
     handle_delete_plan_button, delete_plans_ids_received, handle_complete_plan_button, complete_plans_ids_received,
     handle_set_reminder_button, set_reminder_id_received, set_reminder_time_received,
-    AddPlanStates, EditPlanStates, DeletePlanStates, CompletePlanStates, SetReminderStates
+    handle_plans_archive_button, process_plans_archive_page,
+    handle_add_series_button, add_series_start_date_received, add_series_topic_received, add_series_text_received,
+    add_series_rule_received, add_series_reminder_time_received,
+    AddPlanStates, EditPlanStates, DeletePlanStates, CompletePlanStates, SetReminderStates, AddSeriesStates
 )
 from file_handlers import (
     handle_list_files_button, handle_get_file_button, get_file_id_received,
@@ -42,16 +46,27 @@ from finance_handlers import (
     handle_add_income_to_book_button, process_income_amount, process_income_description, process_income_category, process_income_date,
     handle_add_expense_to_book_button, process_expense_amount, process_expense_description, process_expense_category, process_expense_date,
     handle_book_balance_button, handle_book_report_button, choose_report_format_for_book,
+    handle_book_monthly_summary_button, handle_book_category_summary_button,
+    handle_consolidated_balance_button, handle_fx_command, load_fx_rates_file,
     handle_edit_transaction_button, process_transaction_to_edit_id, choose_edit_transaction_field,
     process_editing_transaction_type, process_editing_transaction_amount, process_editing_transaction_description,
     process_editing_transaction_category, process_editing_transaction_date,
     handle_finance_main_menu_button, handle_back_to_books_button, 
-    handle_scan_qr_button, process_qr_photo, process_qr_category,
+    handle_scan_qr_button, process_qr_photo, process_qr_category, process_qr_webapp_data,
+    handle_import_statement_button, process_statement_file, process_statement_import_cancel,
     FinanceStates
 )
-from scheduler_jobs import scheduler, auto_archive_old_plans, load_reminders_on_startup, set_bot_instance_for_scheduler
-from telegram_handlers import handle_document_upload
+from scheduler_jobs import (
+    scheduler, auto_archive_old_plans, refresh_reminder_window, redeliver_failed_reminders, set_bot_instance_for_scheduler,
+    close_reminders_db, get_dead_letter_count, reminder_stats, archive_stats
+)
+from telegram_handlers import handle_document_upload, rechunk_stale_documents
 from filters import IsAuthorizedUser
+from reports import report_pool
+from receipt_parser import parser_stats
+from llm_client import llm_client
+from http_client import init_http_session, close_http_session
+from warmup import warm_up
 
 # --- Инициализация ---
 bot_properties = DefaultBotProperties(parse_mode=ParseMode.HTML)
@@ -78,6 +93,31 @@ async def handle_unknown_text(message: types.Message):
 async def handle_hide_menu(message: types.Message):
     await message.answer("Меню скрыто.", reply_markup=get_remove_keyboard())
 
+async def handle_stats_command(message: types.Message):
+    """Показывает внутренние метрики бота."""
+    report_metrics = report_pool.get_metrics()
+    llm_metrics = llm_client.get_stats()
+    dead_letters = await get_dead_letter_count()
+    await message.answer(
+        f"{hbold('Отчеты:')}\n"
+        f"Сформировано: {report_metrics['rendered']}, ошибок: {report_metrics['failed']}, отклонено: {report_metrics['rejected']}\n"
+        f"В работе: {report_metrics['in_flight']}\n"
+        f"Рендеринг: среднее {report_metrics['render_seconds_avg']:.2f} с, максимум {report_metrics['render_seconds_max']:.2f} с\n\n"
+        f"{hbold('Напоминания:')}\n"
+        f"Отправлено: {reminder_stats['sent']} (объединено в общие сообщения: {reminder_stats['coalesced']}), повторов: {reminder_stats['retries']}, не доставлено: {reminder_stats['dead_lettered']}, "
+        f"доставлено повторно: {reminder_stats['redelivered']}, в таблице недоставленных: {dead_letters}\n\n"
+        f"{hbold('Автоархивация (последний запуск):')}\n"
+        f"Заархивировано: {archive_stats['archived']}, пачек: {archive_stats['batches']}, "
+        f"самая долгая блокировка: {archive_stats['max_lock_seconds'] * 1000:.1f} мс, всего {archive_stats['duration_seconds']:.1f} с\n\n"
+        f"{hbold('Чеки:')}\n"
+        f"Разобрано локально: {parser_stats['local']}, через ИИ: {parser_stats['llm_fallback']}, ошибок ИИ: {parser_stats['llm_failed']}\n\n"
+        f"{hbold('ИИ:')}\n"
+        f"Запросов: {llm_metrics['requests']}, из кэша: {llm_metrics['cache_hits'] + llm_metrics['coalesced']}, повторов: {llm_metrics['retries']}, "
+        f"таймаутов: {llm_metrics['timeouts']}, ошибок: {llm_metrics['errors']}\n"
+        f"Токены: {llm_metrics['prompt_tokens']} на входе, {llm_metrics['output_tokens']} на выходе\n"
+        f"Задержка: среднее {llm_metrics['latency_seconds_avg']:.2f} с, максимум {llm_metrics['latency_seconds_max']:.2f} с"
+    )
+
 # --- РЕГИСТРАЦИЯ ОБРАБОТЧИКОВ ---
 
 # 1. Главные команды
@@ -87,22 +127,31 @@ dp.message.register(handle_my_documents_button_main, F.text == "Мои доку
 dp.message.register(handle_my_finance_button_main, F.text == "Мои финансы 💰", IsAuthorizedUser())
 dp.message.register(send_welcome, F.text == "Главное меню 🏠", IsAuthorizedUser())
 dp.message.register(handle_hide_menu, F.text == "Скрыть меню ❌", IsAuthorizedUser())
+dp.message.register(handle_stats_command, Command("stats"), IsAuthorizedUser())
 
 # 2. Обработчики планов
 dp.message.register(handle_add_plan_button, F.text == "Добавить план ➕", IsAuthorizedUser())
 # ... (остальные обработчики планов без изменений)
 dp.message.register(handle_today_plans_button, F.text == "Планы на сегодня ☀️", IsAuthorizedUser())
 dp.message.register(handle_all_plans_button, F.text == "Все планы 📝", IsAuthorizedUser())
+dp.message.register(handle_plans_archive_button, F.text == "Архив планов 🗄️", IsAuthorizedUser())
 dp.message.register(handle_edit_plan_button, F.text == "Редактировать план ✏️", IsAuthorizedUser())
 dp.message.register(handle_delete_plan_button, F.text == "Удалить план 🗑️", IsAuthorizedUser())
 dp.message.register(handle_complete_plan_button, F.text == "Выполнить план ✅", IsAuthorizedUser())
+dp.message.register(handle_add_series_button, F.text == "Повторяющийся план 🔁", IsAuthorizedUser())
 dp.message.register(handle_set_reminder_button, F.text == "Установить напоминание ⏰", IsAuthorizedUser())
 dp.message.register(add_plan_date_received, AddPlanStates.awaiting_date, IsAuthorizedUser())
 dp.message.register(add_plan_topic_received, AddPlanStates.awaiting_topic, IsAuthorizedUser())
 dp.message.register(add_plan_content_received, AddPlanStates.awaiting_plan_content, F.text | F.photo | F.voice, IsAuthorizedUser())
 dp.message.register(add_plan_reminder_time_received, AddPlanStates.awaiting_reminder_time, IsAuthorizedUser())
+dp.message.register(add_series_start_date_received, AddSeriesStates.awaiting_start_date, IsAuthorizedUser())
+dp.message.register(add_series_topic_received, AddSeriesStates.awaiting_topic, IsAuthorizedUser())
+dp.message.register(add_series_text_received, AddSeriesStates.awaiting_text, IsAuthorizedUser())
+dp.message.register(add_series_rule_received, AddSeriesStates.awaiting_rule, IsAuthorizedUser())
+dp.message.register(add_series_reminder_time_received, AddSeriesStates.awaiting_reminder_time, IsAuthorizedUser())
 dp.message.register(edit_plan_id_received, EditPlanStates.awaiting_id, IsAuthorizedUser())
 dp.callback_query.register(choose_edit_field, EditPlanStates.choosing_edit_field, F.data.startswith("edit:"), IsAuthorizedUser())
+dp.callback_query.register(process_plans_archive_page, F.data.startswith("plans_archive:"), IsAuthorizedUser())
 dp.message.register(update_plan_text, EditPlanStates.editing_text, IsAuthorizedUser())
 dp.message.register(update_plan_date, EditPlanStates.editing_date, IsAuthorizedUser())
 dp.message.register(update_plan_topic, EditPlanStates.editing_topic, IsAuthorizedUser())
@@ -144,6 +193,8 @@ dp.message.register(handle_my_books_button, F.text == "Мои книги 📚",
 dp.message.register(handle_delete_book_button, F.text == "Удалить книгу 🗑️", IsAuthorizedUser())
 dp.message.register(handle_edit_book_button, F.text == "Редактировать книгу ✏️", IsAuthorizedUser())
 dp.message.register(handle_back_to_books_button, F.text == "Назад к книгам 🔙", IsAuthorizedUser())
+dp.message.register(handle_consolidated_balance_button, F.text == "Все книги 💱", IsAuthorizedUser())
+dp.message.register(handle_fx_command, Command("fx"), IsAuthorizedUser())
 dp.message.register(process_book_name_to_create, FinanceStates.awaiting_book_name_to_create, IsAuthorizedUser())
 dp.callback_query.register(process_book_currency_selection, FinanceStates.awaiting_book_currency, F.data.startswith("currency:"), IsAuthorizedUser())
 dp.callback_query.register(process_book_selection, FinanceStates.choosing_book, F.data.startswith("select_book:"), IsAuthorizedUser())
@@ -161,10 +212,17 @@ dp.message.register(handle_add_expense_to_book_button, F.text.startswith("Доб
 # QR-сканирование
 dp.message.register(handle_scan_qr_button, F.text == "💸 Сканировать QR расхода", IsAuthorizedUser())
 dp.message.register(process_qr_photo, FinanceStates.awaiting_qr_photo, F.content_type == ContentType.PHOTO, IsAuthorizedUser())
+dp.message.register(process_qr_webapp_data, F.web_app_data, IsAuthorizedUser())
 dp.message.register(process_qr_category, FinanceStates.awaiting_qr_category, IsAuthorizedUser())
+# Импорт выписок
+dp.message.register(handle_import_statement_button, F.text == "Импорт выписки 📥", IsAuthorizedUser())
+dp.callback_query.register(process_statement_import_cancel, FinanceStates.awaiting_statement_file, F.data == "statement_import:cancel", IsAuthorizedUser())
+dp.message.register(process_statement_file, FinanceStates.awaiting_statement_file, IsAuthorizedUser())
 # Отчеты и баланс
 dp.message.register(handle_book_balance_button, F.text.startswith("Баланс "), IsAuthorizedUser())
 dp.message.register(handle_book_report_button, F.text.startswith("Отчет "), IsAuthorizedUser())
+dp.message.register(handle_book_monthly_summary_button, F.text == "По месяцам 📅", IsAuthorizedUser())
+dp.message.register(handle_book_category_summary_button, F.text == "По категориям 🗂️", IsAuthorizedUser())
 dp.message.register(handle_edit_transaction_button, F.text == "Редактировать транзакцию 📝", IsAuthorizedUser())
 # Состояния для ручного ввода
 dp.message.register(process_income_amount, FinanceStates.awaiting_income_amount, IsAuthorizedUser())
@@ -193,22 +251,41 @@ dp.message.register(handle_unknown_text, F.text, IsAuthorizedUser())
 
 # --- Точка входа ---
 async def main():
-    try:
-        nltk.data.find("tokenizers/punkt")
-    except LookupError:
-        logger.info("Загрузка NLTK 'punkt'...")
-        nltk.download("punkt", quiet=True)
-    
     await init_db()
+    try:
+        await load_fx_rates_file(FX_RATES_FILE)
+    except (OSError, ValueError) as e:
+        logger.error(f"Не удалось загрузить курсы валют из '{FX_RATES_FILE}': {e}")
+    await init_http_session()
     
     set_bot_instance_for_scheduler(bot)
     
-    scheduler.add_job(auto_archive_old_plans, trigger="interval", days=1, id="auto_archive_job")
+    scheduler.add_job(auto_archive_old_plans, trigger="interval", days=1, id="auto_archive_job", max_instances=1, coalesce=True)
+    scheduler.add_job(
+        rechunk_stale_documents, trigger="interval", minutes=RECHUNK_INTERVAL_MINUTES, args=[bot],
+        id="rechunk_documents_job", max_instances=1, coalesce=True
+    )
+    scheduler.add_job(
+        refresh_reminder_window, trigger="interval", minutes=REMINDER_WINDOW_REFRESH_MINUTES,
+        id="reminder_window_job", max_instances=1, coalesce=True
+    )
+    scheduler.add_job(
+        redeliver_failed_reminders, trigger="interval", minutes=REMINDER_REDELIVERY_INTERVAL_MINUTES,
+        id="reminder_redelivery_job", max_instances=1, coalesce=True
+    )
     scheduler.start()
-    await load_reminders_on_startup()
+    await refresh_reminder_window()
     
     await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    # Тяжелые библиотеки догружаются в фоне, уже после начала опроса
+    warmup_task = asyncio.create_task(warm_up())
+    try:
+        await dp.start_polling(bot)
+    finally:
+        warmup_task.cancel()
+        report_pool.shutdown()
+        await close_http_session()
+        await close_reminders_db()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
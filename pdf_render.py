@@ -0,0 +1,200 @@
+# pdf_render.py
+"""
+PDF-движки отчетов на ReportLab. Модуль вынесен из reports.py, чтобы ReportLab и
+регистрация TTF-шрифтов не замедляли запуск бота: он импортируется при первом
+PDF-отчете или заранее, при фоновом прогреве после старта.
+"""
+import datetime
+import io
+import os
+from typing import Iterable
+from xml.sax.saxutils import escape
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.platypus import LongTable, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+from reportlab.lib import colors
+from reportlab.lib.units import cm
+from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+from config import logger
+from reports import MONTH_NAMES, TYPE_MAP, get_currency_symbol
+
+FONT_NAME = "TimesNewRoman"
+FONT_NAME_BOLD = "TimesNewRoman-Bold"
+try:
+    local_font_path = os.path.join(os.getcwd(), 'times.ttf')
+    local_font_path_bold = os.path.join(os.getcwd(), 'timesbd.ttf')
+    if os.path.exists(local_font_path) and os.path.exists(local_font_path_bold):
+        pdfmetrics.registerFont(TTFont(FONT_NAME, local_font_path))
+        pdfmetrics.registerFont(TTFont(FONT_NAME_BOLD, local_font_path_bold))
+    else:
+        FONT_NAME = "Helvetica"
+        FONT_NAME_BOLD = "Helvetica-Bold"
+except Exception as e:
+    logger.error(f"Ошибка при регистрации шрифта для ReportLab: {e}", exc_info=True)
+    FONT_NAME = "Helvetica"
+    FONT_NAME_BOLD = "Helvetica-Bold"
+
+
+def render_pdf_report(transactions: Iterable[tuple], book_name: str, book_currency: str, total_income: float, total_expense: float) -> bytes:
+    balance = total_income - total_expense
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1.5*cm, bottomMargin=1.5*cm, leftMargin=1.5*cm, rightMargin=1.5*cm)
+
+    income_color = colors.HexColor("#000080")
+    expense_color = colors.HexColor("#FF0000")
+    title_color = colors.HexColor("#0000CD")
+
+    title_style = ParagraphStyle(name='TitleStyle', fontName=FONT_NAME_BOLD, fontSize=16, alignment=TA_CENTER, spaceAfter=12)
+    header_style = ParagraphStyle(name='HeaderStyle', fontName=FONT_NAME_BOLD, fontSize=10, alignment=TA_CENTER, textColor=colors.whitesmoke)
+
+    base_body_style = ParagraphStyle(name='BaseBody', fontName=FONT_NAME, fontSize=9, alignment=TA_LEFT)
+    income_style = ParagraphStyle(name='IncomeStyle', parent=base_body_style, textColor=income_color)
+    expense_style = ParagraphStyle(name='ExpenseStyle', parent=base_body_style, textColor=expense_color)
+
+    summary_label_style = ParagraphStyle(name='SummaryLabel', fontName=FONT_NAME_BOLD, fontSize=10, alignment=TA_RIGHT)
+    summary_value_style = ParagraphStyle(name='SummaryValue', fontName=FONT_NAME, fontSize=10, alignment=TA_LEFT)
+
+    headers = ["ID", "Дата", "Тип", "Сумма", "Категория", "Описание"]
+    data = [[Paragraph(h, header_style) for h in headers]]
+
+    for t_id, t_date, t_type, amount, category, description in transactions:
+        row_style = income_style if t_type == 'income' else expense_style
+        row = [
+            Paragraph(str(t_id), row_style),
+            Paragraph(datetime.datetime.fromisoformat(t_date).strftime('%d.%m.%y %H:%M'), row_style),
+            Paragraph(TYPE_MAP.get(t_type, t_type), row_style),
+            Paragraph(f"{amount:.2f}", row_style),
+            Paragraph(category or '', row_style),
+            Paragraph(description or '', row_style),
+        ]
+        data.append(row)
+
+    data.append(['', '', '', '', '', ''])
+    currency_str = get_currency_symbol(book_currency)
+    data.append([
+        '', '', Paragraph('Общая сумма Доходов', summary_label_style), Paragraph(f'{total_income:.2f} {currency_str}', summary_value_style), '', ''
+    ])
+    data.append([
+        '', '', Paragraph('Общая сумма Расходов', summary_label_style), Paragraph(f'{total_expense:.2f} {currency_str}', summary_value_style), '', ''
+    ])
+    data.append([
+        '', '', Paragraph('Баланс', summary_label_style), Paragraph(f'{balance:.2f} {currency_str}', summary_value_style), '', ''
+    ])
+
+    table = Table(data, colWidths=[cm, 2.5*cm, 3.5*cm, 3*cm, 3*cm, 4*cm])
+
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('GRID', (0, 0), (-1, -5), 1, colors.black),
+        ('GRID', (2, -3), (3, -1), 1, colors.black),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('SPAN', (3, -4), (5, -4)),
+        ('SPAN', (0, -4), (1, -4)),
+        ('BACKGROUND', (2, -1), (3, -1), colors.lightgrey),
+    ]))
+
+    title_text = f"Отчет по книге: <font color='{title_color.hexval()}'>{book_name}</font>"
+    title_paragraph = Paragraph(title_text, title_style)
+
+    elements = [title_paragraph, table]
+    doc.build(elements)
+    return buffer.getvalue()
+
+def render_pdf_report_paginated(transactions: Iterable[tuple], book_name: str, book_currency: str, total_income: float, total_expense: float) -> bytes:
+    """
+    PDF-движок для больших книг: отдельная LongTable на каждый месяц с повтором заголовка
+    на каждой странице и итогами за месяц. Ячейки — обычные строки, цвет строк задается
+    стилем таблицы; Paragraph создается только для длинных описаний, которым нужен перенос.
+    Транзакции (по убыванию даты) читаются за один проход, поэтому их можно подавать итератором.
+    Исходные строки не копятся, но ReportLab собирает документ из готовых таблиц всех месяцев.
+    """
+    balance = total_income - total_expense
+    currency_str = get_currency_symbol(book_currency)
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1.5*cm, bottomMargin=1.5*cm, leftMargin=1.5*cm, rightMargin=1.5*cm)
+
+    income_color = colors.HexColor("#000080")
+    expense_color = colors.HexColor("#FF0000")
+    title_color = colors.HexColor("#0000CD")
+
+    title_style = ParagraphStyle(name='TitleStyle', fontName=FONT_NAME_BOLD, fontSize=16, alignment=TA_CENTER, spaceAfter=12)
+    month_style = ParagraphStyle(name='MonthStyle', fontName=FONT_NAME_BOLD, fontSize=12, spaceBefore=10, spaceAfter=6)
+    description_style = ParagraphStyle(name='DescriptionStyle', fontName=FONT_NAME, fontSize=8, leading=9)
+
+    col_widths = [1.2*cm, 2.4*cm, 1.6*cm, 2.6*cm, 3.2*cm, 7*cm]
+    description_max_plain = 45 # Длиннее — оборачиваем в Paragraph для переноса строк
+    headers = ["ID", "Дата", "Тип", "Сумма", "Категория", "Описание"]
+
+    def build_month_table(month_rows: list, month_styles: list, month_income: float, month_expense: float):
+        month_rows.append(['', '', 'Итого', f"+{month_income:.2f}", f"-{month_expense:.2f}", f"= {month_income - month_expense:.2f} {currency_str}"])
+        table = LongTable(month_rows, colWidths=col_widths, repeatRows=1)
+        table.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (-1, -1), FONT_NAME),
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('FONTNAME', (0, 0), (-1, 0), FONT_NAME_BOLD),
+            ('FONTNAME', (0, -1), (-1, -1), FONT_NAME_BOLD),
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('TEXTCOLOR', (0, 1), (-1, -2), expense_color),
+            ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            *month_styles,
+        ]))
+        return table
+
+    elements = [Paragraph(f"Отчет по книге: <font color='{title_color.hexval()}'>{book_name}</font>", title_style)]
+    current_month, month_rows, month_styles = None, [], []
+    month_income = month_expense = 0.0
+
+    for t_id, t_date, t_type, amount, category, description in transactions:
+        month = t_date[:7]
+        if month != current_month:
+            if current_month is not None:
+                elements.append(build_month_table(month_rows, month_styles, month_income, month_expense))
+            year, month_number = month.split("-")
+            elements.append(Paragraph(f"{MONTH_NAMES[int(month_number) - 1]} {year}", month_style))
+            current_month, month_rows, month_styles = month, [headers], []
+            month_income = month_expense = 0.0
+
+        if t_type == 'income':
+            month_income += amount
+            month_styles.append(('TEXTCOLOR', (0, len(month_rows)), (-1, len(month_rows)), income_color))
+        else:
+            month_expense += amount
+        description = description or ''
+        if len(description) > description_max_plain or '\n' in description:
+            description = Paragraph(escape(description).replace('\n', '<br/>'), description_style)
+        month_rows.append([
+            str(t_id),
+            datetime.datetime.fromisoformat(t_date).strftime('%d.%m.%y %H:%M'),
+            TYPE_MAP.get(t_type, t_type),
+            f"{amount:.2f}",
+            category or '',
+            description,
+        ])
+
+    if current_month is not None:
+        elements.append(build_month_table(month_rows, month_styles, month_income, month_expense))
+
+    summary_table = Table([
+        ['Общая сумма Доходов', f'{total_income:.2f} {currency_str}'],
+        ['Общая сумма Расходов', f'{total_expense:.2f} {currency_str}'],
+        ['Баланс', f'{balance:.2f} {currency_str}'],
+    ], colWidths=[5*cm, 4*cm], hAlign='RIGHT')
+    summary_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (0, -1), FONT_NAME_BOLD),
+        ('FONTNAME', (1, 0), (1, -1), FONT_NAME),
+        ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
+    ]))
+    elements.append(Spacer(1, 0.5*cm))
+    elements.append(summary_table)
+
+    doc.build(elements)
+    return buffer.getvalue()
@@ -10,11 +10,18 @@ from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeybo
 from aiogram.utils.markdown import hbold, hstrikethrough
 from aiogram.filters import StateFilter
 
-from config import DB_NAME, USER_TIMEZONE_STR, logger
-from db import add_plan_to_db, get_all_user_plans, get_plan_by_id, get_plans_for_date, get_attachments_for_plan
-from scheduler_jobs import scheduler, send_reminder_job
+from config import DB_NAME, USER_TIMEZONE_STR, ARCHIVE_PAGE_SIZE, logger
+from db import (
+    add_plan_to_db, get_all_user_plans, get_archived_plans_page, get_plan_by_id, get_plans_for_date, get_attachments_for_plan,
+    add_plan_series, get_user_plan_series, delete_plan_series
+)
+from scheduler_jobs import (
+    scheduler, schedule_reminder, unschedule_reminder, invalidate_reminder_content,
+    schedule_series_reminder, unschedule_series_reminder, next_series_reminder
+)
 from filters import IsAuthorizedUser
-from keyboards import get_plans_keyboard, get_main_keyboard, get_date_keyboard
+from keyboards import get_plans_keyboard, get_main_keyboard, get_date_keyboard, get_plans_archive_pagination_keyboard, get_recurrence_keyboard
+from recurrence import RecurrenceError, parse_rrule, iter_occurrences, occurrences_between
 
 # --- Определения состояний (FSM) ---
 class AddPlanStates(StatesGroup):
@@ -40,6 +47,60 @@ class SetReminderStates(StatesGroup):
     awaiting_id = State()
     awaiting_time = State()
 
+class AddSeriesStates(StatesGroup):
+    awaiting_start_date = State()
+    awaiting_topic = State()
+    awaiting_text = State()
+    awaiting_rule = State()
+    awaiting_reminder_time = State()
+
+RECURRENCE_PRESETS = {
+    "каждый день": "FREQ=DAILY",
+    "по будням": "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR",
+    "каждую неделю": "FREQ=WEEKLY",
+    "каждый месяц": "FREQ=MONTHLY",
+}
+
+def parse_series_id(token: str) -> int | None:
+    """ID серии в виде 'S12' (латиница или кириллица) -> 12."""
+    if len(token) > 1 and token[0] in "SsСс" and token[1:].isdigit():
+        return int(token[1:])
+    return None
+
+def expand_series(series_rows, start: datetime.date, end: datetime.date) -> list[dict]:
+    """
+    Повторения серий в диапазоне [start, end] в виде строк, совместимых с display_multiple_plans.
+    В БД повторения не хранятся: они вычисляются по правилу только для запрошенных дат.
+    """
+    occurrences = []
+    for series in series_rows:
+        try:
+            rule = parse_rrule(series['rrule'])
+        except RecurrenceError as e:
+            logger.warning(f"Серия S{series['id']} с некорректным правилом '{series['rrule']}': {e}")
+            continue
+        for day in occurrences_between(rule, datetime.date.fromisoformat(series['dtstart']), start, end):
+            occurrences.append({
+                'id': f"S{series['id']}",
+                'series_id': series['id'],
+                'plan_date': day.isoformat(),
+                'plan_topic': f"🔁 {series['plan_topic']}",
+                'plan_text': series['plan_text'],
+                'is_completed': 0,
+                'reminder_datetime': f"{day.isoformat()} {series['reminder_time']}:00" if series['reminder_time'] else None,
+            })
+    return occurrences
+
+def describe_series(series) -> str:
+    rule = parse_rrule(series['rrule'])
+    start = datetime.date.fromisoformat(series['dtstart'])
+    text = f"{hbold(series['plan_topic'])}: {series['plan_text']} — {rule.describe()} с {start.strftime('%d.%m.%Y')}"
+    if series['reminder_time']:
+        text += f", напом. в {series['reminder_time']}"
+    upcoming = next(iter_occurrences(rule, start, datetime.date.today()), None)
+    text += f" (ближайший: {upcoming.strftime('%d.%m.%Y')})" if upcoming else " (серия завершена)"
+    return f"  🔁 {text} (ID: {hbold('S' + str(series['id']))})"
+
 # --- ОБРАБОТЧИКИ КНОПОК МЕНЮ ПЛАНОВ ---
 
 async def handle_add_plan_button(message: types.Message, state: FSMContext):
@@ -53,8 +114,9 @@ async def handle_today_plans_button(message: types.Message):
     from telegram_handlers import display_multiple_plans
     logger.info(f"Получено нажатие 'Планы на сегодня ☀️' от пользователя {message.from_user.id}")
     user_id = message.from_user.id
-    today_date_str = datetime.date.today().strftime("%Y-%m-%d")
-    plans = await get_plans_for_date(user_id, today_date_str)
+    today = datetime.date.today()
+    plans = list(await get_plans_for_date(user_id, today.strftime("%Y-%m-%d")))
+    plans += expand_series(await get_user_plan_series(user_id), today, today)
     if not plans:
         await message.answer(f"На сегодня ({datetime.date.today().strftime('%d.%m.%Y г.')}) планов нет.", reply_markup=get_plans_keyboard())
         return
@@ -63,17 +125,49 @@ async def handle_today_plans_button(message: types.Message):
     await message.answer("Вы можете выбрать другое действие:", reply_markup=get_plans_keyboard())
 
 async def handle_all_plans_button(message: types.Message):
-    """Показывает все планы пользователя."""
+    """Показывает все активные планы пользователя (архивные — кнопкой 'Архив планов 🗄️')."""
     from telegram_handlers import display_multiple_plans
     logger.info(f"Получено нажатие 'Все планы 📝' от пользователя {message.from_user.id}")
     user_id = message.from_user.id
     plans = await get_all_user_plans(user_id)
-    if not plans:
-        await message.answer("У вас еще нет планов.", reply_markup=get_plans_keyboard())
+    series_rows = await get_user_plan_series(user_id)
+    if not plans and not series_rows:
+        await message.answer("Активных планов нет. Старые планы — в разделе 'Архив планов 🗄️'.", reply_markup=get_plans_keyboard())
         return
-    await display_multiple_plans(message, plans, "Все ваши планы:")
+    if plans:
+        await display_multiple_plans(message, plans, "Все ваши планы:")
+    if series_rows:
+        await message.answer("Повторяющиеся планы:\n" + "\n".join(describe_series(series) for series in series_rows), parse_mode="HTML")
     await message.answer("Вы можете выбрать другое действие:", reply_markup=get_plans_keyboard())
 
+async def show_archived_plans_page(message: types.Message, user_id: int, page: int):
+    from telegram_handlers import display_multiple_plans
+    plans, total = await get_archived_plans_page(user_id, page, ARCHIVE_PAGE_SIZE)
+    if not total:
+        await message.answer("Архив планов пуст.", reply_markup=get_plans_keyboard())
+        return
+    pages_count = (total + ARCHIVE_PAGE_SIZE - 1) // ARCHIVE_PAGE_SIZE
+    if not plans:
+        await message.answer("Такой страницы архива нет.")
+        return
+    await display_multiple_plans(message, plans, f"Архив планов (всего {total}):")
+    await message.answer(
+        f"Страница {page + 1} из {pages_count}.",
+        reply_markup=get_plans_archive_pagination_keyboard(page, pages_count)
+    )
+
+async def handle_plans_archive_button(message: types.Message):
+    """Показывает первую страницу архива планов (самые новые архивные планы)."""
+    logger.info(f"Получено нажатие 'Архив планов 🗄️' от пользователя {message.from_user.id}")
+    await show_archived_plans_page(message, message.from_user.id, 0)
+
+async def process_plans_archive_page(callback: types.CallbackQuery):
+    """Листает архив планов по кнопкам под сообщением."""
+    page = int(callback.data.split(":")[1])
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await show_archived_plans_page(callback.message, callback.from_user.id, page)
+    await callback.answer()
+
 async def handle_edit_plan_button(message: types.Message, state: FSMContext):
     """Запускает FSM для редактирования плана."""
     logger.info(f"Получено нажатие 'Редактировать план ✏️' от пользователя {message.from_user.id}")
@@ -98,6 +192,12 @@ async def handle_set_reminder_button(message: types.Message, state: FSMContext):
     await message.answer("Введите ID плана, для которого нужно напоминание:", reply_markup=ReplyKeyboardRemove())
     await state.set_state(SetReminderStates.awaiting_id)
 
+async def handle_add_series_button(message: types.Message, state: FSMContext):
+    """Начинает диалог добавления повторяющегося плана, запрашивая дату первого повторения."""
+    logger.info(f"Получено нажатие 'Повторяющийся план 🔁' от пользователя {message.from_user.id}")
+    await message.answer("С какой даты начинается повторяющийся план? Введите в формате ДД.ММ.ГГГГ или нажмите кнопку 'Сегодня':", reply_markup=get_date_keyboard())
+    await state.set_state(AddSeriesStates.awaiting_start_date)
+
 # --- ОБРАБОТЧИКИ СОСТОЯНИЙ (FSM) ---
 
 async def add_plan_date_received(message: types.Message, state: FSMContext):
@@ -231,15 +331,7 @@ async def add_plan_reminder_time_received(message: types.Message, state: FSMCont
         dt_naive = datetime.datetime.strptime(reminder_datetime_db, "%Y-%m-%d %H:%M:%S")
         dt_aware = tz.localize(dt_naive)
         
-        job_id = f"reminder_{user_id}_{plan_id}"
-        scheduler.add_job(
-            send_reminder_job,
-            trigger='date',
-            run_date=dt_aware,
-            args=[user_id, plan_id, plan_topic, plan_text, telegram_file_id, file_type],
-            id=job_id,
-            replace_existing=True
-        )
+        schedule_reminder(user_id, plan_id, dt_aware)
         logger.info(f"Напоминание для плана ID {plan_id} установлено на {dt_aware.strftime('%H:%M')}.")
     
     await state.clear()
@@ -316,6 +408,7 @@ async def update_plan_text(message: types.Message, state: FSMContext):
     async with aiosqlite.connect(DB_NAME) as db:
         await db.execute("UPDATE plans SET plan_text = ? WHERE id = ?", (message.text, data['plan_id']))
         await db.commit()
+    invalidate_reminder_content(data['plan_id'])
     await message.answer(f"✅ Текст плана ID {data['plan_id']} обновлен.", reply_markup=get_plans_keyboard())
     await state.clear()
 
@@ -342,6 +435,7 @@ async def update_plan_topic(message: types.Message, state: FSMContext):
     async with aiosqlite.connect(DB_NAME) as db:
         await db.execute("UPDATE plans SET plan_topic = ? WHERE id = ?", (new_topic, data['plan_id']))
         await db.commit()
+    invalidate_reminder_content(data['plan_id'])
     await message.answer(f"✅ Тема плана ID {data['plan_id']} обновлена на: «{new_topic}».", reply_markup=get_plans_keyboard())
     await state.clear()
 
@@ -378,41 +472,45 @@ async def set_reminder_time_received(message: types.Message, state: FSMContext):
                 return
             
             reminder_datetime_db = dt_naive.strftime("%Y-%m-%d %H:%M:%S")
-            job_id = f"reminder_{user_id}_{plan_id}"
-            scheduler.add_job(
-                send_reminder_job,
-                trigger='date',
-                run_date=dt_aware,
-                args=[user_id, plan_id, plan_topic, plan_text, telegram_file_id, file_type],
-                id=job_id,
-                replace_existing=True
-            )
-            await message.answer(f"✅ Напоминание установлено на {dt_aware.strftime('%H:%M')}.", reply_markup=get_plans_keyboard())
         except Exception as e:
             logger.error(f"Ошибка при установке напоминания: {e}", exc_info=True)
             await message.answer("Ошибка установки напоминания.", reply_markup=get_plans_keyboard())
             await state.clear()
             return
-    else:
-        job_id = f"reminder_{user_id}_{plan_id}"
-        if scheduler.get_job(job_id):
-            scheduler.remove_job(job_id)
-            logger.info(f"Напоминание для плана ID {plan_id} удалено.")
-        await message.answer(f"✅ Напоминание для плана ID {plan_id} удалено.", reply_markup=get_plans_keyboard())
 
+    # Новое время (или его отсутствие) снимает отметку об отправке: иначе окно напоминаний
+    # сочтет задание лишним и удалит его, а напоминание за окном не будет создано вовсе
     async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE plans SET reminder_datetime = ? WHERE id = ?", (reminder_datetime_db, plan_id))
+        await db.execute(
+            "UPDATE plans SET reminder_datetime = ?, is_reminder_sent = 0 WHERE id = ? AND user_id = ?",
+            (reminder_datetime_db, plan_id, user_id)
+        )
         await db.commit()
+
+    if reminder_datetime_db:
+        schedule_reminder(user_id, plan_id, dt_aware)
+        await message.answer(f"✅ Напоминание установлено на {dt_aware.strftime('%H:%M')}.", reply_markup=get_plans_keyboard())
+    else:
+        if unschedule_reminder(user_id, plan_id):
+            logger.info(f"Напоминание для плана ID {plan_id} удалено.")
+        await message.answer(f"✅ Напоминание для плана ID {plan_id} удалено.", reply_markup=get_plans_keyboard())
     await state.clear()
 
 async def delete_plans_ids_received(message: types.Message, state: FSMContext):
     from telegram_handlers import display_multiple_plans
     logger.info(f"Получены ID для удаления плана от пользователя {message.from_user.id}: {message.text}")
-    ids = [int(pid) for pid in re.split(r'[,\s]+', message.text) if pid.isdigit()]
-    if not ids:
+    tokens = re.split(r'[,\s]+', message.text)
+    ids = [int(pid) for pid in tokens if pid.isdigit()]
+    series_ids = [series_id for series_id in map(parse_series_id, tokens) if series_id is not None]
+    if not ids and not series_ids:
         await message.answer("ID не найдены. Введите один или несколько ID.", reply_markup=get_plans_keyboard())
         await state.clear()
         return
+    deleted_series_count = 0
+    for series_id in series_ids:
+        if await delete_plan_series(message.from_user.id, series_id):
+            deleted_series_count += 1
+            unschedule_series_reminder(message.from_user.id, series_id)
     deleted_count = 0
     async with aiosqlite.connect(DB_NAME) as db:
         for plan_id in ids:
@@ -423,7 +521,8 @@ async def delete_plans_ids_received(message: types.Message, state: FSMContext):
                 if scheduler.get_job(f"reminder_{message.from_user.id}_{plan_id}"):
                     scheduler.remove_job(f"reminder_{message.from_user.id}_{plan_id}")
         await db.commit()
-    await message.answer(f"✅ Удалено планов: {deleted_count}.", reply_markup=get_plans_keyboard())
+    series_note = f" Повторяющихся планов: {deleted_series_count}." if series_ids else ""
+    await message.answer(f"✅ Удалено планов: {deleted_count}.{series_note}", reply_markup=get_plans_keyboard())
     all_plans = await get_all_user_plans(message.from_user.id)
     if all_plans:
         await display_multiple_plans(message, all_plans, "Все ваши планы:")
@@ -475,4 +574,87 @@ async def set_reminder_id_received(message: types.Message, state: FSMContext):
         file_type=file_type
     )
     await message.answer(f"Напоминание для плана ID {plan['id']}:\n**Тема:** {plan['plan_topic']}\n**Текст:** {plan['plan_text']}\n**Дата:** {display_date}\n\nВо сколько напомнить (ЧЧ:ММ)?", parse_mode="Markdown")
-    await state.set_state(SetReminderStates.awaiting_time)
\ No newline at end of file
+    await state.set_state(SetReminderStates.awaiting_time)
+# --- ПОВТОРЯЮЩИЕСЯ ПЛАНЫ ---
+
+async def add_series_start_date_received(message: types.Message, state: FSMContext):
+    date_str = message.text.strip()
+    try:
+        date_obj = datetime.date.today() if date_str.lower() == 'сегодня' else datetime.datetime.strptime(date_str, "%d.%m.%Y").date()
+    except ValueError:
+        await message.answer("Неверный формат даты. Введите дату в формате ДД.ММ.ГГГГ или нажмите кнопку 'Сегодня'.", reply_markup=get_date_keyboard())
+        return
+    await state.update_data(series_dtstart=date_obj.isoformat())
+    await message.answer(f"Начало: {date_obj.strftime('%d.%m.%Y г.')}. Теперь введите тему плана:", reply_markup=ReplyKeyboardRemove())
+    await state.set_state(AddSeriesStates.awaiting_topic)
+
+async def add_series_topic_received(message: types.Message, state: FSMContext):
+    topic_text = (message.text or "").strip()
+    if not topic_text:
+        await message.answer("Тема плана не может быть пустой. Пожалуйста, введите тему:")
+        return
+    await state.update_data(plan_topic=topic_text)
+    await message.answer(f"Тема: «{topic_text}». Теперь введите текст плана:")
+    await state.set_state(AddSeriesStates.awaiting_text)
+
+async def add_series_text_received(message: types.Message, state: FSMContext):
+    plan_text = (message.text or "").strip()
+    if not plan_text:
+        await message.answer("У повторяющегося плана может быть только текст. Пожалуйста, введите текст плана:")
+        return
+    await state.update_data(plan_text=plan_text)
+    await message.answer(
+        "Как часто повторять план? Выберите вариант или введите правило RRULE, "
+        "например FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH;COUNT=10.",
+        reply_markup=get_recurrence_keyboard()
+    )
+    await state.set_state(AddSeriesStates.awaiting_rule)
+
+async def add_series_rule_received(message: types.Message, state: FSMContext):
+    rule_text = (message.text or "").strip()
+    try:
+        rule = parse_rrule(RECURRENCE_PRESETS.get(rule_text.lower(), rule_text))
+    except RecurrenceError as e:
+        await message.answer(f"Не удалось разобрать правило: {e}. Выберите вариант или введите правило еще раз.", reply_markup=get_recurrence_keyboard())
+        return
+    await state.update_data(rrule=rule.to_rrule())
+    await message.answer(
+        f"План будет повторяться {rule.describe()}. Во сколько напоминать? Введите время в формате ЧЧ:ММ "
+        f"или 'нет', если напоминание не нужно.",
+        reply_markup=ReplyKeyboardRemove()
+    )
+    await state.set_state(AddSeriesStates.awaiting_reminder_time)
+
+async def add_series_reminder_time_received(message: types.Message, state: FSMContext):
+    """Сохраняет серию одной строкой и ставит задание только на ближайшее повторение."""
+    user_data = await state.get_data()
+    user_id = message.from_user.id
+    reminder_time_str = (message.text or "").strip().lower()
+    reminder_time = None
+    if reminder_time_str != 'нет':
+        match = re.fullmatch(r'(\d{1,2}):(\d{2})', reminder_time_str)
+        try:
+            reminder_time = datetime.time(int(match.group(1)), int(match.group(2))).strftime("%H:%M") if match else None
+        except ValueError:
+            reminder_time = None
+        if reminder_time is None:
+            await message.answer("Неверный формат времени. Введите ЧЧ:ММ (например, 09:30), или 'нет' если напоминание не нужно.")
+            return
+
+    series = {'rrule': user_data['rrule'], 'dtstart': user_data['series_dtstart'], 'reminder_time': reminder_time}
+    tz = pytz.timezone(USER_TIMEZONE_STR)
+    next_reminder = next_series_reminder(series, datetime.datetime.now(tz).replace(tzinfo=None))
+    series_id = await add_plan_series(
+        user_id, user_data['plan_topic'], user_data['plan_text'], series['rrule'], series['dtstart'],
+        reminder_time=reminder_time, next_reminder_datetime=next_reminder
+    )
+    rule_description = parse_rrule(series['rrule']).describe()
+    start_display = datetime.date.fromisoformat(series['dtstart']).strftime('%d.%m.%Y г.')
+    answer = f"✅ Повторяющийся план «{user_data['plan_topic']}» ({rule_description}, с {start_display}) добавлен (ID: S{series_id})."
+    if next_reminder:
+        next_reminder_dt = datetime.datetime.strptime(next_reminder, "%Y-%m-%d %H:%M:%S")
+        schedule_series_reminder(user_id, series_id, tz.localize(next_reminder_dt))
+        answer += f"\nБлижайшее напоминание: {next_reminder_dt.strftime('%d.%m.%Y %H:%M')}."
+        logger.info(f"Напоминание для серии S{series_id} установлено на {next_reminder}.")
+    await message.answer(answer, reply_markup=get_plans_keyboard())
+    await state.clear()
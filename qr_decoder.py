@@ -0,0 +1,73 @@
+# qr_decoder.py
+"""
+Распознавание QR-кодов чеков вне цикла событий.
+Фото Telegram перебираются от меньшего размера к большему: большой файл скачивается,
+только если на меньшем QR не найден. Каждое изображение проходит предобработку
+(оттенки серого, уменьшение, адаптивная бинаризация, повороты) до первого успеха.
+Pillow и pyzbar импортируются в рабочем потоке при первом распознавании.
+"""
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from config import logger, QR_DECODE_WORKERS, QR_MIN_PHOTO_SIDE, QR_MAX_DECODE_SIDE
+
+_executor = ThreadPoolExecutor(max_workers=QR_DECODE_WORKERS, thread_name_prefix="qr_decode")
+
+# Насколько пиксель должен быть темнее локального среднего, чтобы считаться черным
+ADAPTIVE_THRESHOLD_OFFSET = 10
+
+
+def _adaptive_threshold(gray):
+    """Бинаризация относительно локальной яркости: устойчива к теням и неравномерному освещению."""
+    from PIL import ImageChops, ImageFilter
+
+    radius = max(gray.size) // 40 or 1
+    local_mean = gray.filter(ImageFilter.BoxBlur(radius))
+    darker_by = ImageChops.subtract(local_mean, gray)
+    return darker_by.point(lambda value: 0 if value > ADAPTIVE_THRESHOLD_OFFSET else 255)
+
+
+def _candidate_images(image):
+    """Варианты изображения (PIL.Image) в порядке возрастания стоимости обработки."""
+    from PIL import ImageOps
+
+    gray = ImageOps.exif_transpose(image).convert("L")
+    if max(gray.size) > QR_MAX_DECODE_SIDE:
+        gray.thumbnail((QR_MAX_DECODE_SIDE, QR_MAX_DECODE_SIDE))
+    yield gray
+    yield ImageOps.autocontrast(gray)
+    binary = _adaptive_threshold(gray)
+    yield binary
+    for angle in (90, 180, 270):
+        yield binary.rotate(angle, expand=True)
+
+
+def decode_qr_image(image_bytes: bytes) -> str | None:
+    """Синхронно ищет QR-код на изображении. Возвращает его содержимое или None."""
+    from PIL import Image
+    from pyzbar.pyzbar import ZBarSymbol, decode
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        for candidate in _candidate_images(image):
+            decoded_objects = decode(candidate, symbols=[ZBarSymbol.QRCODE])
+            if decoded_objects:
+                return decoded_objects[0].data.decode("utf-8")
+    return None
+
+
+async def decode_qr_from_photo(bot, photo_sizes: list) -> str | None:
+    """
+    Перебирает размеры фото (message.photo) от меньшего к большему, скачивая
+    каждый следующий только если на предыдущем QR-код не найден.
+    """
+    loop = asyncio.get_running_loop()
+    sizes = sorted(photo_sizes, key=lambda size: size.width * size.height)
+    usable_sizes = [size for size in sizes if min(size.width, size.height) >= QR_MIN_PHOTO_SIDE] or sizes[-1:]
+    for size in usable_sizes:
+        downloaded = await bot.download(size.file_id)
+        qr_data = await loop.run_in_executor(_executor, decode_qr_image, downloaded.read())
+        if qr_data:
+            logger.info(f"QR-код распознан на фото {size.width}x{size.height}.")
+            return qr_data
+    return None
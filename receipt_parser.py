@@ -0,0 +1,118 @@
+# receipt_parser.py
+"""
+Локальный разбор страниц фискальных чеков ofd.soliq.uz без обращения к ИИ.
+Из HTML извлекаются итоговая сумма, дата и позиции; результат проходит проверку
+(сумма позиций должна сходиться с итогом). Если проверка не пройдена, вызывающий
+код переходит к разбору через Gemini.
+"""
+import datetime
+import re
+
+from amounts import parse_amount
+
+# Подписи строк, которые не являются товарами (итоги, налоги, способы оплаты)
+SERVICE_ROW_MARKERS = ("jami", "qqs", "naqd", "karta", "bank", "umumiy", "chegirma", "to`lov", "to'lov", "итого", "ндс")
+TOTAL_MARKERS = ("jami to`lov", "jami to'lov", "jami to‘lov", "jami tolov")
+DATE_PATTERNS = [
+    (re.compile(r"(\d{2}\.\d{2}\.\d{4})[,\s]+(\d{2}:\d{2}(?::\d{2})?)"), ("%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M")),
+    (re.compile(r"(\d{4}-\d{2}-\d{2})[T\s]+(\d{2}:\d{2}(?::\d{2})?)"), ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M")),
+]
+CURRENCY_SUFFIX = re.compile(r"\s*(сум|so`m|so'm|so‘m|uzs)$", re.IGNORECASE)
+# Допустимое расхождение суммы позиций и итога (скидки, округление)
+TOTAL_TOLERANCE = 0.01
+
+# Сколько раз чек был разобран локально и сколько раз пришлось звать ИИ
+parser_stats = {"local": 0, "llm_fallback": 0, "llm_failed": 0}
+
+
+class ReceiptParseError(ValueError):
+    """Страница не похожа на чек ожидаемой структуры или данные не сходятся."""
+
+
+def _parse_number(text: str) -> float:
+    """
+    Сумма или количество из ячейки чека. Отбрасывается только подпись валюты, само число
+    разбирается общим строгим amounts.parse_amount: неоднозначные значения вроде «8.000»
+    отклоняются, а не угадываются (иначе сумма могла бы ошибиться в 1000 раз).
+    """
+    return parse_amount(CURRENCY_SUFFIX.sub("", text.strip()))
+
+
+def _is_number(text: str) -> bool:
+    try:
+        _parse_number(text)
+    except ValueError:
+        return False
+    return True
+
+
+def _row_cells(row) -> list[str]:
+    return [" ".join(cell.text_content().split()) for cell in row.xpath("./td|./th")]
+
+
+def _find_date(page_text: str) -> datetime.datetime:
+    for pattern, formats in DATE_PATTERNS:
+        match = pattern.search(page_text)
+        if not match:
+            continue
+        value = f"{match.group(1)} {match.group(2)}"
+        for date_format in formats:
+            try:
+                return datetime.datetime.strptime(value, date_format)
+            except ValueError:
+                continue
+    raise ReceiptParseError("Дата чека не найдена.")
+
+
+def _find_total(rows: list[list[str]]) -> float:
+    for cells in rows:
+        if cells and any(marker in cells[0].lower() for marker in TOTAL_MARKERS):
+            for value in reversed(cells[1:]):
+                if _is_number(value):
+                    return _parse_number(value)
+    raise ReceiptParseError("Итоговая сумма не найдена.")
+
+
+def _find_items(document, rows: list[list[str]]) -> list[dict]:
+    # Основной вариант разметки: строки товаров помечены классом products-row
+    product_rows = [_row_cells(row) for row in document.xpath("//tr[contains(concat(' ', normalize-space(@class), ' '), ' products-row ')]")]
+    candidate_rows = product_rows or rows
+
+    items = []
+    for cells in candidate_rows:
+        if len(cells) < 3 or _is_number(cells[0]) or not cells[0]:
+            continue
+        if any(marker in cells[0].lower() for marker in SERVICE_ROW_MARKERS):
+            continue
+        numbers = [_parse_number(value) for value in cells[1:] if _is_number(value)]
+        if len(numbers) < 2:
+            continue
+        # Первое число — количество, последнее — стоимость позиции
+        items.append({"name": cells[0], "quantity": numbers[0], "price_total": numbers[-1]})
+    return items
+
+
+def parse_receipt_html(html_content: bytes | str) -> dict:
+    """
+    Разбирает страницу чека. Возвращает словарь
+    {"total_sum": float, "check_date": datetime, "items": [{"name", "quantity", "price_total"}]}
+    или бросает ReceiptParseError, если данные не найдены или не прошли проверку.
+    """
+    from lxml import html as lxml_html
+
+    try:
+        document = lxml_html.fromstring(html_content)
+    except Exception as e:
+        raise ReceiptParseError(f"Некорректный HTML: {e}") from e
+
+    rows = [cells for cells in (_row_cells(row) for row in document.xpath("//tr")) if cells]
+    total_sum = _find_total(rows)
+    check_date = _find_date(" ".join(document.text_content().split()))
+    items = _find_items(document, rows)
+
+    if total_sum <= 0 or not items:
+        raise ReceiptParseError("Позиции чека не найдены.")
+    items_sum = sum(item["price_total"] for item in items)
+    if abs(items_sum - total_sum) > max(1.0, total_sum * TOTAL_TOLERANCE):
+        raise ReceiptParseError(f"Сумма позиций {items_sum:.2f} не сходится с итогом {total_sum:.2f}.")
+    return {"total_sum": total_sum, "check_date": check_date, "items": items}
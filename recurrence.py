@@ -0,0 +1,160 @@
+# recurrence.py
+"""
+Повторяющиеся планы: подмножество RRULE (RFC 5545) без внешних зависимостей.
+Поддерживаются FREQ=DAILY|WEEKLY|MONTHLY, INTERVAL, BYDAY (для WEEKLY), COUNT и UNTIL.
+Серия хранится одной строкой, а даты повторений вычисляются лениво и только для
+запрошенного диапазона: без COUNT генератор сразу перескакивает к нужному периоду,
+поэтому стоимость не зависит от того, как давно началась серия.
+"""
+import datetime
+from dataclasses import dataclass
+
+WEEKDAYS = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+WEEKDAY_NAMES = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY")
+MAX_COUNT = 1000 # Больше повторений по COUNT не разрешаем: с COUNT серия перебирается с начала
+MAX_PERIODS = 100_000 # Предохранитель от бесконечного перебора (например, 31-е число раз в 12 месяцев с февраля)
+
+
+class RecurrenceError(ValueError):
+    """Правило повторения не распознано или не поддерживается."""
+
+
+@dataclass(frozen=True)
+class RecurrenceRule:
+    freq: str
+    interval: int = 1
+    byweekday: tuple = ()
+    count: int | None = None
+    until: datetime.date | None = None
+
+    def to_rrule(self) -> str:
+        parts = [f"FREQ={self.freq}"]
+        if self.interval != 1:
+            parts.append(f"INTERVAL={self.interval}")
+        if self.byweekday:
+            parts.append("BYDAY=" + ",".join(WEEKDAYS[day] for day in self.byweekday))
+        if self.count:
+            parts.append(f"COUNT={self.count}")
+        if self.until:
+            parts.append(f"UNTIL={self.until.strftime('%Y%m%d')}")
+        return ";".join(parts)
+
+    def describe(self) -> str:
+        """Описание правила для пользователя, например «каждую 2-ю неделю (пн, ср)»."""
+        if self.freq == "WEEKLY" and self.interval == 1 and self.byweekday == (0, 1, 2, 3, 4):
+            text = "по будням"
+        else:
+            unit = {"DAILY": ("день", "каждый"), "WEEKLY": ("неделю", "каждую"), "MONTHLY": ("месяц", "каждый")}[self.freq]
+            text = f"{unit[1]} {unit[0]}" if self.interval == 1 else f"{unit[1]} {self.interval}-й {unit[0]}"
+            if self.byweekday:
+                text += f" ({', '.join(WEEKDAY_NAMES[day] for day in self.byweekday)})"
+        if self.count:
+            text += f", {self.count} раз"
+        if self.until:
+            text += f", до {self.until.strftime('%d.%m.%Y')}"
+        return text
+
+
+def parse_rrule(text: str) -> RecurrenceRule:
+    """Разбирает строку вида 'FREQ=WEEKLY;BYDAY=MO,WE;COUNT=10' (префикс 'RRULE:' допускается)."""
+    text = text.strip().upper()
+    if text.startswith("RRULE:"):
+        text = text[len("RRULE:"):]
+    fields = {}
+    for part in filter(None, text.split(";")):
+        name, sep, value = part.partition("=")
+        if not sep or not value:
+            raise RecurrenceError(f"Некорректная часть правила: {part}")
+        fields[name.strip()] = value.strip()
+
+    freq = fields.pop("FREQ", None)
+    if freq not in FREQUENCIES:
+        raise RecurrenceError(f"Поддерживаются только FREQ={', '.join(FREQUENCIES)}")
+    try:
+        interval = int(fields.pop("INTERVAL", "1"))
+        count = int(fields["COUNT"]) if "COUNT" in fields else None
+        until = datetime.datetime.strptime(fields["UNTIL"][:8], "%Y%m%d").date() if "UNTIL" in fields else None
+    except ValueError as e:
+        raise RecurrenceError(f"Некорректное значение в правиле: {e}") from e
+    fields.pop("COUNT", None)
+    fields.pop("UNTIL", None)
+    if interval < 1 or (count is not None and not 1 <= count <= MAX_COUNT):
+        raise RecurrenceError(f"INTERVAL должен быть не меньше 1, COUNT — от 1 до {MAX_COUNT}")
+
+    byweekday = ()
+    if "BYDAY" in fields:
+        if freq != "WEEKLY":
+            raise RecurrenceError("BYDAY поддерживается только для FREQ=WEEKLY")
+        days = fields.pop("BYDAY").split(",")
+        if any(day not in WEEKDAYS for day in days):
+            raise RecurrenceError(f"Дни недели BYDAY: {', '.join(WEEKDAYS)}")
+        byweekday = tuple(sorted({WEEKDAYS.index(day) for day in days}))
+    if fields:
+        raise RecurrenceError(f"Неподдерживаемые части правила: {', '.join(fields)}")
+    return RecurrenceRule(freq=freq, interval=interval, byweekday=byweekday, count=count, until=until)
+
+
+def _first_period(rule: RecurrenceRule, dtstart: datetime.date, start: datetime.date) -> int:
+    """Номер первого периода, который может содержать даты не раньше start."""
+    if start <= dtstart:
+        return 0
+    if rule.freq == "DAILY":
+        elapsed = (start - dtstart).days
+    elif rule.freq == "WEEKLY":
+        elapsed = ((start - datetime.timedelta(days=start.weekday())) - (dtstart - datetime.timedelta(days=dtstart.weekday()))).days // 7
+    else:
+        elapsed = (start.year - dtstart.year) * 12 + start.month - dtstart.month
+    return elapsed // rule.interval
+
+
+def _period_dates(rule: RecurrenceRule, dtstart: datetime.date, period: int) -> list:
+    if rule.freq == "DAILY":
+        return [dtstart + datetime.timedelta(days=period * rule.interval)]
+    if rule.freq == "WEEKLY":
+        week_start = dtstart - datetime.timedelta(days=dtstart.weekday()) + datetime.timedelta(weeks=period * rule.interval)
+        return [week_start + datetime.timedelta(days=day) for day in (rule.byweekday or (dtstart.weekday(),))]
+    months = dtstart.month - 1 + period * rule.interval
+    try:
+        return [datetime.date(dtstart.year + months // 12, months % 12 + 1, dtstart.day)]
+    except ValueError:
+        return [] # В месяце нет такого числа (например, 31-го) — как в RFC 5545, повторение пропускается
+
+
+def iter_occurrences(rule: RecurrenceRule, dtstart: datetime.date, start: datetime.date = None):
+    """
+    Даты повторений по возрастанию, начиная с периода, содержащего start.
+    С COUNT перебор всегда идет с начала серии (нужно считать повторения), без COUNT — с нужного периода.
+    """
+    period = _first_period(rule, dtstart, start) if start and not rule.count else 0
+    emitted = 0
+    for period in range(period, period + MAX_PERIODS):
+        for day in _period_dates(rule, dtstart, period):
+            if day < dtstart:
+                continue
+            if rule.until and day > rule.until:
+                return
+            emitted += 1
+            if rule.count and emitted > rule.count:
+                return
+            if start is None or day >= start:
+                yield day
+
+
+def occurrences_between(rule: RecurrenceRule, dtstart: datetime.date, start: datetime.date, end: datetime.date) -> list:
+    """Даты повторений в диапазоне [start, end]."""
+    result = []
+    for day in iter_occurrences(rule, dtstart, start):
+        if day > end:
+            break
+        result.append(day)
+    return result
+
+
+def next_occurrence_at(rule: RecurrenceRule, dtstart: datetime.date, at_time: datetime.time, after: datetime.datetime):
+    """Ближайшее повторение (дата + время at_time) строго позже after или None, если серия закончилась."""
+    for day in iter_occurrences(rule, dtstart, after.date()):
+        occurrence = datetime.datetime.combine(day, at_time)
+        if occurrence > after:
+            return occurrence
+    return None
@@ -0,0 +1,274 @@
+# reports.py
+import asyncio
+import csv
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+
+from aiogram.types import InputFile
+
+from config import (
+    REPORT_WORKERS, REPORT_QUEUE_SIZE, REPORT_STREAM_BATCH_SIZE, REPORT_CACHE_DIR, REPORT_CACHE_MAX_BYTES,
+    PARQUET_ROW_GROUP_SIZE, logger
+)
+from db import iter_transactions_by_book
+from disk_cache import DiskLRUCache
+
+CURRENCY_SYMBOLS = {'USD': '$', 'UZS': 'сум', 'RUB': '₽', 'EUR': '€'}
+def get_currency_symbol(currency_code: str) -> str:
+    if not currency_code:
+        return ""
+    return CURRENCY_SYMBOLS.get(currency_code.upper(), currency_code.upper())
+
+TYPE_MAP = {"income": "Доход", "expense": "Расход"}
+
+
+# --- РЕНДЕРИНГ ОТЧЕТОВ (синхронный, выполняется в пуле потоков) ---
+# Транзакции передаются кортежами (id, transaction_date, type, amount, category, description),
+# как их отдает db.iter_transactions_by_book.
+
+MONTH_NAMES = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь", "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"]
+
+def render_pdf_report(*args, **kwargs) -> bytes:
+    # ReportLab импортируется при первом PDF-отчете, а не при запуске бота
+    from pdf_render import render_pdf_report as render
+    return render(*args, **kwargs)
+
+def render_pdf_report_paginated(*args, **kwargs) -> bytes:
+    from pdf_render import render_pdf_report_paginated as render
+    return render(*args, **kwargs)
+
+
+def iter_rows_from_batches(batches, loop: asyncio.AbstractEventLoop):
+    """
+    Синхронный итератор по строкам асинхронного генератора пачек (iter_transactions_by_book)
+    для рендеринга в потоке пула: следующая пачка запрашивается у цикла событий, только когда
+    предыдущая разобрана, поэтому строки книги целиком в памяти не собираются.
+    iter_transactions_by_book читает каждую пачку отдельным коротким запросом, так что
+    пока поток рисует отчет, чтение не держит блокировку БД и не мешает записи.
+    Закрывать генератор (aclose) должен вызывающий код в цикле событий.
+    """
+    while True:
+        try:
+            batch = asyncio.run_coroutine_threadsafe(batches.__anext__(), loop).result()
+        except StopAsyncIteration:
+            return
+        yield from batch
+
+
+# --- ПОТОКОВЫЙ CSV ---
+
+class StreamingCSVReport(InputFile):
+    """
+    CSV-отчет, который читается из БД пачками прямо во время загрузки в Telegram.
+    В памяти одновременно находится только одна пачка строк, поэтому расход памяти
+    не зависит от размера книги. Итоги передаются заранее посчитанными в SQL.
+    Если передан cache и cache_key, отданные байты параллельно пишутся в кэш
+    и сохраняются в нем только после успешной выгрузки всего файла.
+    """
+    def __init__(self, user_id: int, book_id: int, book_currency: str, total_income: float, total_expense: float,
+                 filename: str, batch_size: int = REPORT_STREAM_BATCH_SIZE,
+                 cache: DiskLRUCache = None, cache_key: str = None):
+        super().__init__(filename=filename)
+        self.cache = cache
+        self.cache_key = cache_key
+        self.user_id = user_id
+        self.book_id = book_id
+        self.book_currency = book_currency
+        self.total_income = total_income
+        self.total_expense = total_expense
+        self.batch_size = batch_size
+
+    @staticmethod
+    def _encode_rows(rows) -> bytes:
+        string_io = io.StringIO()
+        csv.writer(string_io).writerows(rows)
+        return string_io.getvalue().encode('utf-8')
+
+    async def read(self, bot=None):
+        # Если выгрузку прервали, генераторы закрываются сразу (aclosing), а не сборщиком мусора:
+        # иначе соединение с БД из iter_transactions_by_book осталось бы открытым
+        if not (self.cache and self.cache_key):
+            async with aclosing(self._generate()) as chunks:
+                async for chunk in chunks:
+                    yield chunk
+            return
+
+        temp_path = await asyncio.to_thread(self.cache.new_temp_path)
+        try:
+            with open(temp_path, "wb") as cache_file:
+                async with aclosing(self._generate()) as chunks:
+                    async for chunk in chunks:
+                        cache_file.write(chunk)
+                        yield chunk
+            await asyncio.to_thread(self.cache.put_file, self.cache_key, temp_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    async def _generate(self):
+        # BOM в начале файла, чтобы Excel правильно определил кодировку UTF-8
+        yield '\ufeff'.encode('utf-8') + self._encode_rows([["ID", "Дата", "Тип", "Сумма", "Валюта", "Категория", "Описание"]])
+        async with aclosing(iter_transactions_by_book(self.user_id, self.book_id, self.batch_size)) as batches:
+            async for batch in batches:
+                yield self._encode_rows(
+                    [t_id, t_date, TYPE_MAP.get(t_type, t_type), amount, self.book_currency, category, description]
+                    for t_id, t_date, t_type, amount, category, description in batch
+                )
+        balance = self.total_income - self.total_expense
+        yield self._encode_rows([
+            [],
+            ['', '', 'Общая сумма Доходов', f'{self.total_income:.2f}', self.book_currency],
+            ['', '', 'Общая сумма Расходов', f'{self.total_expense:.2f}', self.book_currency],
+            ['', '', 'Баланс', f'{balance:.2f}', self.book_currency],
+        ])
+
+
+# --- ВЫГРУЗКА В PARQUET ---
+
+class ParquetUnavailable(Exception):
+    """Библиотека pyarrow не установлена."""
+
+
+def _parquet_schema(pa, book_name: str, book_currency: str):
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("transaction_date", pa.timestamp("ms")),
+            ("type", pa.dictionary(pa.int8(), pa.string())),
+            ("amount", pa.float64()),
+            ("currency", pa.dictionary(pa.int8(), pa.string())),
+            ("category", pa.dictionary(pa.int32(), pa.string())),
+            ("description", pa.string()),
+        ],
+        metadata={"book_name": book_name, "book_currency": book_currency or ""},
+    )
+
+
+def _parquet_table(pa, pc, schema, batch, book_currency: str):
+    """Собирает типизированную таблицу Arrow из пачки строк (id, date, type, amount, category, description)."""
+    ids, dates, types, amounts, categories, descriptions = zip(*batch)
+    parsed_dates = pc.strptime(
+        pa.array([(d or "")[:19] for d in dates], pa.string()), format="%Y-%m-%d %H:%M:%S", unit="ms", error_is_null=True
+    )
+    return pa.Table.from_arrays(
+        [
+            pa.array(ids, pa.int64()),
+            parsed_dates,
+            pa.array(types, pa.string()).dictionary_encode().cast(schema.field("type").type),
+            pa.array(amounts, pa.float64()),
+            pa.DictionaryArray.from_arrays(pa.array([0] * len(batch), pa.int8()), pa.array([book_currency or ""])),
+            pa.array(categories, pa.string()).dictionary_encode().cast(schema.field("category").type),
+            pa.array(descriptions, pa.string()),
+        ],
+        schema=schema,
+    )
+
+
+async def write_parquet_report(user_id: int, book_id: int, book_name: str, book_currency: str, path: str,
+                               row_group_size: int = PARQUET_ROW_GROUP_SIZE) -> int:
+    """
+    Пишет транзакции книги в Parquet-файл path: типизированные колонки со сжатием zstd,
+    по одной группе строк на каждую пачку из БД. В памяти держится не больше
+    одной пачки, запись на диск выполняется вне цикла событий. Пачки читаются короткими
+    запросами, поэтому на время конвертации в Arrow и записи групп строк БД для записи
+    не блокируется. Возвращает число строк.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ParquetUnavailable() from e
+
+    schema = _parquet_schema(pa, book_name, book_currency)
+    writer = await asyncio.to_thread(pq.ParquetWriter, path, schema, compression="zstd")
+    rows_written = 0
+    try:
+        async with aclosing(iter_transactions_by_book(user_id, book_id, row_group_size)) as batches:
+            async for batch in batches:
+                table = await asyncio.to_thread(_parquet_table, pa, pc, schema, batch, book_currency)
+                await asyncio.to_thread(writer.write_table, table)
+                rows_written += len(batch)
+    finally:
+        await asyncio.to_thread(writer.close)
+    return rows_written
+
+
+# --- КЭШ ГОТОВЫХ ОТЧЕТОВ ---
+
+# Ключ включает версию содержимого книги (books.content_version), поэтому любое
+# изменение транзакций автоматически делает старые записи недостижимыми.
+report_cache = DiskLRUCache(REPORT_CACHE_DIR, REPORT_CACHE_MAX_BYTES)
+
+def report_cache_key(book_id: int, report_format: str, content_version: int) -> str:
+    return f"report:{book_id}:{report_format}:{content_version}"
+
+
+# --- ПУЛ РЕНДЕРИНГА ---
+
+class ReportQueueFull(Exception):
+    """Очередь рендеринга отчетов переполнена."""
+
+
+class ReportRenderPool:
+    """
+    Пул потоков для рендеринга отчетов вне цикла событий.
+    Число одновременно ожидающих и выполняющихся задач ограничено:
+    при переполнении render() сразу бросает ReportQueueFull, а не копит задачи в памяти.
+    """
+    def __init__(self, workers: int, queue_size: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report_render")
+        self._capacity = workers + queue_size
+        self._in_flight = 0
+        self._metrics = {
+            "rendered": 0,
+            "failed": 0,
+            "rejected": 0,
+            "render_seconds_total": 0.0,
+            "render_seconds_max": 0.0,
+            "wait_seconds_total": 0.0,
+        }
+
+    @staticmethod
+    def _timed_call(func, args, queued_at: float):
+        started_at = time.perf_counter()
+        result = func(*args)
+        return result, started_at - queued_at, time.perf_counter() - started_at
+
+    async def render(self, func, *args):
+        if self._in_flight >= self._capacity:
+            self._metrics["rejected"] += 1
+            raise ReportQueueFull()
+        self._in_flight += 1
+        loop = asyncio.get_running_loop()
+        try:
+            result, wait_seconds, render_seconds = await loop.run_in_executor(
+                self._executor, self._timed_call, func, args, time.perf_counter()
+            )
+        except Exception:
+            self._metrics["failed"] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+
+        self._metrics["rendered"] += 1
+        self._metrics["render_seconds_total"] += render_seconds
+        self._metrics["render_seconds_max"] = max(self._metrics["render_seconds_max"], render_seconds)
+        self._metrics["wait_seconds_total"] += wait_seconds
+        logger.info(f"Отчет {func.__name__} отрисован за {render_seconds:.3f} с (ожидание в очереди {wait_seconds:.3f} с).")
+        return result
+
+    def get_metrics(self) -> dict:
+        metrics = dict(self._metrics)
+        metrics["in_flight"] = self._in_flight
+        metrics["render_seconds_avg"] = metrics["render_seconds_total"] / metrics["rendered"] if metrics["rendered"] else 0.0
+        return metrics
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+report_pool = ReportRenderPool(REPORT_WORKERS, REPORT_QUEUE_SIZE)
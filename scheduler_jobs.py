@@ -1,16 +1,32 @@
 # scheduler_jobs.py
+import asyncio
 import datetime
 import logging
+import time
 
 import aiosqlite
 from aiogram import Bot
 import pytz
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+)
+from aiogram.types import InputMediaPhoto
 from aiogram.utils.markdown import hbold
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.date import DateTrigger
 
-from config import DB_NAME, USER_TIMEZONE_STR, logger, user_voice_reply_preference
+from config import (
+    DB_NAME, SCHEDULER_JOBS_DB, USER_TIMEZONE_STR, REMINDER_HORIZON_HOURS, REMINDER_MISFIRE_GRACE_SECONDS,
+    REMINDER_PREFETCH_SECONDS, REMINDER_PREFETCH_LIMIT, REMINDER_SEND_MAX_ATTEMPTS, REMINDER_SEND_RETRY_BASE_DELAY,
+    REMINDER_REDELIVERY_MAX_SWEEPS, REMINDER_REDELIVERY_BATCH_SIZE, REMINDER_COALESCE_SECONDS,
+    ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_PAUSE_SECONDS, logger, user_voice_reply_preference
+)
+from db import get_reminder_contents, get_plan_series_by_id, set_series_next_reminder
+from job_store import SQLiteJobStore
 from keyboards import get_plans_keyboard # Импортируем клавиатуру для напоминаний
+from recurrence import parse_rrule, next_occurrence_at
 
 
 # Инициализация планировщика
@@ -20,7 +36,14 @@ except pytz.exceptions.UnknownTimeZoneError:
     logger.error(f"Неизвестный часовой пояс: {USER_TIMEZONE_STR}. Используется UTC.")
     user_timezone = pytz.utc
 
-scheduler = AsyncIOScheduler(timezone=user_timezone)
+# Напоминания хранятся в SQLite и переживают перезапуск; служебные периодические задачи
+# добавляются при каждом запуске и живут в памяти.
+REMINDERS_JOBSTORE = "reminders"
+reminders_jobstore = SQLiteJobStore(SCHEDULER_JOBS_DB)
+scheduler = AsyncIOScheduler(
+    timezone=user_timezone,
+    jobstores={"default": MemoryJobStore(), REMINDERS_JOBSTORE: reminders_jobstore},
+)
 
 _bot_instance: Bot = None
 
@@ -30,125 +53,613 @@ def set_bot_instance_for_scheduler(bot: Bot):
     logger.info("Экземпляр бота установлен для планировщика.")
 
 
-# ИЗМЕНЕНИЕ: Добавили plan_topic_reminder, telegram_file_id, file_type в аргументы
-async def send_reminder_job(
-    user_telegram_id: int, plan_db_id: int, plan_topic_reminder: str, plan_text_reminder: str,
-    telegram_file_id: str = None, file_type: str = None
-):
+# Микрокэш содержимого напоминаний: когда срабатывает напоминание, одним запросом загружаются
+# и те, что сработают в ближайшие REMINDER_PREFETCH_SECONDS, — пачка напоминаний на одно
+# время не превращается в пачку одинаковых запросов к БД.
+_reminder_contents = {} # plan_id -> (истекает в (monotonic), содержимое)
+_reminder_contents_lock = asyncio.Lock()
+
+
+def invalidate_reminder_content(plan_id: int):
+    """Сбрасывает закэшированное содержимое напоминания (после изменения текста или темы плана)."""
+    _reminder_contents.pop(plan_id, None)
+
+
+def _take_cached_reminder_content(plan_id: int):
+    cached = _reminder_contents.pop(plan_id, None)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    return None
+
+
+async def get_reminder_content(plan_id: int) -> dict | None:
+    content = _take_cached_reminder_content(plan_id)
+    if content is not None:
+        return content
+    async with _reminder_contents_lock:
+        # Пока ждали блокировку, содержимое могло загрузиться вместе с соседним напоминанием
+        content = _take_cached_reminder_content(plan_id)
+        if content is not None:
+            return content
+        now = datetime.datetime.now(user_timezone)
+        contents = await get_reminder_contents(
+            plan_id,
+            (now - datetime.timedelta(seconds=REMINDER_MISFIRE_GRACE_SECONDS)).strftime("%Y-%m-%d %H:%M:%S"),
+            (now + datetime.timedelta(seconds=REMINDER_PREFETCH_SECONDS)).strftime("%Y-%m-%d %H:%M:%S"),
+            REMINDER_PREFETCH_LIMIT,
+        )
+        expires_at = time.monotonic() + REMINDER_PREFETCH_SECONDS
+        for expired_id in [key for key, (expires, _) in _reminder_contents.items() if expires <= time.monotonic()]:
+            del _reminder_contents[expired_id]
+        for prefetched_id, prefetched in contents.items():
+            if prefetched_id != plan_id:
+                _reminder_contents[prefetched_id] = (expires_at, prefetched)
+        return contents.get(plan_id)
+
+
+# Метрики доставки напоминаний (для /stats)
+reminder_stats = {"sent": 0, "coalesced": 0, "retries": 0, "dead_lettered": 0, "redelivered": 0}
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+MEDIA_GROUP_LIMIT = 10 # Telegram принимает в альбоме от 2 до 10 элементов
+
+# Общее соединение для отметок о доставке: напоминания срабатывают пачками, и открывать
+# базу на каждое из них незачем. Открывается при первой отметке, закрывается при остановке бота.
+_reminders_db = None
+
+
+async def _get_reminders_db():
+    global _reminders_db
+    if _reminders_db is None:
+        _reminders_db = await aiosqlite.connect(DB_NAME)
+    return _reminders_db
+
+
+async def close_reminders_db():
+    global _reminders_db
+    if _reminders_db is not None:
+        await _reminders_db.close()
+        _reminders_db = None
+
+
+async def _send_with_retries(send):
+    """
+    Вызывает send() до REMINDER_SEND_MAX_ATTEMPTS раз при временных ошибках Telegram
+    (сеть, 5xx, RetryAfter) с экспоненциальной паузой. Остальные ошибки не повторяются.
+    """
+    for attempt in range(1, REMINDER_SEND_MAX_ATTEMPTS + 1):
+        try:
+            return await send()
+        except TelegramRetryAfter as e:
+            if attempt == REMINDER_SEND_MAX_ATTEMPTS:
+                raise
+            delay = e.retry_after
+        except (TelegramNetworkError, TelegramServerError):
+            if attempt == REMINDER_SEND_MAX_ATTEMPTS:
+                raise
+            delay = REMINDER_SEND_RETRY_BASE_DELAY * (2 ** (attempt - 1))
+        reminder_stats["retries"] += 1
+        logger.warning(f"Временная ошибка Telegram, повтор отправки {attempt + 1}/{REMINDER_SEND_MAX_ATTEMPTS} через {delay:.1f} с.")
+        await asyncio.sleep(delay)
+
+
+class ReminderDeliveryError(Exception):
+    """
+    Текст напоминаний доставлен не полностью. delivered — планы, сообщения с которыми
+    уже ушли (их нельзя отправлять повторно), error — исходная ошибка отправки.
+    """
+    def __init__(self, delivered: list, error: Exception):
+        super().__init__(str(error))
+        self.delivered = delivered
+        self.error = error
+
+
+def _format_reminder_messages(contents: dict) -> list[tuple[str, list]]:
+    """
+    Текст напоминаний одного пользователя: одно напоминание — как раньше, несколько — списком.
+    Возвращает пары (текст сообщения, ID планов в нем).
+    """
+    if len(contents) == 1:
+        plan_id, content = next(iter(contents.items()))
+        return [(
+            f"🔔 {hbold('Напоминание о вашем плане:')}\n"
+            f"Тема: {hbold(content['topic'])}\n"
+            f"Описание: «{content['text']}»",
+            [plan_id],
+        )]
+    messages, current, current_ids = [], f"🔔 {hbold(f'Напоминания о ваших планах ({len(contents)}):')}", []
+    for number, (plan_id, content) in enumerate(contents.items(), start=1):
+        entry = f"\n\n{number}. {hbold(content['topic'])}\n«{content['text']}»"
+        if len(current) + len(entry) > TELEGRAM_MESSAGE_LIMIT:
+            messages.append((current, current_ids))
+            current, current_ids = entry.lstrip("\n"), []
+        else:
+            current += entry
+        current_ids.append(plan_id)
+    messages.append((current, current_ids))
+    return messages
+
+
+async def deliver_reminders(user_telegram_id: int, contents: dict):
+    """
+    Отправляет пользователю напоминания по нескольким планам ({plan_id: содержимое}): общий текст
+    и вложения — фото альбомами по MEDIA_GROUP_LIMIT, голосовые по одному.
+    Если текст не удалось отправить, бросает ReminderDeliveryError со списком планов, сообщения
+    с которыми уже доставлены (вложения к ним тоже отправляются). Ошибка отправки вложений
+    только логируется: текст уже доставлен, и повтор его бы продублировал.
+    """
+    if _bot_instance is None:
+        raise RuntimeError("_bot_instance не установлен")
+    delivered, error = [], None
+    for text, plan_ids in _format_reminder_messages(contents):
+        try:
+            await _send_with_retries(lambda: _bot_instance.send_message(
+                chat_id=user_telegram_id,
+                text=text,
+                parse_mode="HTML",
+                reply_markup=get_plans_keyboard()
+            ))
+        except Exception as e:
+            error = e
+            break
+        delivered.extend(plan_ids)
+    if delivered:
+        logger.info(f"Напоминания отправлены пользователю {user_telegram_id} для планов ID {', '.join(map(str, delivered))}.")
+
+    photos = [(plan_id, file_id) for plan_id in delivered for file_id, file_type in contents[plan_id]["attachments"] if file_type == 'photo']
+    voices = [(plan_id, file_id) for plan_id in delivered for file_id, file_type in contents[plan_id]["attachments"] if file_type == 'voice']
+    for start in range(0, len(photos), MEDIA_GROUP_LIMIT):
+        group = photos[start:start + MEDIA_GROUP_LIMIT]
+        try:
+            if len(group) == 1:
+                plan_id, file_id = group[0]
+                await _send_with_retries(lambda: _bot_instance.send_photo(chat_id=user_telegram_id, photo=file_id, caption=f"Вложение к плану ID {plan_id}"))
+            else:
+                media = [InputMediaPhoto(media=file_id, caption=f"Вложение к плану ID {plan_id}") for plan_id, file_id in group]
+                await _send_with_retries(lambda: _bot_instance.send_media_group(chat_id=user_telegram_id, media=media))
+        except Exception as e:
+            logger.error(f"Ошибка при отправке фото-вложений пользователю {user_telegram_id}: {e}", exc_info=True)
+    for plan_id, file_id in voices:
+        try:
+            await _send_with_retries(lambda: _bot_instance.send_voice(chat_id=user_telegram_id, voice=file_id, caption=f"Вложение к плану ID {plan_id}"))
+        except Exception as e:
+            logger.error(f"Ошибка при отправке голосового вложения {file_id} для плана {plan_id}: {e}", exc_info=True)
+
+    if error is not None:
+        raise ReminderDeliveryError(delivered, error) from error
+
+
+def _split_delivery_error(contents: dict, error: Exception) -> tuple[list, list, Exception]:
+    """Делит планы после ошибки доставки на доставленные и недоставленные; возвращает и исходную ошибку."""
+    delivered = error.delivered if isinstance(error, ReminderDeliveryError) else []
+    cause = error.error if isinstance(error, ReminderDeliveryError) else error
+    return delivered, [plan_id for plan_id in contents if plan_id not in delivered], cause
+
+
+async def _deliver_and_record(user_telegram_id: int, contents: dict):
+    """
+    Доставляет напоминания и отмечает планы обработанными; недоставленные — в reminder_dead_letters.
+    Если из нескольких сообщений ушла только часть, в dead-letter попадают лишь планы из неотправленных.
+    """
+    try:
+        await deliver_reminders(user_telegram_id, contents)
+        delivered, failed, error = list(contents), [], None
+    except Exception as e:
+        logger.error(f"Ошибка при отправке напоминания напрямую для пользователя {user_telegram_id}: {e}", exc_info=True)
+        delivered, failed, error = _split_delivery_error(contents, e)
+
+    db = await _get_reminders_db()
+    # План отмечается обработанным в любом случае: недоставленное напоминание дальше
+    # живет в reminder_dead_letters, а не в окне планировщика
+    await db.executemany(
+        "UPDATE plans SET is_reminder_sent = 1 WHERE id = ? AND user_id = ?",
+        [(plan_id, user_telegram_id) for plan_id in contents],
+    )
+    reminder_stats["sent"] += len(delivered)
+    if failed:
+        reminder_stats["dead_lettered"] += len(failed)
+        await db.executemany(
+            "INSERT INTO reminder_dead_letters (plan_id, user_id, last_error, is_permanent) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(plan_id) DO UPDATE SET last_error = excluded.last_error, is_permanent = excluded.is_permanent, "
+            "redelivery_attempts = 0, failed_at = CURRENT_TIMESTAMP",
+            [(plan_id, user_telegram_id, str(error), int(_is_permanent_error(error))) for plan_id in failed],
+        )
+        logger.warning(f"Напоминания для планов ID {', '.join(map(str, failed))} не доставлены и отложены для повторной отправки.")
+    await db.commit()
+
+
+# Напоминания, ожидающие отправки одним сообщением: user_id -> {"contents": {plan_id: ...}, "done": Future}
+_reminder_batches = {}
+
+# ID заданий напоминаний, которые уже сработали (планировщик их удалил), но еще не доставлены:
+# план в это время остается с is_reminder_sent = 0, и refresh_reminder_window не должен
+# создать для него задание заново — иначе напоминание придет дважды
+_reminders_in_flight = set()
+
+
+async def send_reminder_job(user_telegram_id: int, plan_db_id: int, *legacy_args):
+    """
+    Задание напоминания хранит только (user_id, plan_id); тема, текст и вложения читаются
+    из БД в момент срабатывания, поэтому правки плана попадают в напоминание.
+    legacy_args — тема, текст и вложение из заданий, сохраненных прежними версиями; не используются.
+    Напоминания одного пользователя, сработавшие в пределах REMINDER_COALESCE_SECONDS,
+    отправляются одним сообщением: первое задание ждет остальные и отправляет всю пачку.
+    Если отправить не удалось и после повторов, напоминания попадают в reminder_dead_letters.
+    Пока напоминание ждет пачку или повторы отправки, оно числится в _reminders_in_flight.
+    """
+    job_id = reminder_job_id(user_telegram_id, plan_db_id)
+    _reminders_in_flight.add(job_id)
+    try:
+        await _send_reminder(user_telegram_id, plan_db_id)
+    finally:
+        _reminders_in_flight.discard(job_id)
+
+
+async def _send_reminder(user_telegram_id: int, plan_db_id: int):
     logger.info(
         f"Сработало напоминание для пользователя {user_telegram_id} по плану ID "
         f"{plan_db_id}"
     )
-    clean_plan_text = plan_text_reminder
+    content = await get_reminder_content(plan_db_id)
+    if content is None or content["user_id"] != user_telegram_id:
+        logger.warning(f"План ID {plan_db_id} не найден (возможно, удален). Напоминание не отправлено.")
+        return
 
-    # ИЗМЕНЕНИЕ: Добавлена тема в текст напоминания
-    reminder_message_text = (
-        f"🔔 {hbold('Напоминание о вашем плане:')}\n"
-        f"Тема: {hbold(plan_topic_reminder)}\n"
-        f"Описание: «{clean_plan_text}»"
-    )
+    batch = _reminder_batches.get(user_telegram_id)
+    if batch is not None:
+        batch["contents"][plan_db_id] = content
+        reminder_stats["coalesced"] += 1
+        await asyncio.shield(batch["done"])
+        return
 
+    batch = {"contents": {plan_db_id: content}, "done": asyncio.get_running_loop().create_future()}
+    _reminder_batches[user_telegram_id] = batch
     try:
-        if _bot_instance:
-            await _bot_instance.send_message(
-                chat_id=user_telegram_id,
-                text=reminder_message_text,
-                parse_mode="HTML",
-                reply_markup=get_plans_keyboard()
+        await asyncio.sleep(REMINDER_COALESCE_SECONDS)
+        del _reminder_batches[user_telegram_id]
+        await _deliver_and_record(user_telegram_id, batch["contents"])
+    finally:
+        if _reminder_batches.get(user_telegram_id) is batch:
+            del _reminder_batches[user_telegram_id]
+        batch["done"].set_result(None)
+
+
+def _is_permanent_error(error: Exception) -> bool:
+    # Бот заблокирован пользователем или чат не существует — повторять бессмысленно
+    return isinstance(error, (TelegramForbiddenError, TelegramBadRequest))
+
+
+async def redeliver_failed_reminders():
+    """
+    Периодически повторяет отправку напоминаний из reminder_dead_letters (по одному сообщению
+    на пользователя) и series_reminder_dead_letters (по одному на серию).
+    Удачно доставленные удаляются из таблицы; после REMINDER_REDELIVERY_MAX_SWEEPS
+    неудач и при постоянных ошибках (бот заблокирован) напоминание остается в таблице,
+    но больше не отправляется.
+    """
+    db = await _get_reminders_db()
+    cursor = await db.execute(
+        "SELECT plan_id, user_id FROM reminder_dead_letters "
+        "WHERE is_permanent = 0 AND redelivery_attempts < ? ORDER BY failed_at LIMIT ?",
+        (REMINDER_REDELIVERY_MAX_SWEEPS, REMINDER_REDELIVERY_BATCH_SIZE),
+    )
+    dead_letters = await cursor.fetchall()
+    by_user = {}
+    for plan_id, user_id in dead_letters:
+        content = await get_reminder_content(plan_id)
+        if content is None or content["user_id"] != user_id:
+            await db.execute("DELETE FROM reminder_dead_letters WHERE plan_id = ?", (plan_id,))
+            continue
+        by_user.setdefault(user_id, {})[plan_id] = content
+
+    for user_id, contents in by_user.items():
+        try:
+            await deliver_reminders(user_id, contents)
+            delivered, failed = list(contents), []
+        except Exception as e:
+            logger.warning(f"Повторная отправка напоминаний пользователю {user_id} не удалась: {e}")
+            delivered, failed, error = _split_delivery_error(contents, e)
+            await db.executemany(
+                "UPDATE reminder_dead_letters SET redelivery_attempts = redelivery_attempts + 1, "
+                "last_error = ?, is_permanent = ?, failed_at = CURRENT_TIMESTAMP WHERE plan_id = ?",
+                [(str(error), int(_is_permanent_error(error)), plan_id) for plan_id in failed],
             )
-            logger.info(f"Текстовое напоминание успешно отправлено пользователю {user_telegram_id} для плана ID {plan_db_id}.")
-
-            if telegram_file_id and file_type:
-                try:
-                    if file_type == 'photo':
-                        await _bot_instance.send_photo(chat_id=user_telegram_id, photo=telegram_file_id, caption=f"Вложение к плану ID {plan_db_id}")
-                    elif file_type == 'voice':
-                        await _bot_instance.send_voice(chat_id=user_telegram_id, voice=telegram_file_id, caption=f"Вложение к плану ID {plan_db_id}")
-                    logger.info(f"Вложение типа {file_type} для плана ID {plan_db_id} успешно отправлено.")
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке вложения {telegram_file_id} типа {file_type} для плана {plan_db_id}: {e}", exc_info=True)
-            
-        else:
-            logger.error("Ошибка: _bot_instance не установлен в send_reminder_job. Напоминание не отправлено.")
-    except Exception as e:
-        logger.error(f"Ошибка при отправке напоминания напрямую для пользователя {user_telegram_id}: {e}", exc_info=True)
+        reminder_stats["redelivered"] += len(delivered)
+        await db.executemany("DELETE FROM reminder_dead_letters WHERE plan_id = ?", [(plan_id,) for plan_id in delivered])
+
+    cursor = await db.execute(
+        "SELECT series_id, user_id FROM series_reminder_dead_letters "
+        "WHERE is_permanent = 0 AND redelivery_attempts < ? ORDER BY failed_at LIMIT ?",
+        (REMINDER_REDELIVERY_MAX_SWEEPS, REMINDER_REDELIVERY_BATCH_SIZE),
+    )
+    series_dead_letters = await cursor.fetchall()
+    for series_id, user_id in series_dead_letters:
+        series = await get_plan_series_by_id(user_id, series_id)
+        if series is not None:
+            try:
+                await deliver_reminders(user_id, _series_reminder_contents(series))
+            except Exception as e:
+                logger.warning(f"Повторная отправка напоминания серии S{series_id} пользователю {user_id} не удалась: {e}")
+                error = e.error if isinstance(e, ReminderDeliveryError) else e
+                await db.execute(
+                    "UPDATE series_reminder_dead_letters SET redelivery_attempts = redelivery_attempts + 1, "
+                    "last_error = ?, is_permanent = ?, failed_at = CURRENT_TIMESTAMP WHERE series_id = ?",
+                    (str(error), int(_is_permanent_error(error)), series_id),
+                )
+                continue
+            reminder_stats["redelivered"] += 1
+        await db.execute("DELETE FROM series_reminder_dead_letters WHERE series_id = ?", (series_id,))
+    await db.commit()
+    if dead_letters or series_dead_letters:
+        logger.info(f"Повторная отправка напоминаний: обработано {len(dead_letters) + len(series_dead_letters)}.")
+
+
+async def get_dead_letter_count() -> int:
+    db = await _get_reminders_db()
+    cursor = await db.execute("SELECT (SELECT COUNT(*) FROM reminder_dead_letters) + (SELECT COUNT(*) FROM series_reminder_dead_letters)")
+    return (await cursor.fetchone())[0]
+
 
+# Метрики автоархивации (для /stats): последний запуск
+archive_stats = {"archived": 0, "batches": 0, "max_lock_seconds": 0.0, "duration_seconds": 0.0}
+
+
+async def auto_archive_old_plans() -> dict:
+    """
+    Архивирует планы старше ARCHIVE_AFTER_DAYS дней. Таблица проходится диапазонами id
+    шириной ARCHIVE_BATCH_SIZE: каждая пачка — отдельная короткая транзакция, между пачками
+    задача уступает цикл событий, поэтому блокировка записи не задерживает обработчики.
+    Позиция сохраняется в maintenance_progress вместе с датой отсечки: прерванный запуск
+    продолжается с того же места, а в новый день проход начинается заново.
+    Возвращает метрики запуска: сколько планов заархивировано, сколько было пачек
+    и самую долгую блокировку записи.
+    """
+    logger.info("Запуск автоархивации старых планов...")
+    started = time.perf_counter()
+    cutoff = (datetime.datetime.now(user_timezone) - datetime.timedelta(days=ARCHIVE_AFTER_DAYS)).strftime("%Y-%m-%d")
+    stats = {"archived": 0, "batches": 0, "max_lock_seconds": 0.0}
     async with aiosqlite.connect(DB_NAME) as db:
+        cursor = await db.execute("SELECT last_id, cutoff FROM maintenance_progress WHERE task = 'archive_plans'")
+        progress = await cursor.fetchone()
+        last_id = progress[0] if progress and progress[1] == cutoff else 0
+        cursor = await db.execute("SELECT COALESCE(MAX(id), 0) FROM plans")
+        max_id = (await cursor.fetchone())[0]
+
+        while last_id < max_id:
+            upper_id = min(last_id + ARCHIVE_BATCH_SIZE, max_id)
+            lock_started = time.perf_counter()
+            cursor = await db.execute(
+                "UPDATE plans SET is_archived = 1 WHERE id > ? AND id <= ? AND plan_date < ? AND is_archived = 0",
+                (last_id, upper_id, cutoff),
+            )
+            stats["archived"] += cursor.rowcount
+            await db.execute(
+                "INSERT INTO maintenance_progress (task, last_id, cutoff) VALUES ('archive_plans', ?, ?) "
+                "ON CONFLICT(task) DO UPDATE SET last_id = excluded.last_id, cutoff = excluded.cutoff, "
+                "updated_at = CURRENT_TIMESTAMP",
+                (upper_id, cutoff),
+            )
+            await db.commit()
+            stats["max_lock_seconds"] = max(stats["max_lock_seconds"], time.perf_counter() - lock_started)
+            stats["batches"] += 1
+            last_id = upper_id
+            await asyncio.sleep(ARCHIVE_PAUSE_SECONDS)
+
+    stats["duration_seconds"] = time.perf_counter() - started
+    archive_stats.update(stats)
+    logger.info(
+        f"Автоархивация завершена: заархивировано {stats['archived']} планов за {stats['batches']} пачек, "
+        f"самая долгая блокировка {stats['max_lock_seconds'] * 1000:.1f} мс."
+    )
+    return stats
+
+
+def reminder_job_id(user_id: int, plan_id: int) -> str:
+    return f"reminder_{user_id}_{plan_id}"
+
+
+def reminder_horizon() -> datetime.datetime:
+    return datetime.datetime.now(user_timezone) + datetime.timedelta(hours=REMINDER_HORIZON_HOURS)
+
+
+def _schedule_window_job(job_id: str, func, args: list, run_date: datetime.datetime) -> bool:
+    if run_date > reminder_horizon():
+        # Время напоминания могли перенести дальше окна — старое задание больше не нужно
+        try:
+            scheduler.remove_job(job_id, jobstore=REMINDERS_JOBSTORE)
+        except JobLookupError:
+            pass
+        return False
+    scheduler.add_job(
+        func,
+        trigger=DateTrigger(run_date=run_date),
+        args=args,
+        id=job_id,
+        jobstore=REMINDERS_JOBSTORE,
+        misfire_grace_time=REMINDER_MISFIRE_GRACE_SECONDS,
+        replace_existing=True,
+    )
+    return True
+
+
+def schedule_reminder(user_id: int, plan_id: int, run_date: datetime.datetime) -> bool:
+    """
+    Создает (или заменяет) задание напоминания, если оно попадает в окно REMINDER_HORIZON_HOURS.
+    Более дальние напоминания остаются только в таблице plans: их добавит refresh_reminder_window,
+    когда до них дойдет окно. Возвращает True, если задание создано сейчас.
+    """
+    return _schedule_window_job(reminder_job_id(user_id, plan_id), send_reminder_job, [user_id, plan_id], run_date)
+
+
+def unschedule_reminder(user_id: int, plan_id: int) -> bool:
+    try:
+        scheduler.remove_job(reminder_job_id(user_id, plan_id), jobstore=REMINDERS_JOBSTORE)
+    except JobLookupError:
+        return False
+    return True
+
+
+def series_reminder_job_id(user_id: int, series_id: int) -> str:
+    return f"series_reminder_{user_id}_{series_id}"
+
+
+def schedule_series_reminder(user_id: int, series_id: int, run_date: datetime.datetime) -> bool:
+    """То же, что schedule_reminder, для серии: у серии не больше одного задания — на ближайшее повторение."""
+    return _schedule_window_job(series_reminder_job_id(user_id, series_id), send_series_reminder_job, [user_id, series_id], run_date)
+
+
+def unschedule_series_reminder(user_id: int, series_id: int):
+    try:
+        scheduler.remove_job(series_reminder_job_id(user_id, series_id), jobstore=REMINDERS_JOBSTORE)
+    except JobLookupError:
+        pass
+
+
+def next_series_reminder(series, after: datetime.datetime) -> str | None:
+    """
+    Время следующего напоминания серии (строка 'YYYY-MM-DD HH:MM:SS', местное время) строго позже after
+    (наивное местное время) или None, если напоминание не задано или серия закончилась.
+    """
+    if not series["reminder_time"]:
+        return None
+    occurrence = next_occurrence_at(
+        parse_rrule(series["rrule"]),
+        datetime.date.fromisoformat(series["dtstart"]),
+        datetime.time.fromisoformat(series["reminder_time"]),
+        after,
+    )
+    return occurrence.strftime("%Y-%m-%d %H:%M:%S") if occurrence else None
+
+
+def _series_reminder_contents(series) -> dict:
+    """Содержимое напоминания серии в формате deliver_reminders."""
+    return {f"S{series['id']}": {"topic": series["plan_topic"], "text": series["plan_text"], "attachments": []}}
+
+
+async def send_series_reminder_job(user_telegram_id: int, series_id: int):
+    """
+    Напоминание о повторении серии. После отправки вычисляется следующее повторение
+    и для него ставится новое задание (или его добавит refresh_reminder_window, если оно за окном).
+    Вложений у серий нет, поэтому напоминание уходит сразу, без объединения с планами.
+    Недоставленное напоминание попадает в series_reminder_dead_letters и повторяется
+    вместе с напоминаниями планов в redeliver_failed_reminders.
+    """
+    job_id = series_reminder_job_id(user_telegram_id, series_id)
+    _reminders_in_flight.add(job_id)
+    try:
+        await _send_series_reminder(user_telegram_id, series_id)
+    finally:
+        _reminders_in_flight.discard(job_id)
+
+
+async def _send_series_reminder(user_telegram_id: int, series_id: int):
+    series = await get_plan_series_by_id(user_telegram_id, series_id)
+    if series is None:
+        return # Серию удалили, а задание еще оставалось
+    try:
+        await deliver_reminders(user_telegram_id, _series_reminder_contents(series))
+        reminder_stats["sent"] += 1
+    except Exception as e:
+        logger.error(f"Ошибка при отправке напоминания серии S{series_id} пользователю {user_telegram_id}: {e}", exc_info=True)
+        error = e.error if isinstance(e, ReminderDeliveryError) else e
+        reminder_stats["dead_lettered"] += 1
+        db = await _get_reminders_db()
         await db.execute(
-            "UPDATE plans SET is_reminder_sent = 1 WHERE id = ? AND user_id = ?",
-            (plan_db_id, user_telegram_id),
+            "INSERT INTO series_reminder_dead_letters (series_id, user_id, last_error, is_permanent) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(series_id) DO UPDATE SET last_error = excluded.last_error, is_permanent = excluded.is_permanent, "
+            "redelivery_attempts = 0, failed_at = CURRENT_TIMESTAMP",
+            (series_id, user_telegram_id, str(error), int(_is_permanent_error(error))),
         )
         await db.commit()
-    logger.info(f"Напоминание для плана ID {plan_db_id} отмечено как отправленное.")
 
+    now = datetime.datetime.now(user_timezone).replace(tzinfo=None)
+    fired_at = datetime.datetime.strptime(series["next_reminder_datetime"], "%Y-%m-%d %H:%M:%S") if series["next_reminder_datetime"] else now
+    next_reminder = next_series_reminder(series, max(now, fired_at))
+    await set_series_next_reminder(user_telegram_id, series_id, next_reminder)
+    if next_reminder:
+        schedule_series_reminder(
+            user_telegram_id, series_id, user_timezone.localize(datetime.datetime.strptime(next_reminder, "%Y-%m-%d %H:%M:%S"))
+        )
 
-async def auto_archive_old_plans():
-    logger.info("Запуск автоархивации старых планов...")
+
+async def refresh_reminder_window():
+    """
+    Приводит задания напоминаний в соответствие с таблицей plans в пределах окна
+    REMINDER_HORIZON_HOURS. Вызывается при старте (после scheduler.start()) и периодически.
+    Создаются только недостающие задания и удаляются лишние (план удален, напоминание
+    отправлено или перенесено за окно). Напоминания, опоздавшие больше чем на
+    REMINDER_MISFIRE_GRACE_SECONDS, помечаются отправленными одним UPDATE.
+    Все выборки идут по индексу idx_plans_pending_reminders и ограничены окном, поэтому
+    число заданий и расход памяти не зависят от того, как далеко вперед заданы напоминания.
+    Серии (plan_series) дают не больше одного задания — на ближайшее повторение.
+    """
+    now = datetime.datetime.now(user_timezone)
+    missed_before = (now - datetime.timedelta(seconds=REMINDER_MISFIRE_GRACE_SECONDS)).strftime("%Y-%m-%d %H:%M:%S")
+    horizon = reminder_horizon().strftime("%Y-%m-%d %H:%M:%S")
     async with aiosqlite.connect(DB_NAME) as db:
-        seven_days_ago = (
-            datetime.datetime.now(user_timezone) - datetime.timedelta(days=7)
-        ).strftime("%Y-%m-%d")
-        await db.execute(
-            "UPDATE plans SET is_archived = 1 WHERE plan_date < ? AND is_archived = 0",
-            (seven_days_ago,),
+        cursor = await db.execute(
+            "UPDATE plans SET is_reminder_sent = 1 "
+            "WHERE is_reminder_sent = 0 AND reminder_datetime IS NOT NULL AND reminder_datetime < ?",
+            (missed_before,),
         )
+        missed_count = cursor.rowcount
         await db.commit()
-    logger.info("Автоархивация завершена.")
-
-
-async def load_reminders_on_startup():
-    logger.info("Загрузка активных напоминаний из БД в планировщик...")
-    async with aiosqlite.connect(DB_NAME) as db_load:
-        # ИЗМЕНЕНИЕ: Добавлены plan_topic, telegram_file_id, file_type в SELECT
-        cursor = await db_load.execute(
-            "SELECT p.id, p.user_id, p.plan_topic, p.plan_text, p.reminder_datetime, "
-            "uf.telegram_file_id, uf.file_type FROM plans p "
-            "LEFT JOIN user_files uf ON p.id = uf.plan_id "
-            "WHERE p.reminder_datetime IS NOT NULL AND p.is_reminder_sent = 0"
+        cursor = await db.execute(
+            "SELECT id, user_id, reminder_datetime FROM plans "
+            "WHERE is_reminder_sent = 0 AND reminder_datetime IS NOT NULL AND reminder_datetime <= ?",
+            (horizon,),
         )
-        active_reminders = await cursor.fetchall()
+        in_window = {reminder_job_id(user_id, plan_id): (schedule_reminder, user_id, plan_id, reminder_dt_str)
+                     for plan_id, user_id, reminder_dt_str in await cursor.fetchall()}
 
-    now_aware = datetime.datetime.now(user_timezone)
-    count_loaded = 0
-    for plan_id_db, user_id_db, plan_topic_db, plan_text_db, reminder_dt_str_db, tg_file_id, f_type in active_reminders:
+        # Серии: пропущенное повторение сдвигается на следующее после текущего момента
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute(
+            "SELECT id, user_id, rrule, dtstart, reminder_time FROM plan_series "
+            "WHERE next_reminder_datetime IS NOT NULL AND next_reminder_datetime < ?",
+            (missed_before,),
+        )
+        now_naive = now.replace(tzinfo=None)
+        missed_series = [(next_series_reminder(series, now_naive), series["id"]) for series in await cursor.fetchall()]
+        if missed_series:
+            await db.executemany("UPDATE plan_series SET next_reminder_datetime = ? WHERE id = ?", missed_series)
+            await db.commit()
+            missed_count += len(missed_series)
+        cursor = await db.execute(
+            "SELECT id, user_id, next_reminder_datetime FROM plan_series "
+            "WHERE next_reminder_datetime IS NOT NULL AND next_reminder_datetime <= ?",
+            (horizon,),
+        )
+        in_window.update({series_reminder_job_id(user_id, series_id): (schedule_series_reminder, user_id, series_id, reminder_dt_str)
+                          for series_id, user_id, reminder_dt_str in await cursor.fetchall()})
+
+    stored_job_ids = reminders_jobstore.get_job_ids()
+    # Сработавшие, но еще не доставленные напоминания не пересоздаются
+    missing_reminders = [reminder for job_id, reminder in in_window.items()
+                         if job_id not in stored_job_ids and job_id not in _reminders_in_flight]
+    if missed_count:
+        logger.warning(f"Пропущенных напоминаний: {missed_count}. Помечены как отправленные.")
+
+    for schedule, user_id_db, plan_id_db, reminder_dt_str_db in missing_reminders:
         try:
-            reminder_dt_obj_naive = datetime.datetime.strptime(
-                reminder_dt_str_db, "%Y-%m-%d %H:%M:%S"
+            reminder_dt_obj_aware = user_timezone.localize(
+                datetime.datetime.strptime(reminder_dt_str_db, "%Y-%m-%d %H:%M:%S")
             )
-            reminder_dt_obj_aware = user_timezone.localize(reminder_dt_obj_naive)
-            if reminder_dt_obj_aware > now_aware:
-                job_id = f"reminder_{user_id_db}_{plan_id_db}"
-                if not scheduler.get_job(job_id):
-                    scheduler.add_job(
-                        send_reminder_job,
-                        trigger=DateTrigger(run_date=reminder_dt_obj_aware),
-                        args=[user_id_db, plan_id_db, plan_topic_db, plan_text_db, tg_file_id, f_type],
-                        id=job_id,
-                        replace_existing=True,
-                    )
-                    count_loaded += 1
-                    logger.info(
-                        f"Загружено напоминание из БД: ID {job_id} на "
-                        f"{reminder_dt_obj_aware}"
-                    )
-                else:
-                    logger.info(f"Напоминание ID {job_id} уже в планировщике.")
-            else:
-                async with aiosqlite.connect(DB_NAME) as db_update_expired:
-                    logger.warning(
-                        "Просроченное неотправленное напоминание для плана ID "
-                        f"{plan_id_db} ({reminder_dt_str_db}). Помечаем как "
-                        "отправленное."
-                    )
-                    await db_update_expired.execute(
-                        "UPDATE plans SET is_reminder_sent = 1 WHERE id = ?",
-                        (plan_id_db,),
-                    )
-                    await db_update_expired.commit()
+            schedule(user_id_db, plan_id_db, reminder_dt_obj_aware)
         except Exception as e_load_rem:
             logger.error(
-                f"Ошибка при загрузке напоминания для плана ID {plan_id_db}: "
+                f"Ошибка при загрузке напоминания ({schedule.__name__}) для ID {plan_id_db}: "
                 f"{e_load_rem}",
                 exc_info=True,
             )
-    logger.info(f"Загружено {count_loaded} активных напоминаний в планировщик.")
\ No newline at end of file
+
+    stale_job_ids = [job_id for job_id in stored_job_ids if job_id.startswith(("reminder_", "series_reminder_")) and job_id not in in_window]
+    for job_id in stale_job_ids:
+        try:
+            scheduler.remove_job(job_id, jobstore=REMINDERS_JOBSTORE)
+        except JobLookupError:
+            pass # Просроченное задание планировщик уже удалил сам
+    logger.info(
+        f"Окно напоминаний до {horizon}: {len(in_window)} заданий; добавлено: {len(missing_reminders)}, "
+        f"удалено: {len(stale_job_ids)}."
+    )
@@ -0,0 +1,114 @@
+# statement_import.py
+"""
+Разбор CSV-выписок для массового импорта транзакций.
+Функции синхронные и вызываются в отдельном потоке (asyncio.to_thread).
+"""
+import csv
+import datetime
+import hashlib
+import io
+
+from amounts import parse_amount
+
+# Возможные заголовки колонок (в нижнем регистре) -> поле транзакции
+HEADER_ALIASES = {
+    "date": "date", "дата": "date", "дата операции": "date", "transaction_date": "date",
+    "amount": "amount", "сумма": "amount", "сумма операции": "amount",
+    "type": "type", "тип": "type",
+    "category": "category", "категория": "category",
+    "description": "description", "описание": "description", "назначение платежа": "description", "комментарий": "description",
+}
+TYPE_ALIASES = {
+    "income": "income", "доход": "income", "приход": "income", "поступление": "income",
+    "expense": "expense", "расход": "expense", "списание": "expense",
+}
+DATE_FORMATS = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M", "%d.%m.%Y", "%d/%m/%Y"]
+
+
+class StatementFormatError(Exception):
+    """Файл не похож на выписку: нет обязательных колонок даты и суммы."""
+
+
+def _decode(data: bytes) -> str:
+    for encoding in ("utf-8-sig", "cp1251"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace")
+
+
+def _parse_date(value: str) -> str:
+    value = value.strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            continue
+    raise ValueError(f"Неизвестный формат даты: {value}")
+
+
+def import_hash(book_id: int, transaction_date: str, t_type: str, amount: float, description: str, occurrence: int) -> str:
+    """
+    Естественный ключ импортированной строки. occurrence — порядковый номер одинаковой
+    строки внутри файла: две одинаковые покупки за день сохраняются, а повторный
+    импорт того же файла ничего не добавляет.
+    """
+    key = f"{book_id}|{transaction_date}|{t_type}|{amount:.2f}|{(description or '').strip()}|{occurrence}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def parse_statement(data: bytes, book_id: int):
+    """
+    Разбирает CSV-выписку. Колонки ищутся по заголовкам (см. HEADER_ALIASES), разделитель
+    определяется автоматически. Если колонки типа нет, знак суммы задает доход или расход.
+    Пустые строки пропускаются; строки, которые не удалось разобрать (итоги, неоднозначные суммы
+    вроде «1,000»), считаются пропущенными.
+    Возвращает (строки для вставки, число пропущенных строк); строка —
+    (type, amount, description, category, transaction_date, import_hash).
+    """
+    text = _decode(data)
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(io.StringIO(text), dialect)
+
+    header = next(reader, None) or []
+    columns = {}
+    for index, name in enumerate(header):
+        field = HEADER_ALIASES.get(name.strip().lower())
+        if field and field not in columns:
+            columns[field] = index
+    if "date" not in columns or "amount" not in columns:
+        raise StatementFormatError()
+
+    def cell(row, field):
+        index = columns.get(field)
+        return row[index].strip() if index is not None and index < len(row) else ""
+
+    rows, skipped, occurrences = [], 0, {}
+    for row in reader:
+        if not any(value.strip() for value in row):
+            continue
+        try:
+            transaction_date = _parse_date(cell(row, "date"))
+            amount = parse_amount(cell(row, "amount"))
+            t_type = TYPE_ALIASES.get(cell(row, "type").lower())
+            if t_type is None:
+                if "type" in columns and cell(row, "type"):
+                    raise ValueError(f"Неизвестный тип: {cell(row, 'type')}")
+                t_type = "expense" if amount < 0 else "income"
+            amount = abs(amount)
+        except ValueError:
+            skipped += 1
+            continue
+
+        description = cell(row, "description") or None
+        category = cell(row, "category") or None
+        natural_key = (transaction_date, t_type, round(amount, 2), description)
+        occurrence = occurrences.get(natural_key, 0)
+        occurrences[natural_key] = occurrence + 1
+        rows.append((t_type, amount, description, category, transaction_date,
+                     import_hash(book_id, transaction_date, t_type, amount, description, occurrence)))
+    return rows, skipped
@@ -8,9 +8,9 @@ from aiogram import Bot, types
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.markdown import hbold, hstrikethrough
 
-from config import DB_NAME, logger
-from file_processing import chunk_text, extract_text_from_docx, extract_text_from_pdf
-from db import get_attachments_for_plan
+from config import DB_NAME, RECHUNK_BATCH_SIZE, RECHUNK_PAUSE_SECONDS, RECHUNK_RETRY_BASE_MINUTES, RECHUNK_RETRY_MAX_MINUTES, logger
+from file_processing import CHUNKER_VERSION, chunk_text, extract_text_from_docx, extract_text_from_pdf
+from db import get_attachments_for_plan, get_stale_chunked_files, save_file_chunks, record_rechunk_failure
 from file_handlers import BatchCategorizeStates
 from keyboards import get_batch_categorize_keyboard
 
@@ -43,7 +43,8 @@ async def display_multiple_plans(message: types.Message, plans_data: list, title
             text_display = hstrikethrough(plan['plan_topic']) if plan['is_completed'] else hbold(plan['plan_topic'])
             reminder_info = f" (напом.: {datetime.datetime.fromisoformat(plan['reminder_datetime']).strftime('%H:%M')})" if plan.get('reminder_datetime') else ""
             full_response_text.append(f"  {status_emoji} {text_display}: {plan['plan_text']} (ID: {hbold(str(plan['id']))}){reminder_info}")
-            attachments = await get_attachments_for_plan(plan['id'])
+            # У повторений серий (ID вида S3) вложений нет
+            attachments = None if plan.get('series_id') else await get_attachments_for_plan(plan['id'])
             if attachments:
                 full_response_text.append(f"    [📎 Вложения: {', '.join([a['file_type'] for a in attachments])}]")
 
@@ -99,7 +100,8 @@ async def handle_document_upload(message: types.Message, state: FSMContext):
             reply_markup=get_batch_categorize_keyboard()
         )
 
-async def process_document_background(bot: Bot, user_id: int, db_file_id: int, telegram_file_id: str, original_name: str, file_extension: str):
+async def _download_and_extract_text(bot: Bot, telegram_file_id: str, file_extension: str) -> str:
+    """Скачивает документ из Telegram во временный файл и извлекает из него текст."""
     downloaded_file_path = None
     try:
         file_info = await bot.get_file(telegram_file_id)
@@ -107,25 +109,62 @@ async def process_document_background(bot: Bot, user_id: int, db_file_id: int, t
             await bot.download_file(file_info.file_path, destination=temp_file)
             downloaded_file_path = temp_file.name
         
-        text = ""
         if file_extension == "pdf":
-            text = await asyncio.to_thread(extract_text_from_pdf, downloaded_file_path)
-        elif file_extension == "docx":
-            text = await asyncio.to_thread(extract_text_from_docx, downloaded_file_path)
-        
+            return await asyncio.to_thread(extract_text_from_pdf, downloaded_file_path)
+        if file_extension == "docx":
+            return await asyncio.to_thread(extract_text_from_docx, downloaded_file_path)
+        return ""
+    finally:
+        if downloaded_file_path and os.path.exists(downloaded_file_path):
+            os.remove(downloaded_file_path)
+
+async def process_document_background(bot: Bot, user_id: int, db_file_id: int, telegram_file_id: str, original_name: str, file_extension: str):
+    try:
+        text = await _download_and_extract_text(bot, telegram_file_id, file_extension)
         if not text:
             raise ValueError("Текст не извлечен.")
         
-        chunks = chunk_text(text)
-        async with aiosqlite.connect(DB_NAME) as db:
-            for i, chunk in enumerate(chunks):
-                await db.execute("INSERT INTO file_chunks (user_file_id, chunk_text, chunk_order) VALUES (?, ?, ?)", (db_file_id, chunk, i))
-            await db.execute("UPDATE user_files SET is_processed_for_chunks = 1 WHERE id = ?", (db_file_id,))
-            await db.commit()
+        chunks = await asyncio.to_thread(chunk_text, text)
+        if not await save_file_chunks(db_file_id, chunks, text, CHUNKER_VERSION):
+            logger.info(f"Файл {db_file_id} удален до завершения анализа, результат не сохранен.")
+            return
         await bot.send_message(user_id, f"✅ Анализ файла «{original_name}» завершен. Найдено {len(chunks)} фрагментов.")
     except Exception as e:
         logger.error(f"Ошибка фоновой обработки файла {db_file_id}: {e}", exc_info=True)
         await bot.send_message(user_id, f"❌ Ошибка при анализе файла «{original_name}».")
-    finally:
-        if downloaded_file_path and os.path.exists(downloaded_file_path):
-            os.remove(downloaded_file_path)
\ No newline at end of file
+
+async def rechunk_stale_documents(bot: Bot = None, batch_size: int = RECHUNK_BATCH_SIZE, pause_seconds: float = RECHUNK_PAUSE_SECONDS) -> int:
+    """
+    Фоновая задача: обновляет чанки документов, обработанных устаревшей версией чанкера.
+    За один запуск обрабатывает не более batch_size файлов и делает паузу между ними,
+    чтобы не отнимать ресурсы у обработчиков сообщений. Сохраненный исходный текст
+    используется повторно; загрузка из Telegram нужна только для файлов без кэша.
+    Неудачная попытка записывается в БД, и файл откладывается с растущей задержкой,
+    чтобы не блокировать очередь остальных документов (например, файл удален из Telegram).
+    """
+    # Без экземпляра бота обновить можно только файлы с сохраненным текстом
+    stale_files = await get_stale_chunked_files(CHUNKER_VERSION, batch_size, require_source_text=bot is None)
+    if not stale_files:
+        return 0
+
+    logger.info(f"Перечанковка: найдено {len(stale_files)} документов с устаревшей версией чанкера.")
+    updated_count = 0
+    for stale_file in stale_files:
+        try:
+            text = stale_file['source_text']
+            if not text:
+                text = await _download_and_extract_text(bot, stale_file['telegram_file_id'], stale_file['file_type'])
+                if not text:
+                    raise ValueError("Текст не извлечен.")
+            chunks = await asyncio.to_thread(chunk_text, text)
+            if await save_file_chunks(stale_file['id'], chunks, text, CHUNKER_VERSION):
+                updated_count += 1
+            else:
+                logger.info(f"Перечанковка: файл {stale_file['id']} удален во время обработки, пропускаем.")
+        except Exception as e:
+            retry_after = await record_rechunk_failure(stale_file['id'], RECHUNK_RETRY_BASE_MINUTES, RECHUNK_RETRY_MAX_MINUTES)
+            logger.error(f"Ошибка перечанковки файла {stale_file['id']} (следующая попытка после {retry_after:%Y-%m-%d %H:%M}): {e}", exc_info=True)
+        await asyncio.sleep(pause_seconds)
+
+    logger.info(f"Перечанковка: обновлено {updated_count} документов до версии {CHUNKER_VERSION}.")
+    return updated_count
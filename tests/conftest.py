@@ -35,6 +35,15 @@ async def db_conn(monkeypatch):
     yield TEST_DB_NAME
     os.remove(TEST_DB_NAME)
 
+@pytest.fixture(autouse=True)
+def isolated_report_cache(tmp_path, monkeypatch):
+    """Каждый тест получает собственные пустые кэши отчетов и чеков во временном каталоге."""
+    from disk_cache import DiskLRUCache
+    cache = DiskLRUCache(str(tmp_path / "report_cache"), 10 * 1024 * 1024)
+    monkeypatch.setattr("finance_handlers.report_cache", cache)
+    monkeypatch.setattr("finance_handlers.receipt_cache", DiskLRUCache(str(tmp_path / "receipt_cache"), 10 * 1024 * 1024))
+    return cache
+
 @pytest.fixture
 def mock_bot():
     """Фикстура для создания мока бота."""
@@ -0,0 +1,17 @@
+# tests/test_amounts.py
+import pytest
+
+from amounts import parse_amount
+
+
+def test_parse_amount_handles_thousands_and_rejects_ambiguous_values():
+    """Тест: разделители тысяч распознаются только при правильной группировке, неоднозначные суммы отклоняются."""
+    assert parse_amount("1 000,50") == 1000.5
+    assert parse_amount("1,234.56") == parse_amount("1.234,56") == 1234.56
+    assert parse_amount("1,234,567") == 1234567.0
+    assert parse_amount("-12,50") == -12.5
+    assert parse_amount("0,920") == 0.92
+    assert parse_amount("12650") == 12650.0
+    for value in ("1,000", "12,850", "1.500", "1,234,56", "1,2.3", "", "abc", "-"):
+        with pytest.raises(ValueError):
+            parse_amount(value)
@@ -54,4 +54,98 @@ async def test_add_and_get_book(db_conn):
     # 4. Получаем список всех книг пользователя
     all_books = await get_user_books(user_id=user_id)
     assert len(all_books) == 1
-    assert all_books[0]['name'] == book_name
\ No newline at end of file
+    assert all_books[0]['name'] == book_name
+
+async def test_transaction_rollups_follow_insert_update_delete(db_conn):
+    """
+    Тест: таблица агрегатов обновляется триггерами при вставке, изменении и удалении транзакций.
+    """
+    from db import (
+        add_transaction, update_transaction, delete_transaction,
+        get_book_monthly_summary, get_book_category_summary
+    )
+    user_id = 12345
+    book_id = await add_book(user_id=user_id, name="Агрегаты", currency="USD")
+
+    await add_transaction(user_id, book_id, 'income', 1000.0, "Зарплата", "Работа", "2024-01-05 10:00:00")
+    first_id = await add_transaction(user_id, book_id, 'expense', 100.0, "Обед", "Еда", "2024-01-10 12:00:00")
+    await add_transaction(user_id, book_id, 'expense', 50.0, "Ужин", "Еда", "2024-02-01 19:00:00")
+
+    monthly = [tuple(row) for row in await get_book_monthly_summary(user_id, book_id)]
+    assert monthly == [("2024-02", 0.0, 50.0, 1), ("2024-01", 1000.0, 100.0, 2)]
+
+    # Перенос расхода в другой месяц и категорию
+    await update_transaction(user_id, first_id, 'transaction_date', "2024-02-03 12:00:00")
+    await update_transaction(user_id, first_id, 'category', "Кафе")
+    categories = [tuple(row) for row in await get_book_category_summary(user_id, book_id, month="2024-02")]
+    assert categories == [('expense', 'Кафе', 100.0, 1), ('expense', 'Еда', 50.0, 1)]
+
+    await delete_transaction(user_id, first_id)
+    monthly = [tuple(row) for row in await get_book_monthly_summary(user_id, book_id)]
+    assert monthly == [("2024-02", 0.0, 50.0, 1), ("2024-01", 1000.0, 0.0, 1)]
+
+    # Чужой пользователь не видит агрегаты книги
+    assert await get_book_monthly_summary(999, book_id) == []
+
+
+async def test_consolidated_balance_converts_in_sql(db_conn):
+    """
+    Тест: сводный баланс всех книг пересчитывается по таблице курсов одним запросом;
+    книги без курса возвращаются без пересчета.
+    """
+    from db import add_transaction, set_fx_rates, get_consolidated_balance
+    user_id = 12345
+    usd_book = await add_book(user_id=user_id, name="Доллары", currency="USD")
+    uzs_book = await add_book(user_id=user_id, name="Сумы", currency="UZS")
+    await add_book(user_id=user_id, name="Евро", currency="EUR")
+    await add_transaction(user_id, usd_book, 'income', 100.0, "Зарплата", None, "2024-01-05 10:00:00")
+    await add_transaction(user_id, usd_book, 'expense', 20.0, "Обед", None, "2024-01-06 10:00:00")
+    await add_transaction(user_id, uzs_book, 'income', 126500.0, "Подарок", None, "2024-01-07 10:00:00")
+
+    await set_fx_rates({"UZS": 12650.0})
+    rows = {row[1]: tuple(row[2:]) for row in await get_consolidated_balance(user_id, "UZS")}
+
+    assert rows["Доллары"] == ("USD", 100.0, 20.0, 80.0 * 12650.0)
+    assert rows["Сумы"] == ("UZS", 126500.0, 0.0, 126500.0)
+    assert rows["Евро"][3] is None
+
+
+async def test_active_plans_exclude_archive_and_archive_is_paginated(db_conn):
+    """Тест: обычный список планов не содержит архивных; архив листается страницами от новых к старым."""
+    from db import add_plan_to_db, get_all_user_plans, get_archived_plans_page
+    archived_ids = [await add_plan_to_db(1, f"2020-01-0{day}", f"Старый {day}", "Текст") for day in range(1, 6)]
+    active_id = await add_plan_to_db(1, "2099-01-01", "Новый", "Текст")
+    async with aiosqlite.connect(db_conn) as db:
+        await db.execute("UPDATE plans SET is_archived = 1 WHERE id != ?", (active_id,))
+        await db.commit()
+
+    assert [plan["id"] for plan in await get_all_user_plans(1)] == [active_id]
+
+    first_page, total = await get_archived_plans_page(1, 0, 2)
+    last_page, _ = await get_archived_plans_page(1, 2, 2)
+    assert total == 5
+    assert [plan["id"] for plan in first_page] == [archived_ids[4], archived_ids[3]]
+    assert [plan["id"] for plan in last_page] == [archived_ids[0]]
+
+
+async def test_transaction_stream_does_not_block_writers(db_conn):
+    """Тест: пока потоковое чтение книги не дочитано, другие соединения могут писать в БД; пачки идут без пропусков."""
+    from db import add_transaction, iter_transactions_by_book
+    book_id = await add_book(1, "Поток", "USD")
+    # Две транзакции с одинаковой датой проверяют, что ключ (дата, id) не теряет строки на границе пачек
+    for day in ("2024-01-03", "2024-01-02", "2024-01-02", "2024-01-01"):
+        await add_transaction(1, book_id, 'expense', 1.0, "Покупка", "Еда", f"{day} 10:00:00")
+
+    stream = iter_transactions_by_book(1, book_id, batch_size=2)
+    batches = [await stream.__anext__()]
+    async with aiosqlite.connect(db_conn, timeout=0.1) as writer:
+        await writer.execute(
+            "INSERT INTO transactions (user_id, book_id, type, amount, description, category, transaction_date) "
+            "VALUES (1, ?, 'income', 5.0, 'Параллельно', 'Работа', '2023-12-31 10:00:00')", (book_id,)
+        )
+        await writer.commit()
+    batches.extend([batch async for batch in stream])
+
+    rows = [row for batch in batches for row in batch]
+    assert [row[1][:10] for row in rows] == ["2024-01-03", "2024-01-02", "2024-01-02", "2024-01-01", "2023-12-31"]
+    assert len({row[0] for row in rows}) == 5
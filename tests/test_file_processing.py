@@ -0,0 +1,83 @@
+# tests/test_file_processing.py
+import pytest
+import aiosqlite
+
+from db import save_file_chunks, get_stale_chunked_files
+from file_processing import CHUNKER_VERSION
+from telegram_handlers import rechunk_stale_documents
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_rechunk_uses_cached_text(db_conn, file_in_db):
+    """
+    Тест: файл, обработанный старой версией чанкера, перечанковывается
+    из сохраненного текста без обращения к Telegram.
+    """
+    await save_file_chunks(file_in_db['id'], ["старый чанк"], "Новый текст документа.", CHUNKER_VERSION - 1)
+    assert len(await get_stale_chunked_files(CHUNKER_VERSION, 10)) == 1
+
+    updated = await rechunk_stale_documents(bot=None, batch_size=10, pause_seconds=0)
+    assert updated == 1
+    assert await get_stale_chunked_files(CHUNKER_VERSION, 10) == []
+
+    async with aiosqlite.connect(db_conn) as db:
+        cursor = await db.execute("SELECT chunk_text FROM file_chunks WHERE user_file_id = ?", (file_in_db['id'],))
+        chunks = [row[0] for row in await cursor.fetchall()]
+    assert chunks == ["Новый текст документа."]
+
+
+async def test_rechunk_skips_files_without_cache_when_no_bot(db_conn, file_in_db):
+    """
+    Тест: без кэша текста и без экземпляра бота файл пропускается,
+    а его версия не меняется.
+    """
+    async with aiosqlite.connect(db_conn) as db:
+        await db.execute("UPDATE user_files SET is_processed_for_chunks = 1 WHERE id = ?", (file_in_db['id'],))
+        await db.commit()
+
+    updated = await rechunk_stale_documents(bot=None, batch_size=10, pause_seconds=0)
+    assert updated == 0
+    assert len(await get_stale_chunked_files(CHUNKER_VERSION, 10)) == 1
+
+
+async def test_failed_rechunk_is_retried_with_backoff(db_conn, file_in_db, monkeypatch):
+    """
+    Тест: неудачная перечанковка записывается в БД, файл откладывается
+    с растущей задержкой и снова берется в работу, когда она истекает.
+    """
+    import datetime
+    from unittest.mock import AsyncMock
+    import telegram_handlers
+    from db import record_rechunk_failure
+
+    async with aiosqlite.connect(db_conn) as db:
+        await db.execute("UPDATE user_files SET is_processed_for_chunks = 1 WHERE id = ?", (file_in_db['id'],))
+        await db.commit()
+    monkeypatch.setattr(telegram_handlers, "_download_and_extract_text", AsyncMock(side_effect=RuntimeError("file is gone")))
+
+    assert await rechunk_stale_documents(bot=object(), batch_size=10, pause_seconds=0) == 0
+    assert await get_stale_chunked_files(CHUNKER_VERSION, 10) == []
+    later = datetime.datetime.now() + datetime.timedelta(days=2)
+    assert len(await get_stale_chunked_files(CHUNKER_VERSION, 10, now=later)) == 1
+
+    now = datetime.datetime(2026, 1, 1, 12, 0)
+    second = await record_rechunk_failure(file_in_db['id'], 30, 24 * 60, now=now)
+    third = await record_rechunk_failure(file_in_db['id'], 30, 24 * 60, now=now)
+    assert (second - now, third - now) == (datetime.timedelta(minutes=60), datetime.timedelta(minutes=120))
+
+    # Успешная запись чанков сбрасывает счетчик попыток
+    assert await save_file_chunks(file_in_db['id'], ["текст"], "текст", CHUNKER_VERSION - 1)
+    assert len(await get_stale_chunked_files(CHUNKER_VERSION, 10)) == 1
+
+
+async def test_save_chunks_for_deleted_file_leaves_no_orphans(db_conn, user, file_in_db):
+    """Тест: если файл удалили во время обработки, чанки и текст не записываются."""
+    from db import delete_files_by_ids
+
+    await delete_files_by_ids(user.id, [file_in_db['id']])
+    assert await save_file_chunks(file_in_db['id'], ["чанк"], "текст", CHUNKER_VERSION) is False
+
+    async with aiosqlite.connect(db_conn) as db:
+        cursor = await db.execute("SELECT (SELECT COUNT(*) FROM file_chunks) + (SELECT COUNT(*) FROM file_texts)")
+        assert (await cursor.fetchone())[0] == 0
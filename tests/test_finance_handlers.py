@@ -172,4 +172,359 @@ async def test_generate_pdf_report(user, state, book_with_income):
     assert kwargs['caption'] == "Ваш PDF отчет."
     assert ".pdf" in args[0].filename
     
-    assert await state.get_state() is None
\ No newline at end of file
+    assert await state.get_state() is None
+
+# --- Тест на потоковую выгрузку CSV ---
+async def test_generate_csv_report_streams_from_db(user, state, book_with_income):
+    """Тестирует CSV отчет: файл читается из БД пачками, итоги посчитаны в SQL."""
+    from reports import StreamingCSVReport
+
+    book = book_with_income['book']
+    await state.update_data(current_book_id=book['id'], current_book_name=book['name'], current_book_currency=book['currency'])
+
+    callback = AsyncMock(spec=types.CallbackQuery, from_user=user)
+    callback.message = AsyncMock(spec=types.Message)
+    callback.message.answer_document = AsyncMock()
+    callback.message.edit_text = AsyncMock()
+
+    await state.set_state(FinanceStates.choosing_report_format_for_book)
+    callback.data = "report_format:csv"
+    await choose_report_format_for_book(callback, state)
+
+    args, kwargs = callback.message.answer_document.call_args
+    report_file = args[0]
+    assert isinstance(report_file, StreamingCSVReport)
+    assert report_file.filename.endswith(".csv")
+
+    content = b"".join([chunk async for chunk in report_file.read(None)]).decode("utf-8-sig")
+    assert "Начальный капитал" in content
+    assert "Баланс,1000.00,USD" in content
+    assert await state.get_state() is None
+
+
+async def test_pdf_report_served_from_cache_until_book_changes(user, state, book_with_income, monkeypatch):
+    """Тестирует кэш отчетов: повторный PDF берется из кэша, новая транзакция его инвалидирует."""
+    import finance_handlers
+    from aiogram.types import FSInputFile
+    from db import add_transaction
+
+    render_calls = []
+    original_render = finance_handlers.render_pdf_report
+
+    def counting_render(*args):
+        render_calls.append(args)
+        return original_render(*args)
+    monkeypatch.setattr(finance_handlers, "render_pdf_report", counting_render)
+
+    book = book_with_income['book']
+
+    async def request_pdf():
+        await state.update_data(current_book_id=book['id'], current_book_name=book['name'], current_book_currency=book['currency'])
+        callback = AsyncMock(spec=types.CallbackQuery, from_user=user)
+        callback.message = AsyncMock(spec=types.Message)
+        callback.message.answer_document = AsyncMock()
+        callback.message.edit_text = AsyncMock()
+        callback.data = "report_format:pdf"
+        await state.set_state(FinanceStates.choosing_report_format_for_book)
+        await choose_report_format_for_book(callback, state)
+        return callback.message.answer_document.call_args[0][0]
+
+    first = await request_pdf()
+    second = await request_pdf()
+    assert isinstance(first, BufferedInputFile)
+    assert isinstance(second, FSInputFile)
+    assert len(render_calls) == 1
+
+    await add_transaction(user.id, book['id'], 'expense', 10.0, 'Обед', 'Еда', '2024-01-02 10:00:00')
+    third = await request_pdf()
+    assert isinstance(third, BufferedInputFile)
+    assert len(render_calls) == 2
+
+
+async def test_evicted_cached_report_is_rendered_again(user, state, book_with_income):
+    """Тестирует кэш отчетов: если файл вытеснили до отправки, отчет формируется заново, а не падает."""
+    book = book_with_income['book']
+    await state.update_data(current_book_id=book['id'], current_book_name=book['name'], current_book_currency=book['currency'])
+    callback = AsyncMock(spec=types.CallbackQuery, from_user=user)
+    callback.message = AsyncMock(spec=types.Message)
+    callback.message.edit_text = AsyncMock()
+    callback.message.answer_document = AsyncMock()
+    callback.data = "report_format:pdf"
+    await state.set_state(FinanceStates.choosing_report_format_for_book)
+    await choose_report_format_for_book(callback, state)
+
+    # Кэш есть, но файл исчезает к моменту выгрузки
+    callback.message.answer_document = AsyncMock(side_effect=[FileNotFoundError("вытеснен"), None])
+    await state.set_state(FinanceStates.choosing_report_format_for_book)
+    await choose_report_format_for_book(callback, state)
+
+    assert callback.message.answer_document.await_count == 2
+    assert isinstance(callback.message.answer_document.call_args[0][0], BufferedInputFile)
+    assert await state.get_state() is None
+
+
+async def test_statement_import_inserts_rows_and_skips_duplicates(user, state, db_conn):
+    """Тестирует импорт CSV-выписки: строки добавляются пачкой, повторный импорт дает только дубликаты."""
+    import io
+    from finance_handlers import process_statement_file
+    from db import get_book_totals
+
+    book_id = await add_book(user_id=user.id, name="Выписка", currency="USD")
+    await state.update_data(current_book_id=book_id, current_book_name="Выписка", current_book_currency="USD")
+
+    statement = (
+        "Дата;Сумма;Описание;Категория\n"
+        "05.01.2024;1 000,50;Зарплата;Работа\n"
+        "06.01.2024;-12,50;Кофе;Еда\n"
+        "06.01.2024;-12,50;Кофе;Еда\n"
+        "не дата;-1;Мусор;\n"
+    ).encode("utf-8")
+
+    async def import_once():
+        message = AsyncMock(spec=types.Message, from_user=user)
+        message.answer = AsyncMock()
+        message.document = types.Document(file_id="f1", file_unique_id="u1", file_name="bank.csv", file_size=len(statement))
+        message.bot = AsyncMock()
+        message.bot.download_file.return_value = io.BytesIO(statement)
+        await state.set_state(FinanceStates.awaiting_statement_file)
+        await process_statement_file(message, state)
+        return message.answer.call_args[0][0]
+
+    summary = await import_once()
+    assert "Добавлено: 3" in summary and "Дубликатов пропущено: 0" in summary and "Строк с ошибками: 1" in summary
+    assert tuple(await get_book_totals(user.id, book_id)) == (1000.5, 25.0, 3)
+
+    summary = await import_once()
+    assert "Добавлено: 0" in summary and "Дубликатов пропущено: 3" in summary
+    assert (await get_book_totals(user.id, book_id))[2] == 3
+    assert await state.get_state() is None
+
+
+async def test_statement_import_reads_past_blank_rows_and_skips_manual_entries(user, state, db_conn):
+    """Тестирует импорт: строки после пустой читаются, неоднозначные суммы отклоняются, ручные записи не дублируются."""
+    import io
+    from finance_handlers import handle_import_statement_button, process_statement_file, process_statement_import_cancel
+    from db import add_transaction, get_book_totals
+
+    book_id = await add_book(user_id=user.id, name="Ручная", currency="USD")
+    await state.update_data(current_book_id=book_id, current_book_name="Ручная", current_book_currency="USD")
+    await add_transaction(user.id, book_id, 'expense', 12.5, 'Кофе (вручную)', 'Еда', '2024-01-06 09:15:00')
+
+    message = AsyncMock(spec=types.Message, from_user=user)
+    message.answer = AsyncMock()
+    await handle_import_statement_button(message, state)
+    callback = AsyncMock(spec=types.CallbackQuery, from_user=user, data="statement_import:cancel")
+    callback.message = AsyncMock()
+    callback.answer = AsyncMock()
+    await process_statement_import_cancel(callback, state)
+    assert await state.get_state() is None
+    assert (await state.get_data())['current_book_id'] == book_id
+
+    statement = (
+        "Дата;Сумма;Описание\n"
+        "06.01.2024;-12,50;Кофе\n"
+        "06.01.2024;-12,50;Кофе\n"
+        ";;\n"
+        "07.01.2024;1 000,50;Зарплата\n"
+        "08.01.2024;1,000;Непонятно\n"
+    ).encode("utf-8")
+    message.document = types.Document(file_id="f1", file_unique_id="u1", file_name="bank.csv", file_size=len(statement))
+    message.bot = AsyncMock()
+    message.bot.download_file.return_value = io.BytesIO(statement)
+    await state.set_state(FinanceStates.awaiting_statement_file)
+    await process_statement_file(message, state)
+
+    summary = message.answer.call_args[0][0]
+    assert "Добавлено: 2" in summary and "Уже внесены вручную: 1" in summary and "Строк с ошибками: 1" in summary
+    assert tuple(await get_book_totals(user.id, book_id)) == (1000.5, 25.0, 3)
+
+async def test_receipt_page_is_cached_only_after_successful_parse(monkeypatch):
+    """Тестирует кэш чеков: разобранный чек не запрашивается повторно, а неразобранная страница — запрашивается."""
+    import datetime
+    import finance_handlers
+
+    ok_url, pending_url = "https://ofd.soliq.uz/check?t=1&r=2", "https://ofd.soliq.uz/check?t=2&r=3"
+    pages = {
+        ok_url: "<html><body><p>Jami to`lov</p><p>15 000,00</p></body></html>",
+        pending_url: "<html><body><p>Chek hali ro'yxatdan o'tmagan</p></body></html>",
+    }
+    requests_made = []
+
+    class FakeResponse:
+        status = 200
+        def __init__(self, url):
+            self.url = url
+        async def read(self):
+            return pages[self.url].encode("utf-8")
+        async def __aenter__(self):
+            return self
+        async def __aexit__(self, *exc):
+            return False
+
+    class FakeSession:
+        def get(self, url):
+            requests_made.append(url)
+            return FakeResponse(url)
+
+    async def fake_gemini(check_text):
+        if "Jami" not in check_text:
+            raise ValueError("ИИ не смог извлечь все необходимые данные из чека.")
+        return {"total_sum": 15000.0, "check_date": datetime.datetime(2024, 1, 1), "items": [{"name": "X", "quantity": 1, "price_total": 15000}]}
+
+    monkeypatch.setattr(finance_handlers, "get_http_session", FakeSession)
+    monkeypatch.setattr(finance_handlers, "parse_receipt_with_gemini", fake_gemini)
+
+    for _ in range(2):
+        assert (await finance_handlers.analyze_receipt(ok_url))["total_sum"] == 15000.0
+        with pytest.raises(ValueError):
+            await finance_handlers.analyze_receipt(pending_url)
+    assert requests_made == [ok_url, pending_url, pending_url]
+    assert finance_handlers.extract_receipt_text(ok_url, b"") == "Jami to`lov\n15 000,00"
+
+async def test_webapp_qr_payload_skips_image_pipeline(user, state, db_conn, monkeypatch):
+    """Тестирует WebApp-сканер: ссылка из web_app_data сразу идет на разбор чека, без фото и pyzbar."""
+    import datetime
+    import finance_handlers
+    from finance_handlers import process_qr_webapp_data
+
+    book_id = await add_book(user_id=user.id, name="Чеки", currency="UZS")
+    await state.update_data(current_book_id=book_id, current_book_name="Чеки", current_book_currency="UZS")
+
+    async def fake_analyze(url):
+        return {"total_sum": 20500.0, "check_date": datetime.datetime(2024, 3, 17, 18, 42), "items": [{"name": "Non", "quantity": 2, "price_total": 8000}]}
+    monkeypatch.setattr(finance_handlers, "analyze_receipt", fake_analyze)
+    monkeypatch.setattr(finance_handlers, "decode_qr_from_photo", AsyncMock(side_effect=AssertionError("фото не должно обрабатываться")))
+
+    message = AsyncMock(spec=types.Message, from_user=user)
+    message.answer = AsyncMock()
+    message.web_app_data = types.WebAppData(data="https://ofd.soliq.uz/check?t=1", button_text="📷 Сканер QR")
+    await process_qr_webapp_data(message, state)
+
+    assert await state.get_state() == FinanceStates.awaiting_qr_category
+    assert (await state.get_data())['qr_check_url'] == "https://ofd.soliq.uz/check?t=1"
+    assert "20,500.00" in message.answer.call_args[0][0]
+
+    # Подделки под soliq.uz и не-https ссылки не загружаются
+    fetch = AsyncMock(side_effect=AssertionError("чужая ссылка не должна загружаться"))
+    monkeypatch.setattr(finance_handlers, "analyze_receipt", fetch)
+    for url in ("https://evil.com/?ofd.soliq.uz", "https://ofd.soliq.uz.evil.com/check", "http://ofd.soliq.uz/check", "https://evilsoliq.uz/check"):
+        message.web_app_data = types.WebAppData(data=url, button_text="📷 Сканер QR")
+        await process_qr_webapp_data(message, state)
+        assert "не ссылка на фискальный чек" in message.answer.call_args[0][0]
+    assert finance_handlers.is_receipt_url("https://soliq.uz/check")
+
+
+async def test_receipt_album_is_processed_as_one_batch(user, state, db_conn, monkeypatch):
+    """Тестирует альбом чеков: фото собираются вместе, одна категория и одна запись в БД на все чеки."""
+    import asyncio
+    import datetime
+    import finance_handlers
+    from finance_handlers import process_qr_photo, process_qr_category
+    from db import get_book_totals
+
+    book_id = await add_book(user_id=user.id, name="Альбом", currency="UZS")
+    await state.update_data(current_book_id=book_id, current_book_name="Альбом", current_book_currency="UZS")
+    await state.set_state(FinanceStates.awaiting_qr_photo)
+
+    urls = {"p1": "https://ofd.soliq.uz/1", "p2": "https://ofd.soliq.uz/2", "p3": None}
+    async def fake_decode(bot, photo):
+        return urls[photo[0].file_id]
+    async def fake_analyze(url):
+        return {"total_sum": 1000.0 if url.endswith("1") else 2500.0, "check_date": datetime.datetime(2024, 3, 1, 12, 0), "items": []}
+    monkeypatch.setattr(finance_handlers, "decode_qr_from_photo", fake_decode)
+    monkeypatch.setattr(finance_handlers, "analyze_receipt", fake_analyze)
+    monkeypatch.setattr(finance_handlers, "RECEIPT_ALBUM_DEBOUNCE_SECONDS", 0.01)
+
+    messages = []
+    for file_id in urls:
+        message = AsyncMock(spec=types.Message, from_user=user, media_group_id="album-1")
+        message.answer = AsyncMock()
+        message.photo = [types.PhotoSize(file_id=file_id, file_unique_id=file_id, width=800, height=800)]
+        messages.append(message)
+        await process_qr_photo(message, state)
+    await asyncio.sleep(0.1)
+
+    summary = messages[0].answer.call_args[0][0]
+    assert "Распознано чеков: 2 из 3" in summary and "Фото 3: QR-код не найден" in summary
+    assert await state.get_state() == FinanceStates.awaiting_qr_category
+
+    category_message = AsyncMock(spec=types.Message, from_user=user, text="Продукты")
+    category_message.answer = AsyncMock()
+    await process_qr_category(category_message, state)
+    assert "Записано расходов по чекам: 2 из 2" in category_message.answer.call_args[0][0]
+    assert tuple(await get_book_totals(user.id, book_id)) == (0.0, 3500.0, 2)
+
+
+async def test_late_album_photos_merge_and_abandoned_batch_is_dropped(user, state, db_conn, monkeypatch):
+    """Тестирует: фото альбома после паузы дополняют ожидающую пачку, а брошенная пачка не попадает в следующий чек."""
+    import asyncio
+    import datetime
+    import finance_handlers
+    from finance_handlers import handle_scan_qr_button, process_qr_photo, process_qr_webapp_data, process_qr_category
+    from db import add_receipt_expenses, get_book_content_version, get_book_totals
+
+    book_id = await add_book(user_id=user.id, name="Пачки", currency="UZS")
+    await state.update_data(current_book_id=book_id, current_book_name="Пачки", current_book_currency="UZS")
+
+    async def fake_decode(bot, photo):
+        return f"https://ofd.soliq.uz/{photo[0].file_id}"
+    async def fake_analyze(url):
+        return {"total_sum": 1000.0, "check_date": datetime.datetime(2024, 3, 1, 12, 0), "items": []}
+    monkeypatch.setattr(finance_handlers, "decode_qr_from_photo", fake_decode)
+    monkeypatch.setattr(finance_handlers, "analyze_receipt", fake_analyze)
+    monkeypatch.setattr(finance_handlers, "RECEIPT_ALBUM_DEBOUNCE_SECONDS", 0.01)
+
+    scan_message = AsyncMock(spec=types.Message, from_user=user)
+    scan_message.answer = AsyncMock()
+    await handle_scan_qr_button(scan_message, state)
+    for file_id in ("p1", "p2"):
+        message = AsyncMock(spec=types.Message, from_user=user, media_group_id="album-1")
+        message.answer = AsyncMock()
+        message.photo = [types.PhotoSize(file_id=file_id, file_unique_id=file_id, width=800, height=800)]
+        await process_qr_photo(message, state)
+        await asyncio.sleep(0.05) # второе фото приходит уже после паузы и обрабатывается отдельной пачкой
+    assert [r["check_url"] for r in (await state.get_data())["qr_batch"]] == ["https://ofd.soliq.uz/p1", "https://ofd.soliq.uz/p2"]
+
+    # Пачку бросили без категории и начали новое сканирование через WebApp
+    await handle_scan_qr_button(scan_message, state)
+    message = AsyncMock(spec=types.Message, from_user=user)
+    message.answer = AsyncMock()
+    message.web_app_data = types.WebAppData(data="https://ofd.soliq.uz/single", button_text="📷 Сканер QR")
+    await process_qr_webapp_data(message, state)
+    category_message = AsyncMock(spec=types.Message, from_user=user, text="Продукты")
+    category_message.answer = AsyncMock()
+    await process_qr_category(category_message, state)
+    assert "Расход по QR записан" in category_message.answer.call_args[0][0]
+    assert tuple(await get_book_totals(user.id, book_id)) == (0.0, 1000.0, 1)
+
+    # Повторная запись тех же чеков ничего не добавляет и не сбрасывает кэш отчетов
+    version = await get_book_content_version(user.id, book_id)
+    assert await add_receipt_expenses(user.id, book_id, [(1000.0, "", "2024-03-01 12:00:00", "https://ofd.soliq.uz/single")], "Продукты") == 0
+    assert await get_book_content_version(user.id, book_id) == version
+
+
+async def test_fx_command_sets_rates_only_for_owner(user, db_conn, monkeypatch):
+    """Тестирует /fx: владелец задает курсы, остальные пользователи могут только смотреть."""
+    from aiogram.filters import CommandObject
+    from aiogram.types import User
+    from finance_handlers import handle_fx_command
+    from db import get_fx_rates
+    monkeypatch.setattr("finance_handlers.OWNER_TELEGRAM_ID", 1)
+
+    stranger = User(id=777, is_bot=False, first_name="Гость")
+    message = AsyncMock(spec=types.Message, from_user=stranger, document=None)
+    message.answer = AsyncMock()
+    await handle_fx_command(message, CommandObject(command="fx", args="UZS 12650"))
+    assert "только владелец" in message.answer.call_args[0][0]
+
+    owner = User(id=1, is_bot=False, first_name="Владелец")
+    message = AsyncMock(spec=types.Message, from_user=owner, document=None)
+    message.answer = AsyncMock()
+    await handle_fx_command(message, CommandObject(command="fx", args="UZS 12650 eur 0,92"))
+    assert [tuple(row[:2]) for row in await get_fx_rates()] == [("EUR", 0.92), ("UZS", 12650.0)]
+
+    # Разделитель тысяч без дробной части неоднозначен: курс не должен стать 12.85
+    await handle_fx_command(message, CommandObject(command="fx", args="UZS 12,850"))
+    assert "Неоднозначное число" in message.answer.call_args[0][0]
+    await handle_fx_command(message, CommandObject(command="fx", args="UZS 12,850.00"))
+    assert dict((row[0], row[1]) for row in await get_fx_rates())["UZS"] == 12850.0
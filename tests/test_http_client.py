@@ -0,0 +1,22 @@
+# tests/test_http_client.py
+import pytest
+
+import http_client
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_shared_session_is_reused_and_closed():
+    """Тест: все вызовы получают одну сессию с пулом и таймаутами, после закрытия создается новая."""
+    await http_client.init_http_session()
+    session = http_client.get_http_session()
+    assert http_client.get_http_session() is session
+    assert session.connector.limit == http_client.HTTP_POOL_LIMIT
+    assert session.connector.limit_per_host == http_client.HTTP_POOL_LIMIT_PER_HOST
+    assert session.timeout.sock_connect == http_client.HTTP_CONNECT_TIMEOUT
+
+    await http_client.close_http_session()
+    assert session.closed
+    new_session = http_client.get_http_session()
+    assert new_session is not session
+    await http_client.close_http_session()
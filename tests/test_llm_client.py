@@ -0,0 +1,68 @@
+# tests/test_llm_client.py
+import asyncio
+import pytest
+
+from llm_client import LLMClient, LLMError, FakeLLMBackend
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_retries_transient_errors_and_caches_response():
+    """Тест: временные ошибки повторяются, повторный запрос берется из кэша без вызова бэкенда."""
+    backend = FakeLLMBackend(responder=lambda prompt: prompt.upper(), transient_failures=2)
+    client = LLMClient(backend, max_attempts=3, retry_base_delay=0.001)
+
+    assert await client.generate("чек") == "ЧЕК"
+    assert await client.generate("чек") == "ЧЕК"
+    assert backend.calls == 3
+
+    stats = client.get_stats()
+    assert stats["retries"] == 2 and stats["cache_hits"] == 1
+    assert stats["prompt_tokens"] == 1 and stats["output_tokens"] == 1
+
+    client.forget("чек")
+    await client.generate("чек")
+    assert backend.calls == 4
+
+
+async def test_identical_concurrent_prompts_share_one_call():
+    """Тест: одинаковые одновременные запросы ждут один вызов бэкенда."""
+    backend = FakeLLMBackend(responder=lambda prompt: "ok", latency=0.02)
+    client = LLMClient(backend)
+
+    assert await asyncio.gather(*(client.generate("чек") for _ in range(5))) == ["ok"] * 5
+    assert backend.calls == 1
+    assert client.get_stats()["coalesced"] == 4
+
+
+async def test_deadline_and_concurrency_limit():
+    """Тест: одновременно выполняется не больше max_concurrency запросов; срок включает ожидание слота."""
+    backend = FakeLLMBackend(latency=0.05)
+    client = LLMClient(backend, max_concurrency=2, timeout=0.08)
+
+    results = await asyncio.gather(*(client.generate(f"запрос {i}") for i in range(3)), return_exceptions=True)
+    assert sum(isinstance(result, LLMError) for result in results) == 1
+    assert client.get_stats()["timeouts"] == 1
+
+
+
+async def test_waiting_for_slot_is_bounded_by_deadline():
+    """Тест: если все слоты заняты дольше срока, запрос завершается по сроку, а не ждет освобождения слота."""
+    import time
+    client = LLMClient(FakeLLMBackend(), max_concurrency=1, timeout=0.05)
+    await client._semaphore.acquire()
+    asyncio.get_running_loop().call_later(1.0, client._semaphore.release)
+
+    started = time.monotonic()
+    with pytest.raises(LLMError):
+        await client.generate("чек")
+    assert time.monotonic() - started < 0.5
+    assert client.get_stats()["timeouts"] == 1
+    assert client._semaphore.locked() # чужой слот не освобожден по ошибке
+
+async def test_gives_up_after_max_attempts():
+    """Тест: после исчерпания попыток бросается LLMError."""
+    client = LLMClient(FakeLLMBackend(transient_failures=5), max_attempts=2, retry_base_delay=0.001)
+    with pytest.raises(LLMError):
+        await client.generate("чек")
+    assert client.get_stats()["errors"] == 1
@@ -10,9 +10,11 @@ from plan_handlers import (
     add_plan_content_received, add_plan_reminder_time_received, AddPlanStates,
     handle_delete_plan_button, delete_plans_ids_received, DeletePlanStates,
     handle_complete_plan_button, complete_plans_ids_received, CompletePlanStates,
-    handle_today_plans_button
+    handle_today_plans_button,
+    handle_add_series_button, add_series_start_date_received, add_series_topic_received, add_series_text_received,
+    add_series_rule_received, add_series_reminder_time_received
 )
-from db import get_all_user_plans, get_plan_by_id
+from db import get_all_user_plans, get_plan_by_id, get_user_plan_series
 from keyboards import get_date_keyboard # <--- ИМПОРТИРУЕМ НОВУЮ КЛАВИАТУРУ
 
 pytestmark = pytest.mark.asyncio
@@ -130,4 +132,36 @@ async def test_view_today_plans(user, state, plan_in_db):
     await handle_today_plans_button(message)
     args, _ = message.answer.call_args
     assert "На сегодня" in args[0]
-    assert "планов нет" in args[0]
\ No newline at end of file
+    assert "планов нет" in args[0]
+
+
+# --- Тест на повторяющийся план ---
+async def test_add_series_shows_in_today_plans_and_deletes(user, state, db_conn):
+    """Тестирует добавление серии: одна строка в БД, повторение на сегодня в списке, удаление по ID вида S1."""
+    message = AsyncMock(spec=types.Message, from_user=user)
+    message.answer = AsyncMock()
+
+    await handle_add_series_button(message, state)
+    for handler, text in (
+        (add_series_start_date_received, "Сегодня"),
+        (add_series_topic_received, "Зарядка"),
+        (add_series_text_received, "10 минут"),
+        (add_series_rule_received, "Каждый день"),
+        (add_series_reminder_time_received, "нет"),
+    ):
+        message.text = text
+        await handler(message, state)
+    assert await state.get_state() is None
+    series_rows = await get_user_plan_series(user.id)
+    assert [(row['rrule'], row['next_reminder_datetime']) for row in series_rows] == [("FREQ=DAILY", None)]
+    series_id = series_rows[0]['id']
+
+    message.answer.reset_mock()
+    await handle_today_plans_button(message)
+    first_call_args, _ = message.answer.call_args_list[0]
+    assert "Зарядка" in first_call_args[0] and f"S{series_id}" in first_call_args[0]
+
+    await state.set_state(DeletePlanStates.awaiting_ids)
+    message.text = f"S{series_id}"
+    await delete_plans_ids_received(message, state)
+    assert await get_user_plan_series(user.id) == []
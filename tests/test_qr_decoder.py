@@ -0,0 +1,36 @@
+# tests/test_qr_decoder.py
+import io
+import pytest
+from unittest.mock import AsyncMock
+
+from aiogram.types import PhotoSize
+from PIL import Image
+
+import qr_decoder
+
+
+def _photo(file_id: str, side: int) -> PhotoSize:
+    return PhotoSize(file_id=file_id, file_unique_id=file_id, width=side, height=side)
+
+
+@pytest.mark.asyncio
+async def test_photo_sizes_are_tried_from_small_to_large(monkeypatch):
+    """Тест: миниатюры пропускаются, большое фото скачивается только если на меньшем QR не найден."""
+    bot = AsyncMock()
+    bot.download.side_effect = lambda file_id: io.BytesIO(file_id.encode())
+    monkeypatch.setattr(qr_decoder, "decode_qr_image", lambda data: "https://ofd.soliq.uz/x" if data == b"medium" else None)
+
+    photo = [_photo("large", 1280), _photo("thumb", 90), _photo("small", 320), _photo("medium", 800)]
+    assert await qr_decoder.decode_qr_from_photo(bot, photo) == "https://ofd.soliq.uz/x"
+    assert [call.args[0] for call in bot.download.call_args_list] == ["small", "medium"]
+
+
+def test_candidate_images_are_grayscale_downscaled_and_binarized():
+    """Тест: предобработка дает уменьшенные варианты в оттенках серого и черно-белый вариант с поворотами."""
+    image = Image.new("RGB", (3000, 1500), (200, 180, 160))
+    candidates = list(qr_decoder._candidate_images(image))
+
+    assert all(candidate.mode == "L" for candidate in candidates)
+    assert max(candidates[0].size) == qr_decoder.QR_MAX_DECODE_SIDE
+    assert set(candidates[2].getdata()) <= {0, 255}
+    assert candidates[3].size == (candidates[2].size[1], candidates[2].size[0])
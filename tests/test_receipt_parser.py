@@ -0,0 +1,78 @@
+# tests/test_receipt_parser.py
+import datetime
+import pytest
+
+from receipt_parser import parse_receipt_html, ReceiptParseError
+
+RECEIPT_HTML = """
+<html><body>
+  <h3>"SUPERMARKET" MChJ</h3>
+  <i>17.03.2024, 18:42</i>
+  <table class="products-tables">
+    <tr><th>Nomi</th><th>Soni</th><th>Narxi</th></tr>
+    <tr class="products-row"><td>Non</td><td>2.00</td><td class="price-sum">8,000.00</td></tr>
+    <tr class="products-row"><td>Sut 1l</td><td>1.00</td><td class="price-sum">12,500.00</td></tr>
+    <tr><td>QQS 12%</td><td></td><td>2,196.43</td></tr>
+    <tr><td>Jami to`lov:</td><td></td><td class="price-sum">20,500.00</td></tr>
+  </table>
+</body></html>
+"""
+
+
+def test_parses_total_date_and_items_locally():
+    """Тест: итог, дата и позиции извлекаются из разметки без ИИ."""
+    receipt = parse_receipt_html(RECEIPT_HTML)
+    assert receipt["total_sum"] == 20500.0
+    assert receipt["check_date"] == datetime.datetime(2024, 3, 17, 18, 42)
+    assert receipt["items"] == [
+        {"name": "Non", "quantity": 2.0, "price_total": 8000.0},
+        {"name": "Sut 1l", "quantity": 1.0, "price_total": 12500.0},
+    ]
+
+
+def test_rejects_receipt_when_items_do_not_match_total():
+    """Тест: если сумма позиций не сходится с итогом, разбор отклоняется (дальше работает ИИ)."""
+    broken = RECEIPT_HTML.replace("20,500.00", "99,000.00")
+    with pytest.raises(ReceiptParseError):
+        parse_receipt_html(broken)
+    with pytest.raises(ReceiptParseError):
+        parse_receipt_html("<html><body><p>Чек не найден</p></body></html>")
+
+
+
+def test_amounts_use_strict_shared_parser():
+    """Тест: суммы с подписью валюты разбираются, неоднозначные («8.000») не угадываются и разбор уходит к ИИ."""
+    with_currency = RECEIPT_HTML.replace(">8,000.00<", ">8\u00a0000,00 so'm<").replace(">12,500.00<", ">12 500,00 сум<")
+    assert [item["price_total"] for item in parse_receipt_html(with_currency)["items"]] == [8000.0, 12500.0]
+
+    ambiguous = RECEIPT_HTML.replace(">8,000.00<", ">8.000<")
+    with pytest.raises(ReceiptParseError):
+        parse_receipt_html(ambiguous)
+
+@pytest.mark.asyncio
+async def test_analyze_receipt_falls_back_to_gemini_and_counts_paths(monkeypatch):
+    """Тест: Gemini вызывается только при неудаче локального разбора, оба пути учитываются в счетчиках."""
+    import finance_handlers
+    from receipt_parser import parser_stats
+
+    pages = {"https://ofd.soliq.uz/ok": RECEIPT_HTML.encode(), "https://ofd.soliq.uz/odd": b"<html><body>Jami 5000</body></html>"}
+
+    async def fake_fetch(url):
+        return pages[url]
+
+    gemini_calls = []
+
+    async def fake_gemini(check_text):
+        gemini_calls.append(check_text)
+        return {"total_sum": 5000.0, "check_date": datetime.datetime(2024, 1, 1), "items": [{"name": "X", "quantity": 1, "price_total": 5000}]}
+
+    monkeypatch.setattr(finance_handlers, "fetch_receipt_html", fake_fetch)
+    monkeypatch.setattr(finance_handlers, "parse_receipt_with_gemini", fake_gemini)
+    monkeypatch.setitem(parser_stats, "local", 0)
+    monkeypatch.setitem(parser_stats, "llm_fallback", 0)
+
+    assert (await finance_handlers.analyze_receipt("https://ofd.soliq.uz/ok"))["total_sum"] == 20500.0
+    assert gemini_calls == []
+    assert (await finance_handlers.analyze_receipt("https://ofd.soliq.uz/odd"))["total_sum"] == 5000.0
+    assert gemini_calls == ["Jami 5000"]
+    assert parser_stats["local"] == 1 and parser_stats["llm_fallback"] == 1
@@ -0,0 +1,59 @@
+# tests/test_recurrence.py
+import datetime
+
+import pytest
+
+from recurrence import RecurrenceError, iter_occurrences, next_occurrence_at, occurrences_between, parse_rrule
+
+
+def _occurrences_from_start(rule, dtstart, end):
+    days = []
+    for day in iter_occurrences(rule, dtstart):
+        if day > end:
+            break
+        days.append(day)
+    return days
+
+
+def test_parse_rrule_roundtrip_and_errors():
+    """Тест: правило разбирается, приводится к каноническому виду, неподдерживаемое отклоняется."""
+    rule = parse_rrule("RRULE:freq=weekly;byday=WE,MO;interval=2;count=5")
+    assert rule.byweekday == (0, 2)
+    assert rule.to_rrule() == "FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,WE;COUNT=5"
+    assert parse_rrule("FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR").describe() == "по будням"
+    for bad in ("FREQ=YEARLY", "FREQ=DAILY;BYDAY=MO", "FREQ=DAILY;INTERVAL=0", "FREQ=DAILY;BYHOUR=9", "FREQ=DAILY;COUNT"):
+        with pytest.raises(RecurrenceError):
+            parse_rrule(bad)
+
+
+def test_occurrences_between_weekly_monthly_count_until():
+    """Тест: повторения в диапазоне для BYDAY, INTERVAL, COUNT, UNTIL и несуществующих чисел месяца."""
+    start = datetime.date(2026, 1, 5) # понедельник
+    weekly = parse_rrule("FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH")
+    assert occurrences_between(weekly, start, datetime.date(2026, 1, 1), datetime.date(2026, 1, 31)) == [
+        datetime.date(2026, 1, 5), datetime.date(2026, 1, 8), datetime.date(2026, 1, 19), datetime.date(2026, 1, 22),
+    ]
+    counted = parse_rrule("FREQ=DAILY;COUNT=3")
+    assert occurrences_between(counted, start, datetime.date(2026, 1, 6), datetime.date(2026, 2, 1)) == [
+        datetime.date(2026, 1, 6), datetime.date(2026, 1, 7),
+    ]
+    until = parse_rrule("FREQ=DAILY;UNTIL=20260107")
+    assert list(iter_occurrences(until, start)) == [datetime.date(2026, 1, 5), datetime.date(2026, 1, 6), datetime.date(2026, 1, 7)]
+    monthly = parse_rrule("FREQ=MONTHLY")
+    assert occurrences_between(monthly, datetime.date(2026, 1, 31), datetime.date(2026, 1, 1), datetime.date(2026, 5, 31)) == [
+        datetime.date(2026, 1, 31), datetime.date(2026, 3, 31), datetime.date(2026, 5, 31),
+    ]
+
+
+def test_lazy_expansion_skips_to_requested_range():
+    """Тест: без COUNT генератор начинает с нужного периода и совпадает с полным перебором с начала серии."""
+    dtstart = datetime.date(2000, 2, 29)
+    for text in ("FREQ=DAILY;INTERVAL=3", "FREQ=WEEKLY;INTERVAL=2;BYDAY=TU,SU", "FREQ=MONTHLY;INTERVAL=5"):
+        rule = parse_rrule(text)
+        window_start, window_end = datetime.date(2026, 3, 1), datetime.date(2027, 3, 1)
+        naive = [day for day in _occurrences_from_start(rule, dtstart, window_end) if day >= window_start]
+        assert occurrences_between(rule, dtstart, window_start, window_end) == naive
+
+    at = next_occurrence_at(parse_rrule("FREQ=DAILY"), dtstart, datetime.time(9, 0), datetime.datetime(2026, 3, 1, 9, 0))
+    assert at == datetime.datetime(2026, 3, 2, 9, 0)
+
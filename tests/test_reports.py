@@ -0,0 +1,225 @@
+# tests/test_reports.py
+import asyncio
+import threading
+import pytest
+
+from reports import ReportRenderPool, ReportQueueFull
+
+@pytest.mark.asyncio
+async def test_render_pool_runs_off_loop_and_collects_metrics():
+    """Тест: рендеринг выполняется в отдельном потоке, метрики обновляются."""
+    pool = ReportRenderPool(workers=1, queue_size=1)
+    main_thread = threading.get_ident()
+
+    thread_id = await pool.render(threading.get_ident)
+    assert thread_id != main_thread
+
+    total = await pool.render(sum, [1, 2, 3])
+    assert total == 6
+
+    metrics = pool.get_metrics()
+    assert metrics["rendered"] == 2
+    assert metrics["in_flight"] == 0
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_render_pool_rejects_when_queue_is_full():
+    """Тест: при переполнении очереди задача отклоняется сразу."""
+    pool = ReportRenderPool(workers=1, queue_size=0)
+    release = threading.Event()
+    busy_task = asyncio.create_task(pool.render(release.wait))
+    await asyncio.sleep(0)
+
+    with pytest.raises(ReportQueueFull):
+        await pool.render(sum, [])
+    assert pool.get_metrics()["rejected"] == 1
+
+    release.set()
+    await busy_task
+    pool.shutdown()
+
+
+def test_paginated_pdf_report_splits_by_month():
+    """Тест: постраничный движок рисует разделы по месяцам с итогами."""
+    import fitz
+    from reports import render_pdf_report_paginated
+
+    rows = [
+        (3, "2024-02-03 10:00:00", "expense", 50.0, "Еда", "Обед"),
+        (2, "2024-01-15 09:00:00", "income", 200.0, "Работа", "Зарплата"),
+        (1, "2024-01-02 08:00:00", "expense", 30.0, "Еда", "Очень длинное описание <покупки> & прочего " * 3),
+    ]
+    content = render_pdf_report_paginated(rows, "Книга", "USD", 200.0, 80.0)
+
+    with fitz.open(stream=content, filetype="pdf") as doc:
+        text = "".join(page.get_text() for page in doc)
+    assert "Февраль 2024" in text and "Январь 2024" in text
+    assert "+200.00" in text and "-30.00" in text
+    assert "Баланс" in text
+
+
+@pytest.mark.asyncio
+async def test_paginated_pdf_reads_rows_from_cursor_batches(db_conn, user):
+    """Тест: PDF рисуется в потоке пула из пачек курсора, генератор закрывается после рендеринга."""
+    pytest.importorskip("fitz")
+    import fitz
+    from db import add_book, add_transaction, iter_transactions_by_book
+    from reports import iter_rows_from_batches, render_pdf_report_paginated
+
+    book_id = await add_book(user.id, "Пачки", "USD")
+    await add_transaction(user.id, book_id, 'income', 200.0, "Зарплата", "Работа", "2024-01-15 09:00:00")
+    await add_transaction(user.id, book_id, 'expense', 30.0, "Обед", "Еда", "2024-01-02 08:00:00")
+    await add_transaction(user.id, book_id, 'expense', 50.0, "Ужин", "Еда", "2024-02-03 10:00:00")
+
+    pool = ReportRenderPool(workers=1, queue_size=0)
+    batches = iter_transactions_by_book(user.id, book_id, batch_size=1)
+    rows = iter_rows_from_batches(batches, asyncio.get_running_loop())
+    try:
+        content = await pool.render(render_pdf_report_paginated, rows, "Пачки", "USD", 200.0, 80.0)
+    finally:
+        await batches.aclose()
+        pool.shutdown()
+
+    with fitz.open(stream=content, filetype="pdf") as doc:
+        text = "".join(page.get_text() for page in doc)
+    assert "Февраль 2024" in text and "Январь 2024" in text and "+200.00" in text
+
+
+
+@pytest.mark.asyncio
+async def test_render_thread_reading_rows_does_not_block_writers(db_conn, user):
+    """Тест: пока поток рендеринга разбирает пачки книги, запись в БД из другого соединения проходит."""
+    import sqlite3
+    from db import add_book, add_transaction, iter_transactions_by_book
+    from reports import iter_rows_from_batches
+
+    book_id = await add_book(user.id, "Запись", "USD")
+    for day in range(1, 4):
+        await add_transaction(user.id, book_id, 'expense', 1.0, "Обед", "Еда", f"2024-01-0{day} 10:00:00")
+
+    def render_with_parallel_write(rows):
+        rows = iter(rows)
+        consumed = [next(rows)]
+        with sqlite3.connect(db_conn, timeout=0.1) as writer:
+            writer.execute("UPDATE transactions SET description = 'Изменено' WHERE book_id = ?", (book_id,))
+        consumed.extend(rows)
+        return len(consumed)
+
+    pool = ReportRenderPool(workers=1, queue_size=0)
+    batches = iter_transactions_by_book(user.id, book_id, batch_size=1)
+    try:
+        assert await pool.render(render_with_parallel_write, iter_rows_from_batches(batches, asyncio.get_running_loop())) == 3
+    finally:
+        await batches.aclose()
+        pool.shutdown()
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    """Тест: при превышении лимита вытесняется давно не использованная запись."""
+    import os
+    from disk_cache import DiskLRUCache
+
+    cache = DiskLRUCache(str(tmp_path), max_bytes=25)
+    cache.put("a", b"x" * 10)
+    cache.put("b", b"y" * 10)
+    os.utime(cache.get_path("b"), (1, 1))
+    assert cache.get("a") == b"x" * 10
+
+    cache.put("c", b"z" * 10)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+
+def test_disk_cache_tracks_size_without_rescanning(tmp_path, monkeypatch):
+    """Тест: размер кэша ведется по записям, каталог сканируется один раз и при вытеснении."""
+    from disk_cache import DiskLRUCache
+
+    cache = DiskLRUCache(str(tmp_path), max_bytes=25)
+    scans = []
+    original_scan = cache._scan
+    monkeypatch.setattr(cache, "_scan", lambda: scans.append(1) or original_scan())
+
+    cache.put("a", b"x" * 10)
+    cache.put("a", b"x" * 5) # перезапись того же ключа не должна удваивать размер
+    cache.put("b", b"y" * 10)
+    assert len(scans) == 1 and cache._total_size == 15
+
+    cache.put("c", b"z" * 15)
+    assert len(scans) == 2 and cache._total_size <= 25
+
+@pytest.mark.asyncio
+async def test_aborted_csv_upload_closes_db_cursor(tmp_path, monkeypatch):
+    """Тест: если выгрузку CSV прервали, генератор транзакций закрывается сразу, а кэш не пополняется."""
+    import reports
+    from disk_cache import DiskLRUCache
+
+    closed = []
+
+    async def fake_iter(user_id, book_id, batch_size):
+        try:
+            for i in range(100):
+                yield [(i, "2024-01-01 10:00:00", "expense", 1.0, "Еда", "Обед")]
+        finally:
+            closed.append(True)
+
+    monkeypatch.setattr(reports, "iter_transactions_by_book", fake_iter)
+    cache = DiskLRUCache(str(tmp_path), max_bytes=1024 * 1024)
+    report = reports.StreamingCSVReport(1, 1, "USD", 0.0, 100.0, filename="r.csv", cache=cache, cache_key="k")
+
+    chunks = report.read()
+    await chunks.__anext__() # заголовок
+    await chunks.__anext__() # первая пачка
+    await chunks.aclose()
+
+    assert closed == [True]
+    assert cache.get_path("k") is None
+    assert list(tmp_path.iterdir()) == []
+
+@pytest.mark.asyncio
+async def test_parquet_report_has_typed_columns(db_conn, user, tmp_path):
+    """Тест: Parquet-выгрузка пишет типизированные колонки группами строк."""
+    pq = pytest.importorskip("pyarrow.parquet")
+    from db import add_book, add_transaction
+    from reports import write_parquet_report
+
+    book_id = await add_book(user.id, "Parquet", "USD")
+    await add_transaction(user.id, book_id, 'income', 1000.0, "Зарплата", "Работа", "2024-01-05 10:00:00")
+    await add_transaction(user.id, book_id, 'expense', 12.5, "Обед", None, "2024-01-06 13:30:00")
+    await add_transaction(user.id, book_id, 'expense', 40.0, "Такси", "Транспорт", "2024-02-01 08:00:00")
+
+    path = str(tmp_path / "book.parquet")
+    assert await write_parquet_report(user.id, book_id, "Parquet", "USD", path, row_group_size=2) == 3
+
+    parquet_file = pq.ParquetFile(path)
+    assert parquet_file.metadata.num_row_groups == 2
+    table = parquet_file.read()
+    assert str(table.schema.field("transaction_date").type) == "timestamp[ms]"
+    assert str(table.schema.field("amount").type) == "double"
+    rows = table.to_pylist()
+    assert rows[0]["amount"] == 40.0 and rows[0]["currency"] == "USD"
+    assert rows[0]["transaction_date"].month == 2
+    assert rows[1]["category"] is None
+
+
+@pytest.mark.asyncio
+async def test_parquet_export_does_not_block_writers(db_conn, user, tmp_path, monkeypatch):
+    """Тест: пока группы строк конвертируются и пишутся в Parquet, запись в БД из другого соединения проходит."""
+    pytest.importorskip("pyarrow.parquet")
+    import sqlite3
+    import reports
+    from db import add_book, add_transaction
+
+    book_id = await add_book(user.id, "Parquet", "USD")
+    for day in range(1, 4):
+        await add_transaction(user.id, book_id, 'expense', 1.0, "Обед", "Еда", f"2024-01-0{day} 10:00:00")
+
+    original_table = reports._parquet_table
+    def table_with_parallel_write(*args):
+        with sqlite3.connect(db_conn, timeout=0.1) as writer:
+            writer.execute("UPDATE transactions SET category = 'Изменено' WHERE book_id = ?", (book_id,))
+        return original_table(*args)
+    monkeypatch.setattr(reports, "_parquet_table", table_with_parallel_write)
+
+    path = str(tmp_path / "book.parquet")
+    assert await reports.write_parquet_report(user.id, book_id, "Parquet", "USD", path, row_group_size=1) == 3
@@ -0,0 +1,347 @@
+# tests/test_scheduler_jobs.py
+import asyncio
+import datetime
+
+from unittest.mock import AsyncMock, MagicMock
+
+import aiosqlite
+import pytest
+import pytest_asyncio
+from aiogram import types
+from aiogram.exceptions import TelegramNetworkError
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+import scheduler_jobs
+from db import add_plan_to_db, add_plan_series, get_plan_series_by_id
+from job_store import SQLiteJobStore
+from plan_handlers import set_reminder_time_received
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def close_shared_reminders_db():
+    """Общее соединение напоминаний открывается к тестовой БД и закрывается после каждого теста."""
+    yield
+    await scheduler_jobs.close_reminders_db()
+
+
+@pytest.fixture(autouse=True)
+def no_coalesce_wait(monkeypatch):
+    monkeypatch.setattr(scheduler_jobs, "REMINDER_COALESCE_SECONDS", 0)
+
+
+def _start_scheduler(path: str) -> tuple[AsyncIOScheduler, SQLiteJobStore]:
+    store = SQLiteJobStore(path)
+    scheduler = AsyncIOScheduler(timezone=scheduler_jobs.user_timezone, jobstores={"reminders": store})
+    scheduler.start(paused=True)
+    return scheduler, store
+
+
+def _reminder_str(delta: datetime.timedelta) -> str:
+    return (datetime.datetime.now(scheduler_jobs.user_timezone) + delta).strftime("%Y-%m-%d %H:%M:%S")
+
+
+async def test_sqlite_job_store_keeps_jobs_between_restarts(tmp_path):
+    """Тест: задание напоминания сохраняется в SQLite и восстанавливается после перезапуска планировщика."""
+    path = str(tmp_path / "jobs.db")
+    run_date = datetime.datetime.now(scheduler_jobs.user_timezone) + datetime.timedelta(days=1)
+
+    scheduler, _ = _start_scheduler(path)
+    scheduler.add_job(scheduler_jobs.send_reminder_job, "date", run_date=run_date, args=[1, 7, "Тема", "Текст"],
+                      id="reminder_1_7", jobstore="reminders")
+    scheduler.shutdown(wait=False)
+
+    scheduler, store = _start_scheduler(path)
+    job = scheduler.get_job("reminder_1_7")
+    assert job.args == (1, 7, "Тема", "Текст")
+    assert store.get_job_ids() == {"reminder_1_7"}
+    assert abs((store.get_next_run_time() - run_date).total_seconds()) < 1
+    scheduler.remove_job("reminder_1_7")
+    assert store.get_job_ids() == set()
+    scheduler.shutdown(wait=False)
+
+
+async def test_startup_reconciles_reminders(db_conn, tmp_path, monkeypatch):
+    """Тест: при старте создаются только недостающие задания, лишние удаляются, просроченные помечаются одним UPDATE."""
+    scheduler, store = _start_scheduler(str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(scheduler_jobs, "scheduler", scheduler)
+    monkeypatch.setattr(scheduler_jobs, "reminders_jobstore", store)
+
+    expired_id = await add_plan_to_db(1, "2000-01-01", "Старый", "Текст", reminder_datetime=_reminder_str(-datetime.timedelta(hours=1)))
+    stored_id = await add_plan_to_db(1, "2099-01-01", "Сохраненный", "Текст", reminder_datetime=_reminder_str(datetime.timedelta(hours=3)))
+    missing_id = await add_plan_to_db(1, "2099-01-01", "Новый", "Текст", reminder_datetime=_reminder_str(datetime.timedelta(hours=5)))
+    future = datetime.datetime.now(scheduler_jobs.user_timezone) + datetime.timedelta(hours=3)
+    for job_id in (f"reminder_1_{stored_id}", "reminder_1_999"):
+        scheduler.add_job(scheduler_jobs.send_reminder_job, "date", run_date=future, args=[1, 0, "", ""],
+                          id=job_id, jobstore="reminders")
+
+    await scheduler_jobs.refresh_reminder_window()
+
+    assert store.get_job_ids() == {f"reminder_1_{stored_id}", f"reminder_1_{missing_id}"}
+    # Существующее задание не пересоздавалось
+    assert scheduler.get_job(f"reminder_1_{stored_id}").args == (1, 0, "", "")
+    async with aiosqlite.connect(db_conn) as db:
+        cursor = await db.execute("SELECT id FROM plans WHERE is_reminder_sent = 1")
+        assert [row[0] for row in await cursor.fetchall()] == [expired_id]
+    scheduler.shutdown(wait=False)
+
+
+async def test_reminder_window_only_materialises_near_reminders(db_conn, tmp_path, monkeypatch):
+    """Тест: задания создаются только для напоминаний внутри окна; перенесенные за окно удаляются."""
+    scheduler, store = _start_scheduler(str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(scheduler_jobs, "scheduler", scheduler)
+    monkeypatch.setattr(scheduler_jobs, "reminders_jobstore", store)
+    monkeypatch.setattr(scheduler_jobs, "REMINDER_HORIZON_HOURS", 24)
+
+    late_id = await add_plan_to_db(1, "2000-01-01", "Чуть опоздал", "Текст", reminder_datetime=_reminder_str(-datetime.timedelta(seconds=30)))
+    near_id = await add_plan_to_db(1, "2099-01-01", "Скоро", "Текст", reminder_datetime=_reminder_str(datetime.timedelta(hours=2)))
+    far_id = await add_plan_to_db(1, "2099-01-01", "Нескоро", "Текст", reminder_datetime=_reminder_str(datetime.timedelta(days=30)))
+    # Задание для плана, который потом перенесли за окно
+    scheduler_jobs.schedule_reminder(1, far_id, datetime.datetime.now(scheduler_jobs.user_timezone) + datetime.timedelta(hours=1))
+
+    await scheduler_jobs.refresh_reminder_window()
+
+    assert store.get_job_ids() == {f"reminder_1_{late_id}", f"reminder_1_{near_id}"}
+    run_date = datetime.datetime.now(scheduler_jobs.user_timezone) + datetime.timedelta(days=30)
+    assert scheduler_jobs.schedule_reminder(1, far_id, run_date) is False
+    assert scheduler.get_job(f"reminder_1_{near_id}").args == (1, near_id)
+    scheduler.shutdown(wait=False)
+
+
+async def test_reminder_reads_current_content_and_prefetches_neighbours(db_conn, monkeypatch):
+    """Тест: текст берется из БД в момент срабатывания; соседние напоминания загружаются тем же запросом."""
+    soon = _reminder_str(datetime.timedelta(seconds=20))
+    first_id = await add_plan_to_db(1, "2099-01-01", "Тема", "Старый текст", reminder_datetime=soon)
+    second_id = await add_plan_to_db(2, "2099-01-01", "Другая", "Текст", reminder_datetime=soon)
+    async with aiosqlite.connect(db_conn) as db:
+        await db.execute("UPDATE plans SET plan_text = 'Новый текст' WHERE id = ?", (first_id,))
+        await db.commit()
+
+    queries = []
+    original = scheduler_jobs.get_reminder_contents
+    async def counting_get_reminder_contents(*args):
+        queries.append(args[0])
+        return await original(*args)
+    monkeypatch.setattr(scheduler_jobs, "get_reminder_contents", counting_get_reminder_contents)
+    monkeypatch.setattr(scheduler_jobs, "_reminder_contents", {})
+    bot = MagicMock(send_message=AsyncMock())
+    monkeypatch.setattr(scheduler_jobs, "_bot_instance", bot)
+
+    await scheduler_jobs.send_reminder_job(1, first_id)
+    # Задание, сохраненное старой версией, передает лишние аргументы — они игнорируются
+    await scheduler_jobs.send_reminder_job(2, second_id, "Устаревшая тема", "Устаревший текст", None, None)
+
+    assert queries == [first_id]
+    texts = [call.kwargs["text"] for call in bot.send_message.call_args_list]
+    assert "Новый текст" in texts[0] and "Другая" in texts[1]
+
+
+async def test_failed_reminder_is_retried_dead_lettered_and_redelivered(db_conn, monkeypatch):
+    """Тест: временные ошибки повторяются; недоставленное напоминание уходит в dead-letter и доставляется повторно."""
+    plan_id = await add_plan_to_db(1, "2099-01-01", "Тема", "Текст", reminder_datetime=_reminder_str(datetime.timedelta(seconds=5)))
+    monkeypatch.setattr(scheduler_jobs, "REMINDER_SEND_RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(scheduler_jobs, "_reminder_contents", {})
+    monkeypatch.setattr(scheduler_jobs, "reminder_stats", dict.fromkeys(scheduler_jobs.reminder_stats, 0))
+    network_error = TelegramNetworkError(method=MagicMock(), message="timeout")
+    bot = MagicMock(send_message=AsyncMock(side_effect=network_error))
+    monkeypatch.setattr(scheduler_jobs, "_bot_instance", bot)
+
+    await scheduler_jobs.send_reminder_job(1, plan_id)
+
+    assert bot.send_message.await_count == scheduler_jobs.REMINDER_SEND_MAX_ATTEMPTS
+    async with aiosqlite.connect(db_conn) as db:
+        cursor = await db.execute("SELECT is_reminder_sent FROM plans WHERE id = ?", (plan_id,))
+        assert (await cursor.fetchone())[0] == 1
+    assert await scheduler_jobs.get_dead_letter_count() == 1
+
+    # Сеть вернулась: после одного сбоя сообщение уходит
+    bot.send_message = AsyncMock(side_effect=[network_error, None])
+    await scheduler_jobs.redeliver_failed_reminders()
+
+    assert await scheduler_jobs.get_dead_letter_count() == 0
+    stats = scheduler_jobs.reminder_stats
+    assert stats["dead_lettered"] == 1 and stats["redelivered"] == 1
+    assert stats["retries"] == (scheduler_jobs.REMINDER_SEND_MAX_ATTEMPTS - 1) + 1
+
+
+async def test_simultaneous_reminders_are_sent_as_one_message(db_conn, monkeypatch):
+    """Тест: напоминания одного пользователя на одно время приходят одним сообщением, фото — одним альбомом."""
+    monkeypatch.setattr(scheduler_jobs, "REMINDER_COALESCE_SECONDS", 0.05)
+    monkeypatch.setattr(scheduler_jobs, "_reminder_contents", {})
+    soon = _reminder_str(datetime.timedelta(seconds=10))
+    plan_ids = [await add_plan_to_db(1, "2099-01-01", f"Тема {i}", f"Текст {i}", reminder_datetime=soon) for i in range(3)]
+    async with aiosqlite.connect(db_conn) as db:
+        await db.executemany(
+            "INSERT INTO user_files (user_id, telegram_file_id, file_type, plan_id) VALUES (1, ?, 'photo', ?)",
+            [(f"photo_{plan_id}", plan_id) for plan_id in plan_ids[:2]],
+        )
+        await db.commit()
+    bot = MagicMock(send_message=AsyncMock(), send_photo=AsyncMock(), send_media_group=AsyncMock())
+    monkeypatch.setattr(scheduler_jobs, "_bot_instance", bot)
+
+    await asyncio.gather(*(scheduler_jobs.send_reminder_job(1, plan_id) for plan_id in plan_ids))
+
+    bot.send_message.assert_awaited_once()
+    text = bot.send_message.call_args.kwargs["text"]
+    assert all(f"Тема {i}" in text for i in range(3))
+    bot.send_media_group.assert_awaited_once()
+    assert len(bot.send_media_group.call_args.kwargs["media"]) == 2
+    bot.send_photo.assert_not_awaited()
+    async with aiosqlite.connect(db_conn) as db:
+        cursor = await db.execute("SELECT COUNT(*) FROM plans WHERE is_reminder_sent = 1")
+        assert (await cursor.fetchone())[0] == 3
+
+
+
+async def test_partially_sent_batch_dead_letters_only_undelivered_plans(db_conn, monkeypatch):
+    """Тест: если второе из сообщений пачки не ушло, в dead-letter попадают только его планы, без дублей первого."""
+    monkeypatch.setattr(scheduler_jobs, "REMINDER_SEND_RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(scheduler_jobs, "_reminder_contents", {})
+    soon = _reminder_str(datetime.timedelta(seconds=10))
+    long_text = "x" * 1500
+    plan_ids = [await add_plan_to_db(1, "2099-01-01", f"Тема {i}", long_text, reminder_datetime=soon) for i in range(4)]
+    contents = {plan_id: await scheduler_jobs.get_reminder_content(plan_id) for plan_id in plan_ids}
+    messages = scheduler_jobs._format_reminder_messages(contents)
+    assert len(messages) == 2
+    first_ids, second_ids = messages[0][1], messages[1][1]
+
+    network_error = TelegramNetworkError(method=MagicMock(), message="timeout")
+    bot = MagicMock(send_message=AsyncMock(side_effect=[None] + [network_error] * scheduler_jobs.REMINDER_SEND_MAX_ATTEMPTS))
+    monkeypatch.setattr(scheduler_jobs, "_bot_instance", bot)
+    await scheduler_jobs._deliver_and_record(1, contents)
+
+    async with aiosqlite.connect(db_conn) as db:
+        cursor = await db.execute("SELECT plan_id FROM reminder_dead_letters ORDER BY plan_id")
+        assert [row[0] for row in await cursor.fetchall()] == sorted(second_ids)
+
+    # При повторной отправке уходят только недоставленные планы
+    bot.send_message = AsyncMock()
+    await scheduler_jobs.redeliver_failed_reminders()
+    text = bot.send_message.call_args.kwargs["text"]
+    assert all(contents[plan_id]["topic"] in text for plan_id in second_ids)
+    assert not any(contents[plan_id]["topic"] in text for plan_id in first_ids)
+    assert await scheduler_jobs.get_dead_letter_count() == 0
+
+
+async def test_window_refresh_does_not_reschedule_reminder_being_delivered(db_conn, tmp_path, monkeypatch):
+    """Тест: обновление окна во время ожидания пачки не создает задание заново, напоминание приходит один раз."""
+    scheduler, store = _start_scheduler(str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(scheduler_jobs, "scheduler", scheduler)
+    monkeypatch.setattr(scheduler_jobs, "reminders_jobstore", store)
+    monkeypatch.setattr(scheduler_jobs, "REMINDER_COALESCE_SECONDS", 0.05)
+    monkeypatch.setattr(scheduler_jobs, "_reminder_contents", {})
+    plan_id = await add_plan_to_db(1, "2099-01-01", "Тема", "Текст", reminder_datetime=_reminder_str(datetime.timedelta(seconds=-1)))
+    bot = MagicMock(send_message=AsyncMock())
+    monkeypatch.setattr(scheduler_jobs, "_bot_instance", bot)
+
+    # Задание уже сработало и удалено планировщиком, план еще не отмечен отправленным
+    delivery = asyncio.create_task(scheduler_jobs.send_reminder_job(1, plan_id))
+    await asyncio.sleep(0)
+    await scheduler_jobs.refresh_reminder_window()
+    assert store.get_job_ids() == set()
+
+    await delivery
+    bot.send_message.assert_awaited_once()
+    assert scheduler_jobs._reminders_in_flight == set()
+    await scheduler_jobs.refresh_reminder_window()
+    assert store.get_job_ids() == set()
+    scheduler.shutdown(wait=False)
+
+async def test_auto_archive_works_in_batches_and_resumes(db_conn, monkeypatch):
+    """Тест: архивация идет пачками по диапазонам id, сохраняет прогресс и продолжает прерванный проход."""
+    monkeypatch.setattr(scheduler_jobs, "ARCHIVE_BATCH_SIZE", 2)
+    monkeypatch.setattr(scheduler_jobs, "ARCHIVE_PAUSE_SECONDS", 0)
+    old_ids = [await add_plan_to_db(1, "2000-01-01", f"Старый {i}", "Текст") for i in range(5)]
+    await add_plan_to_db(1, "2099-01-01", "Будущий", "Текст")
+
+    stats = await scheduler_jobs.auto_archive_old_plans()
+
+    assert stats["archived"] == 5 and stats["batches"] == 3
+    assert stats["max_lock_seconds"] > 0
+    async with aiosqlite.connect(db_conn) as db:
+        cursor = await db.execute("SELECT id FROM plans WHERE is_archived = 1 ORDER BY id")
+        assert [row[0] for row in await cursor.fetchall()] == old_ids
+        # Имитируем прерванный проход: позиция после второго плана, остальные еще не в архиве
+        await db.execute("UPDATE plans SET is_archived = 0")
+        await db.execute("UPDATE maintenance_progress SET last_id = ? WHERE task = 'archive_plans'", (old_ids[1],))
+        await db.commit()
+
+    stats = await scheduler_jobs.auto_archive_old_plans()
+
+    assert stats["archived"] == 3
+
+
+async def test_series_has_one_job_for_next_occurrence(db_conn, tmp_path, monkeypatch):
+    """Тест: у серии одно задание на ближайшее повторение; пропущенное сдвигается, после отправки ставится следующее."""
+    scheduler, store = _start_scheduler(str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(scheduler_jobs, "scheduler", scheduler)
+    monkeypatch.setattr(scheduler_jobs, "reminders_jobstore", store)
+    monkeypatch.setattr(scheduler_jobs, "REMINDER_HORIZON_HOURS", 24)
+    reminder_at = (datetime.datetime.now(scheduler_jobs.user_timezone) + datetime.timedelta(hours=1)).replace(second=0, microsecond=0, tzinfo=None)
+    week_ago = (reminder_at - datetime.timedelta(days=7)).date().isoformat()
+    series_id = await add_plan_series(
+        1, "Зарядка", "10 минут", "FREQ=DAILY", week_ago, reminder_time=reminder_at.strftime("%H:%M"),
+        next_reminder_datetime=(reminder_at - datetime.timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S"),
+    )
+
+    await scheduler_jobs.refresh_reminder_window()
+
+    assert store.get_job_ids() == {f"series_reminder_1_{series_id}"}
+    assert (await get_plan_series_by_id(1, series_id))["next_reminder_datetime"] == reminder_at.strftime("%Y-%m-%d %H:%M:%S")
+
+    bot = MagicMock(send_message=AsyncMock())
+    monkeypatch.setattr(scheduler_jobs, "_bot_instance", bot)
+    await scheduler_jobs.send_series_reminder_job(1, series_id)
+
+    assert "Зарядка" in bot.send_message.call_args.kwargs["text"]
+    next_reminder = reminder_at + datetime.timedelta(days=1)
+    assert (await get_plan_series_by_id(1, series_id))["next_reminder_datetime"] == next_reminder.strftime("%Y-%m-%d %H:%M:%S")
+    # Следующее повторение за окном: задание появится при очередном обновлении окна
+    assert store.get_job_ids() == set()
+
+    # Недоставленное напоминание серии уходит в dead-letter и отправляется повторно
+    monkeypatch.setattr(scheduler_jobs, "REMINDER_SEND_RETRY_BASE_DELAY", 0)
+    bot.send_message = AsyncMock(side_effect=TelegramNetworkError(method=MagicMock(), message="timeout"))
+    await scheduler_jobs.send_series_reminder_job(1, series_id)
+    assert await scheduler_jobs.get_dead_letter_count() == 1
+    bot.send_message = AsyncMock()
+    await scheduler_jobs.redeliver_failed_reminders()
+    assert "Зарядка" in bot.send_message.call_args.kwargs["text"]
+    assert await scheduler_jobs.get_dead_letter_count() == 0
+    scheduler.shutdown(wait=False)
+
+
+async def test_reminder_set_again_after_sending_survives_window_refresh(db_conn, tmp_path, monkeypatch, state, user):
+    """Тест: новое время напоминания для уже напомнившего плана снимает отметку об отправке и не удаляется окном."""
+    scheduler, store = _start_scheduler(str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(scheduler_jobs, "scheduler", scheduler)
+    monkeypatch.setattr(scheduler_jobs, "reminders_jobstore", store)
+    monkeypatch.setattr(scheduler_jobs, "REMINDER_HORIZON_HOURS", 48)
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    near_id = await add_plan_to_db(user.id, tomorrow.isoformat(), "Завтра", "Текст", reminder_datetime=_reminder_str(-datetime.timedelta(days=1)))
+    far_id = await add_plan_to_db(user.id, "2099-01-01", "Нескоро", "Текст", reminder_datetime=_reminder_str(-datetime.timedelta(days=1)))
+    async with aiosqlite.connect(db_conn) as db:
+        await db.execute("UPDATE plans SET is_reminder_sent = 1")
+        await db.commit()
+    message = AsyncMock(spec=types.Message, from_user=user)
+    message.answer = AsyncMock()
+
+    for plan_id, plan_date in ((near_id, tomorrow.isoformat()), (far_id, "2099-01-01")):
+        await state.update_data(plan_id=plan_id, plan_date=plan_date)
+        message.text = "10:00"
+        await set_reminder_time_received(message, state)
+    await scheduler_jobs.refresh_reminder_window()
+
+    assert store.get_job_ids() == {f"reminder_{user.id}_{near_id}"}
+    async with aiosqlite.connect(db_conn) as db:
+        cursor = await db.execute("SELECT id, reminder_datetime, is_reminder_sent FROM plans ORDER BY id")
+        assert await cursor.fetchall() == [
+            (near_id, f"{tomorrow.isoformat()} 10:00:00", 0), (far_id, "2099-01-01 10:00:00", 0),
+        ]
+
+    await state.update_data(plan_id=near_id, plan_date=tomorrow.isoformat())
+    message.text = "нет"
+    await set_reminder_time_received(message, state)
+    assert store.get_job_ids() == set()
+    scheduler.shutdown(wait=False)
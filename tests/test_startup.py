@@ -0,0 +1,39 @@
+# tests/test_startup.py
+import os
+import subprocess
+import sys
+
+import pytest
+
+import warmup
+from warmup import warm_up
+
+HEAVY_MODULES = ["google.generativeai", "reportlab", "fitz", "docx", "nltk", "PIL", "bs4", "lxml", "pyzbar", "pyarrow"]
+
+
+def test_importing_main_does_not_load_heavy_libraries():
+    """Тест: запуск бота (импорт main) не тянет тяжелые библиотеки — они грузятся лениво или в фоне."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, TELEGRAM_BOT_TOKEN="123:abc", GEMINI_API_KEY="x", OWNER_TELEGRAM_ID="1")
+    code = f"import sys, main; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=root, env=env, capture_output=True, text=True, timeout=120)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1:] in ([], [""])
+
+
+@pytest.mark.asyncio
+async def test_warm_up_survives_failing_step(monkeypatch):
+    """Тест: ошибка одного шага прогрева не мешает остальным."""
+    calls = []
+
+    def broken():
+        raise ImportError("нет библиотеки")
+
+    monkeypatch.setattr("warmup.WARMUP_STEPS", [("сломанный", broken), ("рабочий", lambda: calls.append(1))])
+    monkeypatch.setattr("warmup.warmup_stats", {})
+
+    await warm_up(delay=0)
+
+    assert calls == [1]
+    assert list(warmup.warmup_stats) == ["рабочий"]
@@ -0,0 +1,56 @@
+# warmup.py
+"""
+Фоновый прогрев тяжелых библиотек после запуска бота.
+Модули с ReportLab, PyMuPDF, python-docx, NLTK, Pillow, lxml/bs4 и Gemini импортируются
+лениво, поэтому бот начинает отвечать сразу. Чтобы первый отчет или первый чек
+не ждали импорта, через WARMUP_DELAY_SECONDS после старта они загружаются в отдельном
+потоке. Ошибка прогрева не мешает работе: модуль загрузится при первом использовании.
+"""
+import asyncio
+import importlib
+import time
+
+from config import logger, WARMUP_DELAY_SECONDS
+
+
+def _load_pdf_render():
+    importlib.import_module("pdf_render")
+
+def _load_document_parsers():
+    from file_processing import ensure_nltk_punkt
+    importlib.import_module("fitz")
+    importlib.import_module("docx")
+    ensure_nltk_punkt()
+    importlib.import_module("nltk.tokenize")
+
+def _load_receipt_parsers():
+    importlib.import_module("lxml.html")
+    importlib.import_module("bs4")
+    importlib.import_module("PIL.Image")
+
+def _load_llm_backend():
+    from llm_client import llm_client
+    llm_client.backend
+
+WARMUP_STEPS = [
+    ("PDF-отчеты", _load_pdf_render),
+    ("документы", _load_document_parsers),
+    ("чеки", _load_receipt_parsers),
+    ("ИИ", _load_llm_backend),
+]
+
+# Сколько секунд занял каждый шаг прогрева
+warmup_stats = {}
+
+
+async def warm_up(delay: float = WARMUP_DELAY_SECONDS):
+    await asyncio.sleep(delay)
+    for name, step in WARMUP_STEPS:
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(step)
+        except Exception as e:
+            logger.warning(f"Прогрев '{name}' не удался: {e}")
+            continue
+        warmup_stats[name] = time.perf_counter() - started
+    logger.info("Прогрев завершен: " + ", ".join(f"{name} {seconds:.2f} с" for name, seconds in warmup_stats.items()))